@@ -34,6 +34,15 @@ setup(
             'pyspark==3.2.1',
             'pyarrow==9.0.0',
             'python-dotenv==0.21.0'
+        ],
+        "parquet": [
+            'pyarrow==9.0.0'
+        ],
+        "validation": [
+            'fastjsonschema==2.16.2'
+        ],
+        "zstd": [
+            'zstandard==0.19.0'
         ]
     },
     entry_points="""
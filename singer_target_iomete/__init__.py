@@ -6,17 +6,27 @@ import json
 import os
 import sys
 import copy
+import itertools
 
-from typing import Dict
+from collections.abc import Mapping
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from functools import partial
+from typing import Callable, Dict, Iterator, List
 from joblib import Parallel, delayed, parallel_backend
-from jsonschema import Draft7Validator, FormatChecker
 from singer import get_logger
 from datetime import datetime, timedelta
 
 from singer_target_iomete.utils import stream_utils
-from singer_target_iomete.file_formats import csv_format
-
-from singer_target_iomete.db_sync import DbSync
+from singer_target_iomete.utils.background_flush import BackgroundFlusher
+from singer_target_iomete.utils.batch_stats import BatchStats
+from singer_target_iomete.utils.catalog_cache import CatalogCache
+from singer_target_iomete.utils.commit_coalescer import CommitCoalescer
+from singer_target_iomete.utils.disk_buffer import DiskBuffer
+from singer_target_iomete.utils.flush_pipeline import FlushPipeline
+from singer_target_iomete.utils.record_validator import RecordValidator
+from singer_target_iomete.utils.stage_cleaner import close_stage_cleaners
+
+from singer_target_iomete.db_sync import DbSync, close_connection_pools
 from singer_target_iomete.utils.exceptions import (
     RecordValidationException,
     UnexpectedValueTypeException,
@@ -28,6 +38,9 @@ LOGGER = get_logger('target_iomete')
 DEFAULT_BATCH_SIZE_ROWS = 100000
 DEFAULT_PARALLELISM = 0  # 0 The number of threads used to flush tables
 DEFAULT_MAX_PARALLELISM = 16  # Don't use more than this number of threads by default when flushing streams in parallel
+DEFAULT_MAX_INFLIGHT_BATCHES = 2  # Max number of flushes running or waiting in the background with async_flush
+DEFAULT_MAX_PIPELINE_BATCHES = 32  # Max number of batches between the serialize and load stages with flush_pipeline
+PART_FILE_UPLOAD_PARALLELISM = 4  # Max number of part files of a batch completing their upload in the background
 
 
 def add_metadata_columns_to_schema(schema_message):
@@ -56,12 +69,13 @@ def emit_state(state):
 
 
 # pylint: disable=too-many-locals,too-many-branches,too-many-statements,invalid-name
-def persist_lines(config, lines) -> None:
+def persist_lines(config, lines, catalog_cache=None) -> None:
     """Main loop to read and consume singer messages from stdin
 
     Params:
         config: configuration dictionary
         lines: iterable of singer messages
+        catalog_cache: optional CatalogCache of the target schemas
 
     Returns:
         tuple of retrieved items
@@ -73,12 +87,32 @@ def persist_lines(config, lines) -> None:
     validators = {}
     records_to_load = {}
     row_count = {}
+    buffer_bytes = {}
+    batch_stats = {}
     stream_to_sync = {}
-    total_row_count = {}
     batch_size_rows = config.get('batch_size_rows', DEFAULT_BATCH_SIZE_ROWS)
+    batch_size_bytes = config.get('batch_size_bytes', None)
+    max_buffer_bytes = config.get('max_buffer_bytes', None)
     batch_wait_limit_seconds = config.get('batch_wait_limit_seconds', None)
     flush_timestamp = datetime.utcnow()
 
+    # Optionally load batches on a background thread while reading further messages. The flush pipeline
+    # implies it, otherwise every flush would wait for the load of its batches before the next one starts
+    flusher = None
+    if config.get('async_flush') or config.get('flush_pipeline'):
+        flusher = BackgroundFlusher(emit_state,
+                                    config.get('max_inflight_batches', DEFAULT_MAX_INFLIGHT_BATCHES))
+
+    # Optionally overlap serialization, upload and load of consecutive batches
+    pipeline = None
+    if config.get('flush_pipeline'):
+        pipeline = create_flush_pipeline(config)
+
+    # Optionally load the staged batches of several flushes in a single commit
+    coalescer = None
+    if config.get('commit_interval_seconds') or config.get('commit_max_files'):
+        coalescer = CommitCoalescer(config.get('commit_interval_seconds'), config.get('commit_max_files'))
+
     # Loop over lines from stdin
     for line in lines:
 
@@ -103,12 +137,12 @@ def persist_lines(config, lines) -> None:
             # Get schema for this record's stream
             stream = o['stream']
 
-            stream_utils.adjust_timestamps_in_record(o['record'], schemas[stream])
+            stream_to_sync[stream].record_plan.adjust_timestamps(o['record'])
 
             # Validate record
             if config.get('validate_records'):
                 try:
-                    validators[stream].validate(stream_utils.float_to_decimal(o['record']))
+                    validators[stream].validate(o['record'])
                 except Exception as ex:
                     if type(ex).__name__ == "InvalidOperation":
                         raise InvalidValidationOperationException(
@@ -118,42 +152,80 @@ def persist_lines(config, lines) -> None:
                     raise RecordValidationException(f"Record does not pass schema validation. RECORD: {o['record']}") \
                         from ex
 
-            primary_key_string = stream_to_sync[stream].record_primary_key_string(o['record'])
-            if not primary_key_string:
-                primary_key_string = f'RID-{total_row_count[stream]}'
-
-            if stream not in records_to_load:
-                records_to_load[stream] = {}
+            primary_key = stream_to_sync[stream].record_primary_key(o['record'])
+            if primary_key == '':
+                # an empty primary key doesn't match any other record
+                primary_key = object()
 
-            # increment row count only when a new PK is encountered in the current batch
-            if primary_key_string not in records_to_load[stream]:
+            if config.get('add_metadata_columns') or config.get('hard_delete'):
+                record = stream_utils.add_metadata_values_to_record(o)
+            else:
+                record = o['record']
+            batch_stats[stream].update(record)
+
+            if config.get('buffer_serialized_rows'):
+                # keep only the row of the staged file, much smaller than the record
+                record = stream_to_sync[stream].serialize_record(record)
+
+            if primary_key is None:
+                # records without primary key are never deduplicated, append them to a list
+                if not records_to_load.get(stream):
+                    records_to_load[stream] = []
+                records_to_load[stream].append(record)
                 row_count[stream] += 1
-                total_row_count[stream] += 1
+            else:
+                if stream not in records_to_load:
+                    records_to_load[stream] = {}
 
-            # append record
-            if config.get('add_metadata_columns') or config.get('hard_delete'):
-                records_to_load[stream][primary_key_string] = stream_utils.add_metadata_values_to_record(o)
+                # increment row count only when a new PK is encountered in the current batch
+                if primary_key not in records_to_load[stream]:
+                    row_count[stream] += 1
+                records_to_load[stream][primary_key] = record
+
+            # The size of the message is a cheap estimate of the size of the buffered record
+            buffer_bytes[stream] = buffer_bytes.get(stream, 0) + (len(record) if isinstance(record, bytes)
+                                                                  else len(line))
+
+            # flush all streams, delete records if needed, reset counts and then emit current state
+            if config.get('flush_all_streams'):
+                filter_streams = None
             else:
-                records_to_load[stream][primary_key_string] = o['record']
+                filter_streams = [stream]
 
             flush = False
             if row_count[stream] >= batch_size_rows:
                 flush = True
                 LOGGER.info("Flush triggered by batch_size_rows (%s) reached in %s",
                             batch_size_rows, stream)
+            elif batch_size_bytes and buffer_bytes[stream] >= batch_size_bytes:
+                flush = True
+                LOGGER.info("Flush triggered by batch_size_bytes (%s) reached in %s",
+                            batch_size_bytes, stream)
             elif (batch_wait_limit_seconds and
                   datetime.utcnow() >= (flush_timestamp + timedelta(seconds=batch_wait_limit_seconds))):
                 flush = True
                 LOGGER.info("Flush triggered by batch_wait_limit_seconds (%s)",
                             batch_wait_limit_seconds)
+            elif max_buffer_bytes:
+                # Buffers spilled to disk don't count towards the memory budget
+                memory_buffer_bytes = {s: size for (s, size) in buffer_bytes.items()
+                                       if size > 0 and not isinstance(records_to_load.get(s), DiskBuffer)}
+                if sum(memory_buffer_bytes.values()) >= max_buffer_bytes:
+                    largest_streams = select_largest_buffers(memory_buffer_bytes, max_buffer_bytes // 2)
+                    if config.get('spill_to_disk'):
+                        for largest_stream in largest_streams:
+                            LOGGER.info("Buffer of %s spilled to disk by max_buffer_bytes (%s)",
+                                        largest_stream, max_buffer_bytes)
+                            records_to_load[largest_stream] = DiskBuffer(records_to_load[largest_stream],
+                                                                         config.get('temp_dir'))
+                    else:
+                        flush = True
+                        if filter_streams:
+                            filter_streams = largest_streams
+                        LOGGER.info("Flush triggered by max_buffer_bytes (%s) reached",
+                                    max_buffer_bytes)
 
             if flush:
-                # flush all streams, delete records if needed, reset counts and then emit current state
-                if config.get('flush_all_streams'):
-                    filter_streams = None
-                else:
-                    filter_streams = [stream]
-
                 # Flush and return a new state dict with new positions only for the flushed streams
                 flushed_state = flush_streams(
                     records_to_load,
@@ -162,12 +234,21 @@ def persist_lines(config, lines) -> None:
                     config,
                     state,
                     flushed_state,
-                    filter_streams=filter_streams)
+                    filter_streams=filter_streams,
+                    flusher=flusher,
+                    pipeline=pipeline,
+                    batch_stats=batch_stats,
+                    buffer_bytes=buffer_bytes,
+                    coalescer=coalescer)
 
                 flush_timestamp = datetime.utcnow()
 
-                # emit last encountered state
-                emit_state(copy.deepcopy(flushed_state))
+                # emit last encountered state, the background flusher emits it once the batch is loaded
+                # and the coalescer once the batch is committed
+                if coalescer:
+                    emit_state(coalescer.take_committed_state())
+                elif not flusher:
+                    emit_state(copy.deepcopy(flushed_state))
 
         elif t == 'SCHEMA':
             if 'stream' not in o:
@@ -181,7 +262,7 @@ def persist_lines(config, lines) -> None:
             if stream not in schemas or schemas[stream] != new_schema:
 
                 schemas[stream] = new_schema
-                validators[stream] = Draft7Validator(schemas[stream], format_checker=FormatChecker())
+                validators[stream] = RecordValidator(o['schema'], config.get('validate_records_sample_rate', 1.0))
 
                 # flush records from previous stream SCHEMA
                 # if same stream has been encountered again, it means the schema might have been altered
@@ -192,10 +273,23 @@ def persist_lines(config, lines) -> None:
                                                   stream_to_sync,
                                                   config,
                                                   state,
-                                                  flushed_state)
+                                                  flushed_state,
+                                                  flusher=flusher,
+                                                  pipeline=pipeline,
+                                                  batch_stats=batch_stats,
+                                                  buffer_bytes=buffer_bytes,
+                                                  coalescer=coalescer)
 
                     # emit latest encountered state
-                    emit_state(flushed_state)
+                    if not flusher and not coalescer:
+                        emit_state(flushed_state)
+
+                # the target table can be altered only when no batch of the previous schema is in flight
+                if flusher:
+                    flusher.wait()
+                if coalescer and coalescer.has_pending(stream):
+                    commit_streams(coalescer, config, flushed_state)
+                    emit_state(coalescer.take_committed_state())
 
                 # key_properties key must be available in the SCHEMA message.
                 if 'key_properties' not in o:
@@ -217,15 +311,16 @@ def persist_lines(config, lines) -> None:
 
                 if config.get('add_metadata_columns') or config.get('hard_delete'):
                     stream_to_sync[stream] = DbSync(config,
-                                                    add_metadata_columns_to_schema(o))
+                                                    add_metadata_columns_to_schema(o),
+                                                    catalog_cache)
                 else:
-                    stream_to_sync[stream] = DbSync(config, o)
+                    stream_to_sync[stream] = DbSync(config, o, catalog_cache)
 
                 stream_to_sync[stream].create_schema_if_not_exists()
                 stream_to_sync[stream].sync_table()
+                batch_stats[stream] = stream_to_sync[stream].new_batch_stats()
 
                 row_count[stream] = 0
-                total_row_count[stream] = 0
 
         elif t == 'ACTIVATE_VERSION':
             LOGGER.debug('ACTIVATE_VERSION message')
@@ -245,7 +340,24 @@ def persist_lines(config, lines) -> None:
     # then flush all buckets.
     if sum(row_count.values()) > 0:
         # flush all streams one last time, delete records if needed, reset counts and then emit current state
-        flushed_state = flush_streams(records_to_load, row_count, stream_to_sync, config, state, flushed_state)
+        flushed_state = flush_streams(records_to_load, row_count, stream_to_sync, config, state, flushed_state,
+                                      flusher=flusher, pipeline=pipeline, batch_stats=batch_stats,
+                                      buffer_bytes=buffer_bytes, coalescer=coalescer)
+
+    # load the batches waiting for their commit, their state is emitted below
+    if coalescer:
+        commit_streams(coalescer, config, flushed_state)
+        coalescer.take_committed_state()
+
+    # wait for the batches in flight, they emit their own states
+    if flusher:
+        flusher.close()
+    if pipeline:
+        pipeline.shutdown()
+
+    # wait for the deletion of the loaded staged files and release the iomete sessions
+    close_stage_cleaners()
+    close_connection_pools()
 
     # emit latest state
     emit_state(copy.deepcopy(flushed_state))
@@ -259,7 +371,12 @@ def flush_streams(
         config,
         state,
         flushed_state,
-        filter_streams=None):
+        filter_streams=None,
+        flusher=None,
+        pipeline=None,
+        batch_stats=None,
+        buffer_bytes=None,
+        coalescer=None):
     """
     Flushes all buckets and resets records count to 0 as well as empties records to load list
     :param streams: dictionary with records to load per stream
@@ -269,44 +386,59 @@ def flush_streams(
     :param state: dictionary containing the original state from tap
     :param flushed_state: dictionary containing updated states only when streams got flushed
     :param filter_streams: Keys of streams to flush from the streams dict. Default is every stream
+    :param flusher: BackgroundFlusher to hand the batches over to. Default is loading them inline
+    :param pipeline: FlushPipeline to run the batches through, used with the flusher. Default is loading them stage by stage
+    :param batch_stats: dictionary with BatchStats of the buffered records per stream
+    :param buffer_bytes: dictionary with estimated size of the buffered records per stream
+    :param coalescer: CommitCoalescer collecting the staged batches until their commit. Default is loading every batch
     :return: State dict with flushed positions
     """
-    parallelism = config.get("parallelism", DEFAULT_PARALLELISM)
-    max_parallelism = config.get("max_parallelism", DEFAULT_MAX_PARALLELISM)
-
-    # Parallelism 0 means auto parallelism:
-    #
-    # Auto parallelism trying to flush streams efficiently with auto defined number
-    # of threads where the number of threads is the number of streams that need to
-    # be loaded but it's not greater than the value of max_parallelism
-    if parallelism == 0:
-        n_streams_to_flush = len(streams.keys())
-        if n_streams_to_flush > max_parallelism:
-            parallelism = max_parallelism
-        else:
-            parallelism = n_streams_to_flush
-
     # Select the required streams to flush
     if filter_streams:
         streams_to_flush = filter_streams
     else:
-        streams_to_flush = streams.keys()
-
-    # Single-host, thread-based parallelism
-    with parallel_backend('threading', n_jobs=parallelism):
-        Parallel()(delayed(load_stream_batch)(
-            stream=stream,
-            records=streams[stream],
-            row_count=row_count,
-            db_sync=stream_to_sync[stream],
-            no_compression=config.get('no_compression'),
-            delete_rows=config.get('hard_delete'),
-            temp_dir=config.get('temp_dir')
-        ) for stream in streams_to_flush)
+        streams_to_flush = list(streams.keys())
+
+    if batch_stats is None:
+        batch_stats = {}
+
+    load_job = None
+    if flusher and pipeline:
+        # Send the full buffers into the pipeline, the next stages run while the main loop continues
+        batch_futures = [
+            pipeline.submit(stream, {
+                'stream': stream,
+                'records': streams[stream],
+                'db_sync': stream_to_sync[stream],
+                'temp_dir': config.get('temp_dir'),
+                'no_compression': config.get('no_compression'),
+                'batch_stats': batch_stats.get(stream)
+            })
+            for stream in streams_to_flush if row_count[stream] > 0
+        ]
+        for stream in streams_to_flush:
+            row_count[stream] = 0
+        load_job = partial(wait_for_batches, batch_futures)
+    elif flusher:
+        # Hand the full buffers over to the background flusher and start filling fresh ones right away
+        batches = {stream: streams[stream] for stream in streams_to_flush}
+        batches_row_count = {stream: row_count[stream] for stream in streams_to_flush}
+        batches_db_sync = {stream: stream_to_sync[stream] for stream in streams_to_flush}
+        batches_stats = {stream: batch_stats.get(stream) for stream in streams_to_flush}
+        for stream in streams_to_flush:
+            row_count[stream] = 0
+        load_job = partial(load_streams, batches, batches_row_count, batches_db_sync, config, streams_to_flush,
+                           batches_stats)
+    else:
+        load_streams(streams, row_count, stream_to_sync, config, streams_to_flush, batch_stats, coalescer)
 
     # reset flushed stream records to empty to avoid flushing same records
     for stream in streams_to_flush:
         streams[stream] = {}
+        if buffer_bytes is not None:
+            buffer_bytes[stream] = 0
+        if stream in batch_stats:
+            batch_stats[stream] = stream_to_sync[stream].new_batch_stats()
 
         # Update flushed streams
         if filter_streams:
@@ -322,20 +454,75 @@ def flush_streams(
         else:
             flushed_state = copy.deepcopy(state)
 
+    # The state is emitted by the flusher once the batches and every batch before them got loaded
+    if load_job:
+        flusher.submit(load_job, copy.deepcopy(flushed_state))
+
+    # The staged batches are loaded once their commit is due, the state is emitted after
+    if coalescer and coalescer.is_due():
+        commit_streams(coalescer, config, flushed_state)
+
     # Return with state message with flushed positions
     return flushed_state
 
 
-def load_stream_batch(stream, records, row_count, db_sync, no_compression=False, delete_rows=False,
-                      temp_dir=None):
+def select_largest_buffers(buffer_bytes: Dict, max_bytes: int) -> List[str]:
+    """Select the streams with the largest buffers until the rest of the buffers fit into max_bytes"""
+    selected = []
+    remaining_bytes = sum(buffer_bytes.values())
+    for stream in sorted(buffer_bytes, key=buffer_bytes.get, reverse=True):
+        if remaining_bytes <= max_bytes:
+            break
+        selected.append(stream)
+        remaining_bytes -= buffer_bytes[stream]
+    return selected
+
+
+def flush_parallelism(config, n_streams_to_flush):
+    """Number of threads flushing n_streams_to_flush streams"""
+    parallelism = config.get("parallelism", DEFAULT_PARALLELISM)
+    max_parallelism = config.get("max_parallelism", DEFAULT_MAX_PARALLELISM)
+
+    # Parallelism 0 means auto parallelism:
+    #
+    # Auto parallelism trying to flush streams efficiently with auto defined number
+    # of threads where the number of threads is the number of streams that need to
+    # be loaded but it's not greater than the value of max_parallelism
+    if parallelism == 0:
+        if n_streams_to_flush > max_parallelism:
+            parallelism = max_parallelism
+        else:
+            parallelism = n_streams_to_flush
+
+    return parallelism
+
+
+def load_streams(streams, row_count, stream_to_sync, config, streams_to_flush, batch_stats=None, coalescer=None):
+    """Load the batches of the selected streams into iomete, in parallel"""
+    if batch_stats is None:
+        batch_stats = {}
+
+    # Single-host, thread-based parallelism
+    with parallel_backend('threading', n_jobs=flush_parallelism(config, len(streams.keys()))):
+        Parallel()(delayed(load_stream_batch)(
+            stream=stream,
+            records=streams[stream],
+            row_count=row_count,
+            db_sync=stream_to_sync[stream],
+            no_compression=config.get('no_compression'),
+            temp_dir=config.get('temp_dir'),
+            batch_stats=batch_stats.get(stream),
+            coalescer=coalescer
+        ) for stream in streams_to_flush)
+
+
+# pylint: disable=too-many-arguments
+def load_stream_batch(stream, records, row_count, db_sync, no_compression=False, temp_dir=None, batch_stats=None,
+                      coalescer=None):
     """Load one batch of the stream into target table"""
-    # Load into iomete
+    # Load into iomete, rows flagged as deleted are deleted by the load itself if hard_delete is enabled
     if row_count[stream] > 0:
-        flush_records(stream, records, db_sync, temp_dir, no_compression)
-
-        # Delete soft-deleted, flagged rows - where _sdc_deleted at is not null
-        if delete_rows:
-            db_sync.delete_rows(stream)
+        flush_records(stream, records, db_sync, temp_dir, no_compression, batch_stats, coalescer)
 
         # reset row count for the current stream
         row_count[stream] = 0
@@ -345,7 +532,9 @@ def flush_records(stream: str,
                   records: Dict,
                   db_sync: DbSync,
                   temp_dir: str = None,
-                  no_compression: bool = False) -> None:
+                  no_compression: bool = False,
+                  batch_stats: BatchStats = None,
+                  coalescer: CommitCoalescer = None) -> None:
     """
     Takes a list of record messages and loads it into the iomete target table
 
@@ -357,31 +546,206 @@ def flush_records(stream: str,
         db_sync: A DbSync object
         temp_dir: Directory where intermediate temporary files will be created. (Default: OS specific temp directory)
         no_compression: Disable to use compressed files. (Default: False)
+        batch_stats: Statistics of the records, used to pick the load statement. (Default: None)
+        coalescer: Stage the batch for the next commit of the stream instead of loading it. (Default: None)
 
     Returns:
         None
     """
-    # Generate file on disk in the required format
-    filepath = csv_format.records_to_file(records,
-                                          db_sync.flatten_schema,
-                                          compression=not no_compression,
-                                          dest_dir=temp_dir,
-                                          data_flattening_max_level=
-                                          db_sync.data_flattening_max_level)
+    batch = {
+        'stream': stream,
+        'records': records,
+        'db_sync': db_sync,
+        'temp_dir': temp_dir,
+        'no_compression': no_compression,
+        'batch_stats': batch_stats
+    }
+    if coalescer:
+        batch['key_prefix'] = coalescer.batch_key_prefix(stream, db_sync)
+        coalescer.add(stream, upload_batch(serialize_batch(batch)))
+    else:
+        load_batch(upload_batch(serialize_batch(batch)))
 
-    # Get file stats
-    row_count = len(records)
-    size_bytes = os.path.getsize(filepath)
 
-    # Upload to s3 and load into iomete
-    s3_key = db_sync.put_to_stage(filepath, stream, row_count, temp_dir=temp_dir)
-    db_sync.load_file(s3_key, row_count, size_bytes)
+def split_records(records, rows_per_file: Callable) -> Iterator[list]:
+    """
+    Split the records of a batch into the records of its part files, one part at a time
+
+    Args:
+        records: Dictionary of record messages or list of records without primary key
+        rows_per_file: Function returning the number of records of the next part
+    """
+    iterator = iter(records.values() if isinstance(records, Mapping) else records)
+    while True:
+        part = list(itertools.islice(iterator, rows_per_file()))
+        if not part:
+            return
+        yield part
 
-    # Delete file from local disk
-    os.remove(filepath)
 
-    # Delete file from S3
-    db_sync.delete_from_stage(stream, s3_key)
+def serialize_batch(batch: Dict) -> Dict:
+    """
+    Flush stage: generate the staged files of a batch in the required format, streamed to the s3 stage
+    while they are written or written to local disk if stage_on_disk is enabled
+    """
+    db_sync = batch['db_sync']
+    file_format = db_sync.file_format
+    records = batch['records']
+    options = {
+        'compression': 'none' if batch['no_compression'] else db_sync.compression_codec(len(records)),
+        'compression_level': db_sync.compression_level,
+        'data_flattening_max_level': db_sync.data_flattening_max_level,
+        'record_plan': db_sync.record_plan
+    }
+    # Records buffered as encoded rows are written as they are
+    if db_sync.buffer_serialized_rows:
+        options['serialized_rows'] = True
+    # Large CSV files are compressed on multiple threads
+    if db_sync.compression_threads > 1:
+        options['compression_threads'] = db_sync.compression_threads
+    file_suffix = file_format.file_suffix(options['compression'])
+
+    rows_per_file = db_sync.rows_per_file()
+    if rows_per_file is None or len(records) <= rows_per_file:
+        batch['s3_key'] = db_sync.stage_file_key(batch['stream'], file_suffix, batch.get('key_prefix'))
+        parts = [(batch['s3_key'], records)]
+    else:
+        # Large batches are split into part files under a common prefix, iomete reads them in parallel
+        prefix = db_sync.stage_file_key(batch['stream'], '', batch.get('key_prefix'))
+        batch['s3_key'] = f'{prefix}/'
+        # The part files of a coalesced batch stay next to the files of the other batches of the commit
+        separator = '_' if batch.get('key_prefix') else '/'
+        parts = ((f'{prefix}{separator}part_{i:05d}{file_suffix}', part)
+                 for (i, part) in enumerate(split_records(records, db_sync.rows_per_file)))
+
+    batch['files'] = []
+    try:
+        # Uploads of the streamed part files are completed in the background while the next part is written
+        with ThreadPoolExecutor(max_workers=PART_FILE_UPLOAD_PARALLELISM, thread_name_prefix='stage') as uploads:
+            closing = []
+            try:
+                for s3_key, part in parts:
+                    staged_file = {'s3_key': s3_key, 'row_count': len(part)}
+                    batch['files'].append(staged_file)
+                    if db_sync.stage_on_disk:
+                        staged_file['filepath'] = file_format.records_to_file(part, db_sync.flatten_schema,
+                                                                              dest_dir=batch['temp_dir'], **options)
+                        staged_file['size_bytes'] = os.path.getsize(staged_file['filepath'])
+                    else:
+                        stage = db_sync.open_stage_stream(s3_key)
+                        try:
+                            file_format.records_to_fileobj(part, db_sync.flatten_schema, stage, **options)
+                        except Exception:
+                            stage.abort()
+                            raise
+                        staged_file['size_bytes'] = stage.tell()
+                        closing.append(uploads.submit(stage.close))
+                    db_sync.track_staged_file(staged_file['row_count'], staged_file['size_bytes'])
+                for future in closing:
+                    future.result()
+            except Exception:
+                wait(closing)
+                discard_staged_files(batch)
+                raise
+    finally:
+        # Records spilled to disk are released as soon as they are written
+        if isinstance(records, DiskBuffer):
+            records.close()
+
+    batch['row_count'] = sum(staged_file['row_count'] for staged_file in batch['files'])
+    batch['size_bytes'] = sum(staged_file['size_bytes'] for staged_file in batch['files'])
+
+    # The records are not needed anymore, release them while the batch waits for the next stages
+    batch['records'] = None
+    return batch
+
+
+def upload_batch(batch: Dict) -> Dict:
+    """Flush stage: upload the files of a batch written to local disk to s3 and delete them from local disk"""
+    # Streamed files are already on the s3 stage
+    for staged_file in batch['files']:
+        if staged_file.get('filepath') is not None:
+            batch['db_sync'].put_to_stage(staged_file['filepath'],
+                                          batch['stream'],
+                                          staged_file['row_count'],
+                                          temp_dir=batch['temp_dir'],
+                                          s3_key=staged_file['s3_key'])
+            os.remove(staged_file['filepath'])
+    return batch
+
+
+def discard_staged_files(batch: Dict) -> None:
+    """Delete the files of a failed batch from local disk and from the s3 stage"""
+    for staged_file in batch['files']:
+        if not batch['db_sync'].stage_on_disk:
+            batch['db_sync'].delete_from_stage(batch['stream'], staged_file['s3_key'])
+        elif staged_file.get('filepath') and os.path.exists(staged_file['filepath']):
+            os.remove(staged_file['filepath'])
+
+
+def load_batch(batch: Dict) -> Dict:
+    """Flush stage: load the uploaded files of a batch into iomete and delete them from s3"""
+    db_sync = batch['db_sync']
+    db_sync.load_file(batch['s3_key'], batch['row_count'], batch['size_bytes'], batch.get('batch_stats'))
+    for staged_file in batch['files']:
+        db_sync.delete_from_stage(batch['stream'], staged_file['s3_key'])
+    return batch
+
+
+def commit_streams(coalescer: CommitCoalescer, config, flushed_state) -> None:
+    """Load the batches waiting in the coalescer with a single load per stream, in parallel"""
+    commits = coalescer.take()
+    if commits:
+        with parallel_backend('threading', n_jobs=flush_parallelism(config, len(commits))):
+            Parallel()(delayed(load_commit)(commit) for commit in commits.values())
+
+    # Every batch flushed so far is loaded
+    coalescer.committed_state = copy.deepcopy(flushed_state)
+
+
+def load_commit(commit: Dict) -> None:
+    """Load the files of the staged batches of a stream from their commit prefix and delete them from s3"""
+    batches = commit['batches']
+    db_sync = batches[0]['db_sync']
+
+    batch_stats = None
+    if all(batch.get('batch_stats') is not None for batch in batches):
+        batch_stats = db_sync.new_batch_stats()
+        for batch in batches:
+            batch_stats.merge(batch['batch_stats'])
+
+    db_sync.load_file(commit['s3_key'],
+                      sum(batch['row_count'] for batch in batches),
+                      sum(batch['size_bytes'] for batch in batches),
+                      batch_stats,
+                      batches=len(batches))
+    for batch in batches:
+        for staged_file in batch['files']:
+            db_sync.delete_from_stage(batch['stream'], staged_file['s3_key'])
+
+
+def create_flush_pipeline(config) -> FlushPipeline:
+    """Create the pipeline running the serialize, upload and load flush stages in separate thread pools"""
+    max_parallelism = config.get('max_parallelism', DEFAULT_MAX_PARALLELISM)
+    return FlushPipeline(
+        stages=[
+            ('serialize', serialize_batch, config.get('serialize_parallelism', os.cpu_count() or 1)),
+            ('upload', upload_batch, config.get('upload_parallelism', max_parallelism)),
+            ('load', load_batch, config.get('load_parallelism', max_parallelism))
+        ],
+        max_inflight_batches=config.get('max_pipeline_batches', DEFAULT_MAX_PIPELINE_BATCHES))
+
+
+def wait_for_batches(futures: List[Future]) -> None:
+    """Block until every batch of a flush is loaded, raise the first failure"""
+    for future in futures:
+        future.result()
+
+
+def load_catalog_cache(config) -> CatalogCache:
+    """Load the schemas, tables and columns of the target schemas in a few bulk queries"""
+    LOGGER.info('Loading catalog cache...')
+    return CatalogCache.load(DbSync(config).execute_query, stream_utils.get_schema_names_from_config(config))
 
 
 def main():
@@ -396,9 +760,14 @@ def main():
     else:
         config = {}
 
+    # Load the catalog snapshot once instead of querying it for every stream
+    catalog_cache = None
+    if not config.get('disable_table_cache'):
+        catalog_cache = load_catalog_cache(config)
+
     # Consume singer messages
     singer_messages = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
-    persist_lines(config, singer_messages)
+    persist_lines(config, singer_messages, catalog_cache)
 
     LOGGER.debug("Exiting normally")
 
@@ -1,18 +1,33 @@
+import re
 import sys
+import threading
 
 import time
 import uuid
 
+from contextlib import contextmanager, ExitStack
+from datetime import datetime, timezone
+
 from singer import get_logger
-from singer_target_iomete.file_formats import csv_format
-from singer_target_iomete.utils import flattening, stream_utils
+from singer_target_iomete.file_formats import csv_format, get_file_format, FILE_FORMATS
+from singer_target_iomete.utils import compression, flattening, stream_utils
 
-from singer_target_iomete.utils.exceptions import PrimaryKeyNotFoundException
-from singer_target_iomete.utils.s3_upload_client import S3UploadClient
+from singer_target_iomete.utils.batch_stats import BatchStats, NOT_COMPARABLE, comparable_value, sql_literal
+from singer_target_iomete.utils.connection_pool import ConnectionPool
+from singer_target_iomete.utils.record_plan import RecordPlan
+from singer_target_iomete.utils.s3_upload_client import S3UploadClient, STAGE_CLEANUP_MODES
 from pyhive import hive
 
 ICEBERG_CATALOG_NAME = "spark_catalog"
 
+DEFAULT_CONNECTION_POOL_SIZE = 16
+DEFAULT_CONNECTION_IDLE_TIMEOUT_SECONDS = 300
+DEFAULT_CONNECTION_HEALTH_CHECK_SECONDS = 60
+
+# Connection pools shared by every DbSync instance, one per lakehouse and user
+_connection_pools = {}
+_connection_pools_lock = threading.Lock()
+
 
 def validate_config(config):
     """Validate configuration"""
@@ -37,9 +52,90 @@ def validate_config(config):
     if not config_default_target_schema and not config_schema_mapping:
         errors.append("Neither 'default_target_schema' (string) nor 'schema_mapping' (object) keys set in config.")
 
+    # Check file format of the staged files
+    file_format = config.get('file_format', 'csv')
+    if str(file_format).lower() not in FILE_FORMATS:
+        errors.append(f"Unknown file_format: {file_format}. Supported formats: {', '.join(FILE_FORMATS)}")
+    elif config.get('buffer_serialized_rows') and str(file_format).lower() != 'csv':
+        errors.append("'buffer_serialized_rows' is supported only with the csv file_format")
+
+    # Check size of the staged part files
+    for key in ('max_rows_per_file', 'target_file_size_bytes'):
+        value = config.get(key)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+            errors.append(f"'{key}' must be a positive integer: {value}")
+
+    # Check coalescing of the staged batches into fewer commits
+    commit_interval_seconds = config.get('commit_interval_seconds')
+    if commit_interval_seconds is not None and (not isinstance(commit_interval_seconds, (int, float)) or
+                                                isinstance(commit_interval_seconds, bool) or
+                                                commit_interval_seconds <= 0):
+        errors.append(f"'commit_interval_seconds' must be a positive number: {commit_interval_seconds}")
+    commit_max_files = config.get('commit_max_files')
+    if commit_max_files is not None and (not isinstance(commit_max_files, int) or
+                                         isinstance(commit_max_files, bool) or commit_max_files < 1):
+        errors.append(f"'commit_max_files' must be a positive integer: {commit_max_files}")
+    if (commit_interval_seconds or commit_max_files) and (config.get('async_flush') or config.get('flush_pipeline')):
+        errors.append("'commit_interval_seconds' and 'commit_max_files' are not supported with "
+                      "'async_flush' or 'flush_pipeline'")
+
+    # Check cleanup of the staged files
+    stage_cleanup = config.get('stage_cleanup', 'background')
+    if stage_cleanup not in STAGE_CLEANUP_MODES:
+        errors.append(f"Unknown stage_cleanup: {stage_cleanup}. Supported modes: {', '.join(STAGE_CLEANUP_MODES)}")
+
+    # Check source of the loads
+    if config.get('stage_source', 'view') not in ('view', 'path'):
+        errors.append(f"Unknown stage_source: {config.get('stage_source')}. Supported sources: view, path")
+
+    # Check compression of the staged files
+    errors.extend(compression.validate_compression(config))
+
     return errors
 
 
+def create_connection(connection_config):
+    """Open iomete connection"""
+    host = connection_config['host']
+    workspace_id = connection_config['workspace_id']
+    lakehouse = connection_config['lakehouse']
+    user = connection_config['user']
+    password = connection_config['password']
+    database = connection_config.get('database', 'default')
+    return hive.connect(
+        host=host,
+        workspace_id=workspace_id,
+        lakehouse=lakehouse,
+        database=database,
+        username=user,
+        password=password
+    )
+
+
+def get_connection_pool(connection_config) -> ConnectionPool:
+    """Get the process-wide connection pool of the lakehouse in the config"""
+    pool_key = tuple(connection_config.get(key) for key in ('host', 'workspace_id', 'lakehouse', 'database', 'user'))
+    with _connection_pools_lock:
+        if pool_key not in _connection_pools:
+            _connection_pools[pool_key] = ConnectionPool(
+                connect=lambda: create_connection(connection_config),
+                max_size=connection_config.get('connection_pool_size', DEFAULT_CONNECTION_POOL_SIZE),
+                idle_timeout_seconds=connection_config.get('connection_idle_timeout_seconds',
+                                                           DEFAULT_CONNECTION_IDLE_TIMEOUT_SECONDS),
+                health_check_seconds=connection_config.get('connection_health_check_seconds',
+                                                           DEFAULT_CONNECTION_HEALTH_CHECK_SECONDS))
+        return _connection_pools[pool_key]
+
+
+def close_connection_pools() -> None:
+    """Close the idle connections of every pool, called at shutdown"""
+    with _connection_pools_lock:
+        pools = list(_connection_pools.values())
+        _connection_pools.clear()
+    for pool in pools:
+        pool.close()
+
+
 def column_type_spark(schema_property):
     """Take a specific schema property and return the spark equivalent column type"""
     property_type = schema_property['type']
@@ -122,6 +218,30 @@ def column_clause_iceberg(name, schema_property):
     return f'{safe_column_name(name)} {column_type_iceberg(schema_property)}'
 
 
+def partition_source_columns(desc_table):
+    """
+    Source columns of the partitions of a table, parsed from the rows of DESCRIBE TABLE: the partition
+    transforms of iceberg tables, e.g. days(updated_at), or the partition columns of hive tables
+    """
+    columns = []
+    section = None
+    for row in desc_table:
+        col_name = (row.get('col_name') or '').strip()
+        data_type = (row.get('data_type') or '').strip()
+        if col_name.startswith('#'):
+            header = col_name.lstrip('#').strip().lower()
+            # Hive tables print the header of the columns of the partition section
+            if header != 'col_name':
+                section = header
+        elif section == 'partitioning' and data_type:
+            match = re.search(r'`?(\w+)`?\)?$', data_type)
+            if match:
+                columns.append(match.group(1))
+        elif section == 'partition information' and col_name:
+            columns.append(col_name)
+    return columns
+
+
 def primary_column_names(stream_schema_message):
     """Generate list of SQL friendly PK column names"""
     return [safe_column_name(p) for p in stream_schema_message['key_properties']]
@@ -131,7 +251,7 @@ def primary_column_names(stream_schema_message):
 class DbSync:
     """DbSync class"""
 
-    def __init__(self, connection_config, stream_schema_message=None):
+    def __init__(self, connection_config, stream_schema_message=None, catalog_cache=None):
         """
             connection_config:      iomete connection details
 
@@ -149,9 +269,13 @@ class DbSync:
                                     iomete and can run individual queries. For example
                                     collecting catalog informations from iomete for caching
                                     purposes.
+
+            catalog_cache:          Optional CatalogCache answering schema, table and column
+                                    lookups without querying iomete.
         """
         self.connection_config = connection_config
         self.stream_schema_message = stream_schema_message
+        self.catalog_cache = catalog_cache
 
         # logger to be used across the class's methods
         self.logger = get_logger('target_iomete')
@@ -202,41 +326,96 @@ class DbSync:
             self.flatten_schema = flattening.flatten_schema(stream_schema_message['schema'],
                                                             max_level=self.data_flattening_max_level)
 
+            # Schema interpretation applied to every record of the stream
+            self.record_plan = RecordPlan(stream_schema_message['schema'],
+                                          self.flatten_schema,
+                                          stream_schema_message['key_properties'],
+                                          self.data_flattening_max_level)
+            self.encode_row = csv_format.row_encoder(self.flatten_schema)
+
+            # Incremental key of the stream, batches newer than the loaded rows of append streams are inserted
+            self.incremental_key = None
+            if stream_schema_message.get('bookmark_properties'):
+                self.incremental_key = stream_utils.get_incremental_key(stream_schema_message)
+            self.incremental_key_max = None
+            self.incremental_key_max_known = False
+
+        # Columns of the target table, cached between flushes until the table gets altered
+        self.cache_table_columns = self.connection_config.get('cache_table_columns', True)
+        self.table_columns_cache = None
+
+        # Partition source columns of the target table, described once when needed
+        self.partition_columns = None
+
+        # File format of the staged files
+        self.file_format_name = str(self.connection_config.get('file_format', 'csv')).lower()
+        self.file_format = get_file_format(self.file_format_name)
+
+        # Compression of the staged files
+        self.compression = compression.configured_codec(self.connection_config)
+        self.compression_level = self.connection_config.get('compression_level')
+        self.compression_threads = self.connection_config.get('compression_threads', 1)
+
+        # Records are buffered as their encoded rows in the staged file
+        self.buffer_serialized_rows = self.connection_config.get('buffer_serialized_rows', False)
+
+        # Staged files are streamed to the external stage, written to local disk first only if enabled
+        self.stage_on_disk = self.connection_config.get('stage_on_disk', False)
+
+        # Batches are split into part files of at most max_rows_per_file records, or of about
+        # target_file_size_bytes estimated from the size of the previous staged files of the stream
+        self.max_rows_per_file = self.connection_config.get('max_rows_per_file')
+        self.target_file_size_bytes = self.connection_config.get('target_file_size_bytes')
+        self.staged_bytes_per_row = None
+
         # Use external stage
         self.upload_client = S3UploadClient(connection_config)
 
-        if hasattr(sys, '_called_from_test'):
-            print("called from within a tests run")
-        else:
-            self.connection = self.create_connection()
+        # Connections are borrowed from a pool shared by every stream, opened only when needed
+        self.connection_pool = get_connection_pool(connection_config)
+        self._pinned = threading.local()
 
     def create_connection(self):
         """Open iomete connection"""
-        host = self.connection_config['host']
-        workspace_id = self.connection_config['workspace_id']
-        lakehouse = self.connection_config['lakehouse']
-        user = self.connection_config['user']
-        password = self.connection_config['password']
-        database = self.connection_config.get('database', 'default')
-        return hive.connect(
-            host=host,
-            workspace_id=workspace_id,
-            lakehouse=lakehouse,
-            database=database,
-            username=user,
-            password=password
-        )
+        return create_connection(self.connection_config)
+
+    @contextmanager
+    def session(self):
+        """
+        Run every query of the current thread on the same connection until the block exits.
+        Required when queries depend on session state, like temporary tables.
+        """
+        if getattr(self._pinned, 'stack', None) is not None:
+            yield
+            return
+
+        # The connection is borrowed by the first query of the block and returned when the block exits
+        with ExitStack() as stack:
+            self._pinned.stack = stack
+            try:
+                yield
+            finally:
+                self._pinned.stack = None
+                self._pinned.connection = None
 
     def execute_query(self, query):
         self.logger.debug('Running query: %s', query)
-        cursor = self.connection.cursor()
-        cursor.execute(query)
-
-        cols = [col[0] for col in cursor.description]
-        res = []
-        for row in cursor.fetchall():
-            res.append({cols[i]: row[i] for i in range(len(cols))})
-        return res
+        with ExitStack() as stack:
+            connection = getattr(self._pinned, 'connection', None)
+            if connection is None:
+                session_stack = getattr(self._pinned, 'stack', None)
+                connection = (session_stack or stack).enter_context(self.connection_pool.connection())
+                if session_stack is not None:
+                    self._pinned.connection = connection
+
+            cursor = connection.cursor()
+            cursor.execute(query)
+
+            cols = [col[0] for col in cursor.description]
+            res = []
+            for row in cursor.fetchall():
+                res.append({cols[i]: row[i] for i in range(len(cols))})
+            return res
 
     def table_name(self, stream_name, is_temporary, without_schema=False):
         """Generate target table name"""
@@ -255,102 +434,330 @@ class DbSync:
 
         return f'{ICEBERG_CATALOG_NAME}.{self.schema_name}.`{iom_table_name.upper()}`'
 
+    def record_primary_key(self, record):
+        """Get the compact primary key of the record, None if the stream has no primary key"""
+        return self.record_plan.primary_key(record)
+
     def record_primary_key_string(self, record):
         """Generate a unique PK string in the record"""
-        if len(self.stream_schema_message['key_properties']) == 0:
-            return None
-        flatten = flattening.flatten_record(record, self.flatten_schema, max_level=self.data_flattening_max_level)
-        try:
-            key_props = [str(flatten[p]) for p in self.stream_schema_message['key_properties']]
-        except Exception as exc:
-            pks = self.stream_schema_message['key_properties']
-            fields = list(flatten.keys())
-            raise PrimaryKeyNotFoundException(f"Cannot find {pks} primary key(s) in record. "
-                                              f"Available fields: {fields}") from exc
-        return ','.join(key_props)
-
-    def put_to_stage(self, file, stream, count, temp_dir=None):
+        return self.record_plan.primary_key_string(record)
+
+    def serialize_record(self, record):
+        """Encode a record to its row in the staged CSV file"""
+        return self.encode_row(self.record_plan.row(record))
+
+    def compression_codec(self, row_count):
+        """Codec compressing the staged file of a batch of row_count records"""
+        return compression.resolve_codec(self.compression, self.file_format_name, row_count)
+
+    def put_to_stage(self, file, stream, count, temp_dir=None, s3_key=None):
         """Upload file to s3 stage"""
         self.logger.info('Uploading %d rows to stage', count)
-        return self.upload_client.upload_file(file, stream, temp_dir)
+        return self.upload_client.upload_file(file, stream, temp_dir, s3_key)
+
+    def stage_file_key(self, stream, file_suffix, key_prefix=None):
+        """Generate the s3 key of a new staged file, under the prefix of a batch of a coalesced commit if set"""
+        file_name = f"batch_{uuid.uuid4().hex}{file_suffix}"
+        if key_prefix:
+            return f"{key_prefix}{file_name}"
+        return self.upload_client.stage_key(stream, file_name)
+
+    def stage_commit_key(self, stream):
+        """Generate the s3 prefix of the staged files of a coalesced commit"""
+        return self.upload_client.stage_key(stream, f"commit_{uuid.uuid4().hex}") + '/'
+
+    def open_stage_stream(self, s3_key):
+        """Open a file object streaming a staged file to the s3 stage"""
+        return self.upload_client.open_stream(s3_key)
+
+    def rows_per_file(self):
+        """Number of records of the staged part files of a batch, None to stage every batch in a single file"""
+        limits = []
+        if self.max_rows_per_file:
+            limits.append(self.max_rows_per_file)
+        if self.target_file_size_bytes and self.staged_bytes_per_row:
+            limits.append(max(1, int(self.target_file_size_bytes / self.staged_bytes_per_row)))
+        return min(limits) if limits else None
+
+    def track_staged_file(self, row_count, size_bytes):
+        """Learn the size of the staged rows of the stream from a staged file"""
+        if row_count:
+            self.staged_bytes_per_row = size_bytes / row_count
 
     def delete_from_stage(self, stream, s3_key):
         """Delete file from s3 stage"""
         self.logger.info('Deleting %s from stage', format(s3_key))
-        self.upload_client.delete_object(s3_key)
+        self.upload_client.delete_staged_file(s3_key)
+
+    def stage_view_name(self):
+        """Name of the temporary view of the stream over its staged files, replaced by every load"""
+        table_name = self.table_name(self.stream_schema_message['stream'], False, without_schema=True).strip('`')
+        return re.sub(r'\W', '_', f'stage_{self.schema_name}_{table_name}').lower()
 
     def create_temporary_stage_table(self, s3_key: str):
-        tmp_table_name = str(uuid.uuid1()).replace("-", "_")
+        """Create or replace the temporary view of the stream over a staged file, returns the name of the view"""
+        view_name = self.stage_view_name()
 
         columns = [
             column_clause_spark(name, properties_schema)
             for (name, properties_schema) in self.flatten_schema.items()
         ]
 
-        create_tbl_query = f"""
-        CREATE TEMPORARY TABLE {tmp_table_name}({",".join(columns)})
-        USING csv
-        OPTIONS (
-          header "false",
-          path "s3a://{self.connection_config['s3_bucket']}/{s3_key}",
-          mode "FAILFAST"
-        )
+        create_view_query = self.file_format.create_temporary_view_sql(
+            view_name, columns, f"s3a://{self.connection_config['s3_bucket']}/{s3_key}")
+
+        self.execute_query(create_view_query)
+
+        return view_name
+
+    def stage_source(self, s3_key: str):
         """
+        Source of the load of a staged file: the temporary view of the stream, or with stage_source set to
+        path the staged file read straight from its path, saving the query creating the view
+        """
+        if self.connection_config.get('stage_source', 'view') != 'path':
+            return self.create_temporary_stage_table(s3_key)
 
-        self.execute_query(create_tbl_query)
+        columns = [
+            (safe_column_name(name), column_type_spark(properties_schema))
+            for (name, properties_schema) in self.flatten_schema.items()
+        ]
+        return self.file_format.create_path_source_sql(
+            columns, f"s3a://{self.connection_config['s3_bucket']}/{s3_key}")
 
-        return tmp_table_name
+    def load_file(self, s3_key, count, size_bytes, batch_stats=None, batches=1):
+        """
+        Load a supported file type from iomete stage into target table
 
-    def load_file(self, s3_key, count, size_bytes):
-        """Load a supported file type from iomete stage into target table"""
+        With the staged files of several batches under s3_key, the rows of a primary key are loaded
+        from the latest batch only, the batches are ordered by the names of their files.
+        """
         stream_schema_message = self.stream_schema_message
         stream = stream_schema_message['stream']
         self.logger.info("Loading %d rows into '%s'", count, self.table_name(stream, False))
 
-        table_name = self.table_name(stream, False, True)
-        table_columns = [
-            safe_column_name(row['COLUMN_NAME'])
-            for row in self.get_table_columns(schema_name=self.schema_name, table_name=table_name)
-        ]
+        columns_from_cache = self.has_cached_table_columns()
+        table_columns = self.cached_table_columns()
+        insert_only = self.is_new_batch(batch_stats)
+        target_predicate = None if insert_only else self.merge_pruning_condition(batch_stats)
+
+        # The temporary view exists only in the session that created it
+        with self.session():
+            self._load_from_stage(s3_key, table_columns, columns_from_cache, insert_only, batches > 1,
+                                  target_predicate)
+
+        if self.is_append_stream():
+            self.track_incremental_key_max(batch_stats)
+
+        # Insert or Update with MERGE command if primary key defined
+        if len(self.stream_schema_message['key_properties']) > 0 and not insert_only:
+            self.logger.info("Merge successfully executed for %s, size_bytes: %s",
+                             self.table_name(stream, False), size_bytes)
+
+        # Insert only in the case of no primary key
+        else:
+            self.logger.info("Insert successfully executed for %s, size_bytes: %s",
+                             self.table_name(stream, False), size_bytes)
+
+    def _load_from_stage(self, s3_key, table_columns, columns_from_cache, insert_only=False, deduplicate=False,
+                         target_predicate=None):
+        stream = self.stream_schema_message['stream']
+        temporary_stage_table = self.stage_source(s3_key)
+
+        try:
+            self.execute_query(self.load_file_query(temporary_stage_table, table_columns, insert_only, deduplicate,
+                                                    target_predicate))
+        except Exception:
+            # The target table might have been altered since the columns got cached: retry once with fresh columns
+            if not columns_from_cache:
+                raise
+            self.set_cached_table_columns(None)
+            fresh_table_columns = self.cached_table_columns()
+            if {c['COLUMN_NAME'].upper() for c in fresh_table_columns} == \
+                    {c['COLUMN_NAME'].upper() for c in table_columns}:
+                raise
+            self.logger.warning("Columns of '%s' changed since they were cached, retrying the load",
+                                self.table_name(stream, False))
+            self.execute_query(self.load_file_query(temporary_stage_table, fresh_table_columns, insert_only,
+                                                    deduplicate, target_predicate))
+
+    def load_file_query(self, temporary_stage_table, table_columns, insert_only=False, deduplicate=False,
+                        target_predicate=None):
+        """
+        Generate the SQL loading a temporary stage table into the target table
 
+        MERGE if primary key defined and the rows are not known to be new, INSERT otherwise. With deduplicate
+        only the row of the last staged file of every primary key is loaded. The target_predicate restricts
+        the target rows a MERGE can match.
+        """
+        stream = self.stream_schema_message['stream']
         data_columns = [
             safe_column_name(name)
             for (name, _) in self.flatten_schema.items()
         ]
 
         columns_no_data = [
-            col_name for col_name in table_columns
+            col_name for col_name in [safe_column_name(row['COLUMN_NAME']) for row in table_columns]
             if col_name not in data_columns
         ]
 
-        temporary_stage_table = self.create_temporary_stage_table(s3_key)
+        # Rows flagged as deleted are removed by the load itself
+        deleted_at_column = None
+        if self.connection_config.get('hard_delete') and '_sdc_deleted_at' in self.flatten_schema:
+            deleted_at_column = safe_column_name('_sdc_deleted_at')
+
+        # The staged files of several batches may contain several rows of a primary key
+        if deduplicate and len(self.stream_schema_message['key_properties']) > 0:
+            temporary_stage_table = csv_format.create_latest_rows_sql(
+                temporary_stage_table, data_columns, primary_column_names(self.stream_schema_message))
 
         # Insert or Update with MERGE command if primary key defined
-        if len(self.stream_schema_message['key_properties']) > 0:
-            merge_sql = csv_format.create_merge_sql(table_name=self.table_name(stream, False),
-                                                    columns_no_data=columns_no_data,
-                                                    temporary_stage_table=temporary_stage_table,
-                                                    data_columns=data_columns,
-                                                    pk_merge_condition=
-                                                    self.primary_key_merge_condition())
-
-            # Get number of inserted and updated records - MERGE does insert and update
-            self.execute_query(merge_sql)
-            self.logger.info("Merge successfully executed for %s, size_bytes: %s",
-                             self.table_name(stream, False), size_bytes)
+        if len(self.stream_schema_message['key_properties']) > 0 and not insert_only:
+            return csv_format.create_merge_sql(table_name=self.table_name(stream, False),
+                                               columns_no_data=columns_no_data,
+                                               temporary_stage_table=temporary_stage_table,
+                                               data_columns=data_columns,
+                                               pk_merge_condition=
+                                               self.primary_key_merge_condition(),
+                                               deleted_at_column=deleted_at_column,
+                                               target_predicate=target_predicate)
+
+        # Insert only in the case of no primary key or new rows
+        return csv_format.create_copy_sql(table_name=self.table_name(stream, False),
+                                          columns_no_data=columns_no_data,
+                                          temporary_stage_table=temporary_stage_table,
+                                          data_columns=data_columns,
+                                          deleted_at_column=deleted_at_column)
+
+    def is_append_stream(self):
+        """
+        Whether the rows of the stream are never updated once loaded, so a batch with every
+        incremental key above the loaded ones contains only new primary keys
+        """
+        key_properties = self.stream_schema_message['key_properties']
+        if not self.incremental_key or not key_properties or \
+                not self.connection_config.get('insert_only_fast_path', True):
+            return False
+
+        return key_properties == [self.incremental_key] or \
+            self.stream_schema_message['stream'] in self.connection_config.get('append_only_streams', [])
+
+    def new_batch_stats(self):
+        """Create the statistics to collect for the records of the next batch"""
+        columns = {}
+        if self.is_append_stream():
+            columns[self.incremental_key] = column_type_spark(self.flatten_schema[self.incremental_key])
+        for column in self.merge_pruning_columns():
+            columns[column] = column_type_spark(self.flatten_schema[column])
+        return BatchStats(columns)
+
+    def merge_pruning_columns(self):
+        """
+        Columns whose batch bounds restrict the target rows a MERGE can match: the primary key, and the
+        incremental key and partition columns of append streams, as their values never change once loaded
+        """
+        key_properties = self.stream_schema_message['key_properties']
+        if not key_properties or not self.connection_config.get('merge_pruning', True):
+            return []
 
-        # Insert only in the case of no primary key
-        else:
-            copy_sql = csv_format.create_copy_sql(table_name=self.table_name(stream, False),
-                                                  columns_no_data=columns_no_data,
-                                                  temporary_stage_table=temporary_stage_table,
-                                                  data_columns=data_columns)
+        columns = list(key_properties)
+        if self.is_append_stream():
+            columns.append(self.incremental_key)
+            partition_columns = {column.lower() for column in self.table_partition_columns()}
+            columns.extend(name for name in self.flatten_schema if name.lower() in partition_columns)
 
-            # Get number of inserted records - COPY does insert only
-            self.execute_query(copy_sql)
+        # Nested properties have no bounds
+        return [column for column in dict.fromkeys(columns) if column in self.flatten_schema]
 
-            self.logger.info("Insert successfully executed for %s, size_bytes: %s",
-                             self.table_name(stream, False), size_bytes)
+    def merge_pruning_condition(self, batch_stats):
+        """
+        Generate the SQL predicate restricting the target rows of a MERGE to the bounds of the batch, so
+        that iceberg reads only the data files that can match. None if the batch has no usable bounds.
+        """
+        if batch_stats is None:
+            return None
+
+        key_properties = self.stream_schema_message['key_properties']
+        predicates = []
+        for column in self.merge_pruning_columns():
+            # Null primary keys never match, other columns can't be bounded with nulls
+            if column not in key_properties and column in batch_stats.has_nulls:
+                continue
+            bounds = batch_stats.min_max(column)
+            column_type = batch_stats.columns.get(column)
+            if bounds is None or column_type is None:
+                continue
+            min_value, max_value = sql_literal(bounds[0], column_type), sql_literal(bounds[1], column_type)
+            if min_value is None or max_value is None:
+                continue
+            predicates.append(f't.{safe_column_name(column)} >= {min_value} AND '
+                              f't.{safe_column_name(column)} <= {max_value}')
+
+        return ' AND '.join(predicates) if predicates else None
+
+    def loaded_incremental_key_max(self):
+        """Max incremental key in the target table, queried once and tracked by the loads afterwards"""
+        if not self.incremental_key_max_known:
+            column = safe_column_name(self.incremental_key)
+            column_type = column_type_spark(self.flatten_schema[self.incremental_key])
+
+            # Timestamps are read as epoch seconds to not depend on the session timezone
+            if column_type == 'timestamp':
+                expression = f'CAST(MAX({column}) AS DOUBLE)'
+            elif column_type == 'date':
+                expression = f'CAST(MAX({column}) AS STRING)'
+            else:
+                expression = f'MAX({column})'
+
+            stream = self.stream_schema_message['stream']
+            rows = self.execute_query(f'SELECT {expression} AS MAX_VALUE FROM {self.table_name(stream, False)}')
+            value = list(rows[0].values())[0] if rows else None
+            if value is not None and column_type == 'timestamp':
+                value = datetime.fromtimestamp(float(value), timezone.utc)
+
+            self.incremental_key_max = comparable_value(value, column_type)
+            self.incremental_key_max_known = True
+
+        return self.incremental_key_max
+
+    def is_new_batch(self, batch_stats):
+        """Whether every row of a batch is known to be new in the target table and can be inserted"""
+        if batch_stats is None or not self.is_append_stream() or self.incremental_key in batch_stats.has_nulls:
+            return False
+
+        bounds = batch_stats.min_max(self.incremental_key)
+        if bounds is None:
+            return False
+
+        loaded_max = self.loaded_incremental_key_max()
+        if loaded_max is NOT_COMPARABLE:
+            return False
+        if loaded_max is None:
+            return True
+        try:
+            return bounds[0] > loaded_max
+        except TypeError:
+            return False
+
+    def track_incremental_key_max(self, batch_stats):
+        """Update the max incremental key of the target table after loading a batch"""
+        if not self.incremental_key_max_known:
+            return
+
+        # The max is queried again before the next insert if the batch doesn't tell it
+        if batch_stats is None or self.incremental_key in batch_stats.not_comparable or \
+                self.incremental_key_max is NOT_COMPARABLE:
+            self.incremental_key_max_known = False
+            return
+
+        bounds = batch_stats.min_max(self.incremental_key)
+        if bounds is None:
+            return
+        try:
+            if self.incremental_key_max is None or bounds[1] > self.incremental_key_max:
+                self.incremental_key_max = bounds[1]
+        except TypeError:
+            self.incremental_key_max_known = False
 
     def primary_key_merge_condition(self):
         """Generate SQL join condition on primary keys for merge SQL statements"""
@@ -374,17 +781,12 @@ class DbSync:
         p_columns = ', '.join(columns)
         return f"CREATE TABLE IF NOT EXISTS {p_table_name} ({p_columns})"
 
-    def delete_rows(self, stream):
-        """Hard delete rows from target table"""
-        table = self.table_name(stream, False)
-        query = f"DELETE FROM {table} WHERE _sdc_deleted_at IS NOT NULL"
-        self.logger.info("Deleting rows from '%s' table... %s", table, query)
-        self.execute_query(query)
-        self.logger.info('Deleting rows finished')
-
     def create_schema_if_not_exists(self):
         """Create target schema if not exists"""
         schema_name = self.schema_name
+        if self.catalog_cache and self.catalog_cache.has_schema(schema_name):
+            return
+
         # Query realtime if not pre-collected
         schema_rows = self.execute_query(f"SHOW SCHEMAS LIKE '{schema_name.upper()}'")
 
@@ -393,7 +795,15 @@ class DbSync:
             self.logger.info("Schema '%s' does not exist. Creating... %s", schema_name, query)
             self.execute_query(query)
 
+        if self.catalog_cache:
+            self.catalog_cache.add_schema(schema_name, created=len(schema_rows) == 0)
+
     def table_exists(self, schema, table_name):
+        if self.catalog_cache:
+            cached_table_exists = self.catalog_cache.has_table(schema, table_name)
+            if cached_table_exists is not None:
+                return cached_table_exists
+
         table_name_without_quotes = table_name.replace("`", "")
         show_tables = self.execute_query(query=f"SHOW TABLES in {schema} LIKE '{table_name_without_quotes}'")
         return len(show_tables) > 0
@@ -407,20 +817,64 @@ class DbSync:
         # return the following columns: column_name, data_type
         desc_table = self.execute_query(query=f"describe {schema_name}.{table_name}")
 
-        table_columns = [
-            {'COLUMN_NAME': row['col_name'], 'DATA_TYPE': row['data_type']}
-            for row in desc_table
-            if row['data_type'] is not None and len(row['data_type'].strip()) > 0
-        ]
+        table_columns = []
+        for row in desc_table:
+            # Partitioning and other sections follow the columns
+            if (row['col_name'] or '').startswith('#'):
+                break
+            if row['data_type'] is not None and len(row['data_type'].strip()) > 0:
+                table_columns.append({'COLUMN_NAME': row['col_name'], 'DATA_TYPE': row['data_type']})
+
+        return table_columns
+
+    def table_partition_columns(self):
+        """Partition source columns of the target table"""
+        if self.partition_columns is None:
+            stream = self.stream_schema_message['stream']
+            self.partition_columns = partition_source_columns(
+                self.execute_query(f"describe {self.table_name(stream, False)}"))
+        return self.partition_columns
+
+    def has_cached_table_columns(self):
+        """Whether the columns of the target table can be returned without describing the table"""
+        if not self.cache_table_columns:
+            return False
+        if self.table_columns_cache is not None:
+            return True
+
+        stream = self.stream_schema_message['stream']
+        return self.catalog_cache is not None and \
+            self.catalog_cache.get_columns(self.schema_name, self.table_name(stream, False, True)) is not None
+
+    def cached_table_columns(self):
+        """Get list of columns of the target table, described only if not cached yet"""
+        if self.cache_table_columns and self.table_columns_cache is not None:
+            return self.table_columns_cache
+
+        stream = self.stream_schema_message['stream']
+        table_name = self.table_name(stream, False, True)
+        table_columns = None
+        if self.cache_table_columns and self.catalog_cache:
+            table_columns = self.catalog_cache.get_columns(self.schema_name, table_name)
+        if table_columns is None:
+            table_columns = self.get_table_columns(schema_name=self.schema_name, table_name=table_name)
 
+        self.set_cached_table_columns(table_columns)
         return table_columns
 
+    def set_cached_table_columns(self, table_columns):
+        """Cache the columns of the target table, None invalidates the cached columns"""
+        if self.cache_table_columns:
+            self.table_columns_cache = table_columns
+        if self.catalog_cache:
+            stream = self.stream_schema_message['stream']
+            self.catalog_cache.set_columns(self.schema_name, self.table_name(stream, False, True), table_columns)
+
     def update_columns(self):
         """Adds required but not existing columns the target table according to the schema"""
         stream_schema_message = self.stream_schema_message
         stream = stream_schema_message['stream']
-        table_name = self.table_name(stream, False, True)
-        columns = self.get_table_columns(schema_name=self.schema_name, table_name=table_name)
+        columns = self.cached_table_columns()
 
         columns_dict = {column['COLUMN_NAME'].upper(): column for column in columns}
 
@@ -446,6 +900,16 @@ class DbSync:
             self.version_column(column_name, stream)
             self.add_column(column, stream)
 
+        # Cache the columns as they are after the changes, versioned columns are described again when needed
+        if columns_to_replace:
+            self.set_cached_table_columns(None)
+        else:
+            self.set_cached_table_columns(columns + [
+                {'COLUMN_NAME': name.upper(), 'DATA_TYPE': column_type_iceberg(properties_schema)}
+                for (name, properties_schema) in self.flatten_schema.items()
+                if name.upper() not in columns_dict
+            ])
+
     def drop_column(self, column_name, stream):
         """Drops column from an existing table"""
         drop_column = f"ALTER TABLE {self.table_name(stream, False)} DROP COLUMN {column_name}"
@@ -477,8 +941,15 @@ class DbSync:
 
         if self.table_exists(schema=self.schema_name, table_name=table_name):
             self.logger.info('Table %s exists', table_name_with_schema)
+            # A new SCHEMA message describes the table again, it may have been altered outside of the target
+            self.set_cached_table_columns(None)
             self.update_columns()
         else:
             query = self.create_table_query()
             self.logger.info('Table %s does not exist. Creating...', table_name_with_schema)
             self.execute_query(query)
+
+            self.set_cached_table_columns([
+                {'COLUMN_NAME': name.upper(), 'DATA_TYPE': column_type_iceberg(properties_schema)}
+                for (name, properties_schema) in self.flatten_schema.items()
+            ])
@@ -0,0 +1,17 @@
+"""File formats of the staged files"""
+from singer_target_iomete.file_formats import csv_format, parquet_format
+from singer_target_iomete.utils.exceptions import FileFormatNotFoundException
+
+FILE_FORMATS = {
+    'csv': csv_format,
+    'parquet': parquet_format
+}
+
+
+def get_file_format(name: str):
+    """Return the module implementing a file format by its name"""
+    try:
+        return FILE_FORMATS[name.lower()]
+    except KeyError as exc:
+        raise FileFormatNotFoundException(f"Unknown file format: {name}. "
+                                          f"Supported formats: {', '.join(FILE_FORMATS)}") from exc
@@ -1,19 +1,76 @@
 """CSV file format functions"""
-import gzip
 import json
+import math
 import os
 
+from collections.abc import Mapping
+from json.encoder import encode_basestring
 from typing import Callable, Dict, List
 from tempfile import mkstemp
 
 from singer_target_iomete.utils import flattening
+from singer_target_iomete.utils.compression import compressed_writer, file_extension
+
+
+def create_temporary_view_sql(view_name: str, columns: list, path: str) -> str:
+    """Generate an iomete temporary view on top of staged CSV files, replacing the view of the same name"""
+    return f"""
+        CREATE OR REPLACE TEMPORARY VIEW {view_name}({",".join(columns)})
+        USING csv
+        OPTIONS (
+          header "false",
+          path "{path}",
+          mode "FAILFAST"
+        )
+        """
+
+
+def create_path_source_sql(columns: list, path: str) -> str:
+    """
+    Generate the source of a load reading staged CSV files straight from their path
+
+    The positional string columns of the files are cast to the column types by Spark SQL. A cast turning
+    a value into null raises an error, so malformed values fail the load as with the temporary view.
+
+    Args:
+        columns: List of (column name, spark type) in file column order
+        path: Path of the staged file or of the prefix of its part files
+    """
+    casts = ', '.join(_checked_cast(i, column_name, column_type)
+                      for (i, (column_name, column_type)) in enumerate(columns))
+    return f"(SELECT {casts} FROM csv.`{path}`) stage"
+
+
+def _checked_cast(index: int, column_name: str, column_type: str) -> str:
+    cast = f'CAST(_c{index} AS {column_type})'
+    # Every value casts to string
+    if column_type.lower() == 'string':
+        return f'{cast} AS {column_name}'
+    error = f"Malformed {column_type} value in column {column_name}".replace("'", "\\'")
+    return (f"CASE WHEN _c{index} IS NOT NULL AND {cast} IS NULL "
+            f"THEN CAST(raise_error('{error}') AS {column_type}) ELSE {cast} END AS {column_name}")
+
+
+def create_latest_rows_sql(temporary_stage_table: str, data_columns: list, primary_key_columns: list) -> str:
+    """
+    Generate the source of a load over the staged files of several batches, keeping the row of the last
+    staged file of every primary key. The staged files are named in batch order.
+    """
+    p_columns = ', '.join(data_columns)
+    p_keys = ', '.join(primary_key_columns)
+    return f"(SELECT {p_columns} FROM (" \
+           f"SELECT {p_columns}, " \
+           f"ROW_NUMBER() OVER (PARTITION BY {p_keys} ORDER BY _sdc_staged_file DESC) AS _sdc_row_number " \
+           f"FROM (SELECT {p_columns}, input_file_name() AS _sdc_staged_file FROM {temporary_stage_table}) files" \
+           f") ranked WHERE _sdc_row_number = 1) latest"
 
 
 def create_copy_sql(table_name: str,
                     columns_no_data: list[str],
                     temporary_stage_table: str,
-                    data_columns: list):
-    """Generate a CSV compatible iomete insert"""
+                    data_columns: list,
+                    deleted_at_column: str = None):
+    """Generate a CSV compatible iomete insert, rows flagged in deleted_at_column are not inserted"""
     p_target_columns = ', '.join([c for c in data_columns])
     if columns_no_data:
         p_target_columns += ", " + ",".join(columns_no_data)
@@ -22,16 +79,27 @@ def create_copy_sql(table_name: str,
     if columns_no_data:
         p_source_columns += ", " + ",".join([f"null" for _ in columns_no_data])
 
+    p_where = f" WHERE {deleted_at_column} IS NULL" if deleted_at_column else ""
+
     return f"INSERT INTO {table_name} ({p_target_columns}) " \
-           f"SELECT {p_source_columns} FROM {temporary_stage_table}"
+           f"SELECT {p_source_columns} FROM {temporary_stage_table}{p_where}"
 
 
 def create_merge_sql(table_name: str,
                      columns_no_data: list[str],
                      temporary_stage_table: str,
                      data_columns: list,
-                     pk_merge_condition: str) -> str:
-    """Generate an iomete MERGE INTO command"""
+                     pk_merge_condition: str,
+                     deleted_at_column: str = None,
+                     target_predicate: str = None) -> str:
+    """
+    Generate an iomete MERGE INTO command
+
+    If deleted_at_column is defined, matching rows flagged as deleted in the source are deleted from
+    the target table and flagged rows without a match are not inserted. The target_predicate, on the
+    columns of the target table t, is added to the merge condition so the target files that can't
+    match are not read.
+    """
     p_source_columns = ', '.join([c for c in data_columns])
 
     p_update = ', '.join([f"{c}=s.{c}" for c in data_columns])
@@ -46,12 +114,23 @@ def create_merge_sql(table_name: str,
     if columns_no_data:
         p_insert_values += ", " + ",".join([f"null" for _ in columns_no_data])
 
+    p_condition = pk_merge_condition
+    if target_predicate:
+        p_condition += f" AND {target_predicate}"
+
+    p_delete = ""
+    p_not_matched = ""
+    if deleted_at_column:
+        p_delete = f"WHEN MATCHED AND s.{deleted_at_column} IS NOT NULL THEN DELETE "
+        p_not_matched = f" AND s.{deleted_at_column} IS NULL"
+
     return f"MERGE INTO {table_name} t USING (" \
            f"SELECT {p_source_columns} " \
            f"FROM {temporary_stage_table}) s " \
-           f"ON {pk_merge_condition} " \
+           f"ON {p_condition} " \
+           f"{p_delete}" \
            f"WHEN MATCHED THEN UPDATE SET {p_update} " \
-           "WHEN NOT MATCHED THEN " \
+           f"WHEN NOT MATCHED{p_not_matched} THEN " \
            f"INSERT ({p_insert_cols}) " \
            f"VALUES ({p_insert_values})"
 
@@ -81,6 +160,104 @@ def record_to_csv_line(record: dict,
     )
 
 
+def encode_value(value) -> str:
+    """
+    Encode a column value to a CSV cell, same as json.dumps(value, ensure_ascii=False) for
+    non empty values and an empty string for empty values
+    """
+    value_type = type(value)
+    if value_type is str:
+        return encode_basestring(value) if value else ''
+    if value_type is int:
+        return int.__repr__(value)
+    if value_type is bool:
+        return 'true' if value else 'false'
+    if value is None:
+        return ''
+    if value_type is float and math.isfinite(value):
+        return float.__repr__(value)
+    return json.dumps(value, ensure_ascii=False) if value == 0 or value else ''
+
+
+def _encode_str(value) -> str:
+    if type(value) is str:
+        return encode_basestring(value) if value else ''
+    return encode_value(value)
+
+
+def _encode_int(value) -> str:
+    if type(value) is int:
+        return int.__repr__(value)
+    return encode_value(value)
+
+
+def _encode_float(value) -> str:
+    if type(value) is float and math.isfinite(value):
+        return float.__repr__(value)
+    return encode_value(value)
+
+
+def _encode_bool(value) -> str:
+    if type(value) is bool:
+        return 'true' if value else 'false'
+    return encode_value(value)
+
+
+def column_encoder(schema_property: Dict) -> Callable:
+    """Return the function encoding the values of a column, checking the type of the schema first"""
+    property_type = schema_property.get('type', [])
+    if 'format' in schema_property or 'string' in property_type:
+        return _encode_str
+    if 'integer' in property_type:
+        return _encode_int
+    if 'number' in property_type:
+        return _encode_float
+    if 'boolean' in property_type:
+        return _encode_bool
+    return encode_value
+
+
+def row_encoder(schema: Dict) -> Callable:
+    """
+    Compile the function encoding the column values of a record, as returned by RecordPlan.row,
+    to its line in the CSV file
+
+    Args:
+        schema: Flattened JSONSchema of the records
+
+    Returns:
+        Function taking the values of a record in column order and returning the UTF-8 encoded line
+    """
+    encoders = [column_encoder(schema_property) for schema_property in schema.values()]
+
+    def encode_row(row: list) -> bytes:
+        return (','.join([encode(value) for (encode, value) in zip(encoders, row)]) + '\n').encode('utf-8')
+
+    return encode_row
+
+
+def write_rows_to_file(outfile, rows, chunk_size: int = 10000) -> None:
+    """
+    Writes encoded CSV lines to a given file
+
+    Args:
+        outfile: An open file object
+        rows: Iterable of CSV lines encoded by the function returned by row_encoder
+        chunk_size: Number of lines joined into a single write
+
+    Returns:
+        None
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            outfile.write(b''.join(chunk))
+            chunk = []
+    if chunk:
+        outfile.write(b''.join(chunk))
+
+
 def write_records_to_file(outfile,
                           records: Dict,
                           schema: Dict,
@@ -99,18 +276,72 @@ def write_records_to_file(outfile,
     Returns:
         None
     """
-    for record in records.values():
+    for record in (records.values() if isinstance(records, Mapping) else records):
         csv_line = record_to_csv_line_transformer(record, schema, data_flattening_max_level)
         outfile.write(bytes(csv_line + '\n', 'UTF-8'))
 
 
+def _codec(compression) -> str:
+    if isinstance(compression, str):
+        return compression
+    return 'gzip' if compression else 'none'
+
+
+def file_suffix(compression=False, suffix: str = 'csv') -> str:
+    """Suffix of the CSV files compressed by a codec, iomete picks the decompression by the file extension"""
+    return f'.{suffix}{file_extension(_codec(compression))}'
+
+
+def records_to_fileobj(records: Dict,
+                       schema: Dict,
+                       outfile,
+                       compression=False,
+                       data_flattening_max_level: int = 0,
+                       record_plan=None,
+                       serialized_rows: bool = False,
+                       compression_level: int = None,
+                       compression_threads: int = 1) -> None:
+    """
+    Writes a batch of records messages as a CSV file to a binary file object
+
+    Args:
+        records: List of dictionaries that represents a batch of singer record messages
+        schema: JSONSchema of the records
+        outfile: An open binary file object, stays open
+        compression: Codec of the file: none, gzip or zstd. True means gzip, False none (Default: False)
+        data_flattening_max_level: Max level of auto flattening if a record message has nested objects. (Default: 0)
+        record_plan: RecordPlan of the stream reading the columns without flattening the records. (Default: None)
+        serialized_rows: The records are already encoded by the function returned by row_encoder. (Default: False)
+        compression_level: Compression level, default level of the codec if not set. (Default: None)
+        compression_threads: Number of threads compressing the file. (Default: 1)
+
+    Returns:
+        None
+    """
+    with compressed_writer(outfile, _codec(compression), compression_level, threads=compression_threads) as writer:
+        if serialized_rows:
+            write_rows_to_file(writer, records.values() if isinstance(records, Mapping) else records)
+        elif record_plan is not None:
+            encode_row = row_encoder(schema)
+            write_rows_to_file(writer, (
+                encode_row(record_plan.row(record))
+                for record in (records.values() if isinstance(records, Mapping) else records)
+            ))
+        else:
+            write_records_to_file(writer, records, schema, record_to_csv_line, data_flattening_max_level)
+
+
 def records_to_file(records: Dict,
                     schema: Dict,
                     suffix: str = 'csv',
                     prefix: str = 'batch_',
-                    compression: bool = False,
+                    compression=False,
                     dest_dir: str = None,
-                    data_flattening_max_level: int = 0):
+                    data_flattening_max_level: int = 0,
+                    record_plan=None,
+                    serialized_rows: bool = False,
+                    compression_level: int = None,
+                    compression_threads: int = 1):
     """
     Transforms a list of dictionaries with records messages to a CSV file
 
@@ -119,9 +350,13 @@ def records_to_file(records: Dict,
         schema: JSONSchema of the records
         suffix: Generated filename suffix
         prefix: Generated filename prefix
-        compression: Gzip compression enabled or not (Default: False)
+        compression: Codec of the file: none, gzip or zstd. True means gzip, False none (Default: False)
         dest_dir: Directory where the CSV file will be generated. (Default: OS specificy temp directory)
         data_flattening_max_level: Max level of auto flattening if a record message has nested objects. (Default: 0)
+        record_plan: RecordPlan of the stream reading the columns without flattening the records. (Default: None)
+        serialized_rows: The records are already encoded by the function returned by row_encoder. (Default: False)
+        compression_level: Compression level, default level of the codec if not set. (Default: None)
+        compression_threads: Number of threads compressing the file. (Default: 1)
 
     Returns:
         Absolute path of the generated CSV file
@@ -129,20 +364,10 @@ def records_to_file(records: Dict,
     if dest_dir:
         os.makedirs(dest_dir, exist_ok=True)
 
-    if compression:
-        file_suffix = f'.{suffix}.gz'
-    else:
-        file_suffix = f'.{suffix}'
-
-    filedesc, filename = mkstemp(suffix=file_suffix, prefix=prefix, dir=dest_dir)
-
-    # Using gzip or plain file object
-    if compression:
-        with open(filedesc, 'wb') as outfile:
-            with gzip.GzipFile(filename=filename, mode='wb', fileobj=outfile) as gzipfile:
-                write_records_to_file(gzipfile, records, schema, record_to_csv_line, data_flattening_max_level)
-    else:
-        with open(filedesc, 'wb') as outfile:
-            write_records_to_file(outfile, records, schema, record_to_csv_line, data_flattening_max_level)
+    filedesc, filename = mkstemp(suffix=file_suffix(compression, suffix), prefix=prefix, dir=dest_dir)
+
+    with open(filedesc, 'wb') as outfile:
+        records_to_fileobj(records, schema, outfile, compression, data_flattening_max_level, record_plan,
+                           serialized_rows, compression_level, compression_threads)
 
     return filename
@@ -0,0 +1,248 @@
+"""Parquet file format functions"""
+import json
+import os
+
+from collections.abc import Mapping
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Dict
+from tempfile import mkstemp
+
+from dateutil import parser
+
+from singer_target_iomete.utils import flattening
+from singer_target_iomete.utils.compression import LEVEL_CODECS
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+def create_temporary_view_sql(view_name: str, columns: list, path: str) -> str:
+    """
+    Generate an iomete temporary view on top of staged Parquet files, replacing the view of the same name.
+    Column types come from the files.
+    """
+    return f"""
+        CREATE OR REPLACE TEMPORARY VIEW {view_name}
+        USING parquet
+        OPTIONS (
+          path "{path}"
+        )
+        """
+
+
+def create_path_source_sql(columns: list, path: str) -> str:
+    """Generate the source of a load reading staged Parquet files straight from their path"""
+    return f"parquet.`{path}`"
+
+
+def column_type_arrow(schema_property):
+    """Take a specific schema property and return the arrow type of the spark column it is loaded into"""
+    property_type = schema_property['type']
+    property_format = schema_property['format'] if 'format' in schema_property else None
+    col_type = pyarrow.string()
+    if 'object' in property_type or 'array' in property_type:
+        col_type = pyarrow.string()
+    elif property_format in ('date-time', 'time'):
+        col_type = pyarrow.timestamp('us', tz='UTC')
+    elif property_format == 'date':
+        col_type = pyarrow.date32()
+    elif property_format == 'binary':
+        col_type = pyarrow.string()
+    elif 'number' in property_type:
+        col_type = pyarrow.float64()
+    elif 'integer' in property_type and 'string' in property_type:
+        col_type = pyarrow.string()
+    elif 'integer' in property_type:
+        col_type = pyarrow.int64()
+    elif 'boolean' in property_type:
+        col_type = pyarrow.bool_()
+
+    return col_type
+
+
+def _parse_datetime(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return parser.parse(value)
+
+
+def _to_timestamp(value) -> datetime:
+    if isinstance(value, str) and value[2:3] == ':':
+        # Time values are loaded as timestamps on the first day of the epoch, as there is no TIME type in spark
+        return datetime.combine(date(1970, 1, 1), time.fromisoformat(value))
+    return _parse_datetime(value)
+
+
+def _to_date(value) -> date:
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return value
+    return _parse_datetime(value).date()
+
+
+def _to_string(value) -> str:
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+
+
+def _to_float(value) -> float:
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return float(value)
+    raise ValueError(f'Not a number: {value!r}')
+
+
+def _to_int(value) -> int:
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    raise ValueError(f'Not an integer: {value!r}')
+
+
+def _to_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    raise ValueError(f'Not a boolean: {value!r}')
+
+
+def value_converter(arrow_type):
+    """Return the function converting a flattened record value to the python type of an arrow column"""
+    if pyarrow.types.is_timestamp(arrow_type):
+        return _to_timestamp
+    if pyarrow.types.is_date(arrow_type):
+        return _to_date
+    # Values of other types are rejected like the CSV loads reject them, not coerced
+    if pyarrow.types.is_float64(arrow_type):
+        return _to_float
+    if pyarrow.types.is_int64(arrow_type):
+        return _to_int
+    if pyarrow.types.is_boolean(arrow_type):
+        return _to_bool
+    return _to_string
+
+
+def records_to_table(records: Dict, schema: Dict, data_flattening_max_level: int = 0, record_plan=None):
+    """
+    Transforms a batch of record messages to a typed arrow table
+
+    Args:
+        records: Dictionary of record messages, values are dictionaries of the records
+        schema: Flattened JSONSchema of the records
+        data_flattening_max_level: Max level of auto flattening if a record message has nested objects. (Default: 0)
+        record_plan: RecordPlan of the stream reading the columns without flattening the records. (Default: None)
+
+    Returns:
+        pyarrow.Table with one column per schema property, named as the target table columns
+    """
+    if pyarrow is None:
+        raise ImportError('Parquet file format requires pyarrow. Install it with `pip install pyarrow`')
+
+    fields = [pyarrow.field(name.upper(), column_type_arrow(prop)) for (name, prop) in schema.items()]
+    converters = [value_converter(field.type) for field in fields]
+    columns = [[] for _ in fields]
+
+    for record in (records.values() if isinstance(records, Mapping) else records):
+        if record_plan is not None:
+            row = record_plan.row(record)
+        else:
+            flatten_record = flattening.flatten_record(record, schema, max_level=data_flattening_max_level)
+            row = [flatten_record.get(column) for column in schema]
+        for i, (column, value) in enumerate(zip(schema, row)):
+            # Same rule as the CSV format: empty values are loaded as nulls
+            if value == 0 or value:
+                try:
+                    value = converters[i](value)
+                except (TypeError, ValueError) as exc:
+                    raise ValueError(f"Cannot convert value {value!r} of column {column} "
+                                     f"to {fields[i].type}") from exc
+            else:
+                value = None
+            columns[i].append(value)
+
+    return pyarrow.Table.from_arrays(
+        [pyarrow.array(values, type=field.type) for (values, field) in zip(columns, fields)],
+        schema=pyarrow.schema(fields))
+
+
+def _codec(compression) -> str:
+    if isinstance(compression, str):
+        return compression
+    return 'snappy' if compression else 'none'
+
+
+def file_suffix(compression=False, suffix: str = 'parquet') -> str:
+    """Suffix of the Parquet files, the column chunks are compressed inside the file"""
+    return f'.{suffix}'
+
+
+def records_to_fileobj(records: Dict,
+                       schema: Dict,
+                       outfile,
+                       compression=False,
+                       data_flattening_max_level: int = 0,
+                       record_plan=None,
+                       compression_level: int = None) -> None:
+    """
+    Writes a batch of records messages as a Parquet file to a binary file object
+
+    Args:
+        records: List of dictionaries that represents a batch of singer record messages
+        schema: JSONSchema of the records
+        outfile: An open binary file object, stays open
+        compression: Codec of the column chunks: none, snappy, gzip, zstd or lz4. True means snappy,
+            False none (Default: False)
+        data_flattening_max_level: Max level of auto flattening if a record message has nested objects. (Default: 0)
+        record_plan: RecordPlan of the stream reading the columns without flattening the records. (Default: None)
+        compression_level: Compression level of the gzip, zstd and lz4 codecs, default level of the codec if not set,
+            ignored by the other codecs. (Default: None)
+
+    Returns:
+        None
+    """
+    table = records_to_table(records, schema, data_flattening_max_level, record_plan)
+    codec = _codec(compression)
+    # Batches of the automatic mode resolve to none, that doesn't take a level
+    pyarrow.parquet.write_table(table, outfile, compression=codec,
+                                compression_level=compression_level if codec in LEVEL_CODECS else None)
+
+
+def records_to_file(records: Dict,
+                    schema: Dict,
+                    suffix: str = 'parquet',
+                    prefix: str = 'batch_',
+                    compression=False,
+                    dest_dir: str = None,
+                    data_flattening_max_level: int = 0,
+                    record_plan=None,
+                    compression_level: int = None):
+    """
+    Transforms a list of dictionaries with records messages to a Parquet file
+
+    Args:
+        records: List of dictionaries that represents a batch of singer record messages
+        schema: JSONSchema of the records
+        suffix: Generated filename suffix
+        prefix: Generated filename prefix
+        compression: Codec of the column chunks: none, snappy, gzip, zstd or lz4. True means snappy,
+            False none (Default: False)
+        dest_dir: Directory where the Parquet file will be generated. (Default: OS specificy temp directory)
+        data_flattening_max_level: Max level of auto flattening if a record message has nested objects. (Default: 0)
+        record_plan: RecordPlan of the stream reading the columns without flattening the records. (Default: None)
+        compression_level: Compression level of the gzip, zstd and lz4 codecs, default level of the codec if not set,
+            ignored by the other codecs. (Default: None)
+
+    Returns:
+        Absolute path of the generated Parquet file
+    """
+    if dest_dir:
+        os.makedirs(dest_dir, exist_ok=True)
+
+    filedesc, filename = mkstemp(suffix=file_suffix(compression, suffix), prefix=prefix, dir=dest_dir)
+    with open(filedesc, 'wb') as outfile:
+        records_to_fileobj(records, schema, outfile, compression, data_flattening_max_level, record_plan,
+                           compression_level)
+
+    return filename
@@ -0,0 +1,85 @@
+"""Background flushing of stream batches"""
+import queue
+import threading
+
+from typing import Callable, Optional
+
+from singer import get_logger
+
+LOGGER = get_logger('target_iomete')
+
+_STOP = object()
+
+
+class BackgroundFlusher:
+    """
+    Runs flush jobs on a single background thread while the main loop keeps reading messages.
+
+    Jobs are executed strictly in submission order and the state attached to a job is emitted
+    only after the job finished, so an emitted state never covers a batch that is not loaded yet.
+    The number of submitted but not finished jobs is bounded: `submit` blocks when the limit is
+    reached, which applies backpressure to the tap.
+    """
+
+    def __init__(self, emit_state: Callable, max_inflight_batches: int = 2):
+        """
+        Args:
+            emit_state: Function called with the state of every successfully finished job
+            max_inflight_batches: Max number of jobs waiting or running in the background
+        """
+        self.emit_state = emit_state
+        self._queue = queue.Queue()
+        # Acquired by every submitted job and released once it finished, the job taken by the worker included
+        self._inflight = threading.BoundedSemaphore(max(1, max_inflight_batches))
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='target-iomete-flush', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+
+                job, state = item
+                # Skip every remaining job once one failed, their states must not be emitted
+                if self._error is None:
+                    job()
+                    self.emit_state(state)
+            except BaseException as exc:  # pylint: disable=broad-except
+                LOGGER.error('Background flush failed: %s', exc)
+                self._error = exc
+            finally:
+                if item is not _STOP:
+                    self._inflight.release()
+                self._queue.task_done()
+
+    def raise_if_failed(self) -> None:
+        """Re-raise the error of a failed background job in the calling thread"""
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, job: Callable, state: Optional[dict] = None) -> None:
+        """
+        Queue a flush job, blocks if max_inflight_batches jobs are already in flight
+
+        Args:
+            job: Callable without arguments that loads one or more batches
+            state: State to emit once the job and every job submitted before it finished
+        """
+        self.raise_if_failed()
+        self._inflight.acquire()
+        self._queue.put((job, state))
+        self.raise_if_failed()
+
+    def wait(self) -> None:
+        """Block until every submitted job finished"""
+        self._queue.join()
+        self.raise_if_failed()
+
+    def close(self) -> None:
+        """Wait for the in-flight jobs and stop the background thread"""
+        self._queue.put(_STOP)
+        self._thread.join()
+        self.raise_if_failed()
@@ -0,0 +1,141 @@
+"""Statistics of the records of a batch, collected while the batch is buffered"""
+import math
+
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict
+
+# Returned by comparable_value if a value cannot be compared safely with the values loaded into iomete
+NOT_COMPARABLE = object()
+
+
+def comparable_value(value, column_type: str):
+    """
+    Convert a record value to a python value that sorts the same way as the value loaded into the spark column
+
+    Args:
+        value: Value of a record
+        column_type: Spark type of the column, as returned by db_sync.column_type_spark
+
+    Returns:
+        Comparable python value, None for nulls or NOT_COMPARABLE
+    """
+    if value is None:
+        return None
+
+    if column_type in ('long', 'double'):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value
+        return NOT_COMPARABLE
+
+    if column_type == 'timestamp':
+        # Timestamps without timezone are interpreted in the session timezone of iomete, not comparable here
+        try:
+            timestamp = value if isinstance(value, datetime) else datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            return NOT_COMPARABLE
+        return timestamp if timestamp.tzinfo is not None else NOT_COMPARABLE
+
+    if column_type == 'date':
+        try:
+            if isinstance(value, date):
+                return value if not isinstance(value, datetime) else value.date()
+            return datetime.fromisoformat(value).date()
+        except (TypeError, ValueError):
+            return NOT_COMPARABLE
+
+    if column_type == 'string' and isinstance(value, str):
+        return value
+
+    return NOT_COMPARABLE
+
+
+def sql_literal(value, column_type: str):
+    """
+    Convert a value returned by comparable_value to the spark SQL literal of the same value of the column
+
+    Returns:
+        SQL expression or None if the value has no exact literal
+    """
+    if column_type == 'long' and isinstance(value, int):
+        return str(value)
+
+    if column_type == 'double' and isinstance(value, (int, float)) and math.isfinite(value):
+        return repr(float(value))
+
+    if column_type == 'timestamp' and isinstance(value, datetime) and value.tzinfo is not None:
+        # Epoch microseconds are exact and don't depend on the session timezone
+        micros = (value - datetime(1970, 1, 1, tzinfo=timezone.utc)) // timedelta(microseconds=1)
+        return f'TIMESTAMP_MICROS({micros})'
+
+    if column_type == 'date' and isinstance(value, date):
+        return f"DATE '{value.isoformat()}'"
+
+    if column_type == 'string' and isinstance(value, str):
+        escaped = value.replace('\\', '\\\\').replace("'", "\\'")
+        return f"'{escaped}'"
+
+    return None
+
+
+class BatchStats:
+    """Min and max values of selected columns of the records of a batch"""
+
+    def __init__(self, columns: Dict[str, str] = None):
+        """
+        Args:
+            columns: Spark column types of the record properties to collect bounds for, by property name
+        """
+        self.columns = columns or {}
+        self.bounds = {}
+        self.has_nulls = set()
+        self.not_comparable = set()
+
+    def update(self, record: Dict) -> None:
+        """Add a buffered record to the statistics"""
+        for column, column_type in self.columns.items():
+            if column in self.not_comparable:
+                continue
+
+            value = comparable_value(record.get(column), column_type)
+            if value is None:
+                self.has_nulls.add(column)
+            elif value is NOT_COMPARABLE:
+                self.not_comparable.add(column)
+            elif column not in self.bounds:
+                self.bounds[column] = (value, value)
+            else:
+                min_value, max_value = self.bounds[column]
+                try:
+                    if value < min_value:
+                        self.bounds[column] = (value, max_value)
+                    elif value > max_value:
+                        self.bounds[column] = (min_value, value)
+                except TypeError:
+                    self.not_comparable.add(column)
+
+    def min_max(self, column: str):
+        """
+        Bounds of a column
+
+        Returns:
+            (min, max) tuple of the non null values or None if the values of the column are not comparable
+        """
+        if column in self.not_comparable:
+            return None
+        return self.bounds.get(column)
+
+    def merge(self, other: 'BatchStats') -> None:
+        """Add the statistics of another batch of the same columns"""
+        self.has_nulls.update(other.has_nulls)
+        self.not_comparable.update(other.not_comparable)
+        for column, (other_min, other_max) in other.bounds.items():
+            if column in self.not_comparable:
+                continue
+            if column not in self.bounds:
+                self.bounds[column] = (other_min, other_max)
+                continue
+            min_value, max_value = self.bounds[column]
+            try:
+                self.bounds[column] = (min(min_value, other_min), max(max_value, other_max))
+            except TypeError:
+                self.not_comparable.add(column)
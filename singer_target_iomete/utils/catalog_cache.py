@@ -0,0 +1,130 @@
+"""In-memory snapshot of the iomete catalog"""
+import re
+import threading
+
+from typing import Callable, Dict, List, Optional
+
+from singer import get_logger
+
+LOGGER = get_logger('target_iomete')
+
+# Column types printed by the schema tree of SHOW TABLE EXTENDED that DESCRIBE prints differently
+TREE_STRING_TYPES = {
+    'long': 'bigint',
+    'integer': 'int',
+    'short': 'smallint',
+    'byte': 'tinyint'
+}
+
+SCHEMA_TREE_COLUMN = re.compile(r'^ \|-- (?P<name>.+?): (?P<type>\S+) \(nullable = (true|false)\)$')
+
+
+def _normalize(name: str) -> str:
+    return name.replace('`', '').lower()
+
+
+def parse_table_columns(information: str) -> Optional[List[Dict]]:
+    """
+    Extract the top level columns from the information column of a SHOW TABLE EXTENDED row
+
+    Returns:
+        List of columns in the format of DbSync.get_table_columns or None if the schema is not printed
+    """
+    lines = information.split('\n')
+    if 'Schema: root' not in lines:
+        return None
+
+    columns = []
+    for line in lines[lines.index('Schema: root') + 1:]:
+        match = SCHEMA_TREE_COLUMN.match(line)
+        if match:
+            data_type = match.group('type')
+            columns.append({'COLUMN_NAME': match.group('name'),
+                            'DATA_TYPE': TREE_STRING_TYPES.get(data_type, data_type)})
+    return columns
+
+
+class CatalogCache:
+    """
+    Schemas, tables and columns of the target schemas, loaded in a few bulk queries at startup.
+
+    Lookups answer from memory. None means the cache doesn't know the answer and the catalog
+    has to be queried. DbSync keeps the cache up to date when it creates or alters objects.
+    """
+
+    def __init__(self):
+        self._schemas = set()
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, execute_query: Callable, schema_names: List[str]) -> 'CatalogCache':
+        """
+        Load the snapshot of the target schemas
+
+        Args:
+            execute_query: Function running a query and returning the rows as list of dictionaries
+            schema_names: Target schemas to load tables and columns from
+        """
+        cache = cls()
+
+        for row in execute_query('SHOW SCHEMAS'):
+            cache.add_schema(list(row.values())[0])
+
+        for schema_name in sorted({_normalize(name) for name in schema_names if name}):
+            if not cache.has_schema(schema_name):
+                continue
+
+            tables = {}
+            for row in execute_query(f'SHOW TABLES IN {schema_name}'):
+                if not row.get('isTemporary'):
+                    tables[_normalize(row['tableName'])] = None
+
+            # Columns of every table in a single query, described table by table later if not supported
+            try:
+                for row in execute_query(f"SHOW TABLE EXTENDED IN {schema_name} LIKE '*'"):
+                    table_name = _normalize(row['tableName'])
+                    if table_name in tables:
+                        tables[table_name] = parse_table_columns(row.get('information') or '')
+            except Exception as exc:
+                LOGGER.info('Cannot load columns of the tables in %s, describing them when needed: %s',
+                            schema_name, exc)
+
+            with cache._lock:
+                cache._tables[schema_name] = tables
+
+        LOGGER.info('Catalog cache loaded: %d schemas, %d tables',
+                    len(cache._schemas), sum(len(tables) for tables in cache._tables.values()))
+        return cache
+
+    def has_schema(self, schema_name: str) -> bool:
+        """Whether the schema exists"""
+        with self._lock:
+            return _normalize(schema_name) in self._schemas
+
+    def add_schema(self, schema_name: str, created: bool = False) -> None:
+        """Register a schema, a schema created by the target is known to have no tables"""
+        with self._lock:
+            self._schemas.add(_normalize(schema_name))
+            if created:
+                self._tables[_normalize(schema_name)] = {}
+
+    def has_table(self, schema_name: str, table_name: str) -> Optional[bool]:
+        """Whether the table exists, None if the tables of the schema are not cached"""
+        with self._lock:
+            tables = self._tables.get(_normalize(schema_name))
+            if tables is None:
+                return None
+            return _normalize(table_name) in tables
+
+    def get_columns(self, schema_name: str, table_name: str) -> Optional[List[Dict]]:
+        """Columns of the table in the format of DbSync.get_table_columns, None if not cached"""
+        with self._lock:
+            return self._tables.get(_normalize(schema_name), {}).get(_normalize(table_name))
+
+    def set_columns(self, schema_name: str, table_name: str, columns: Optional[List[Dict]]) -> None:
+        """Register an existing table with its columns, None columns invalidates the cached ones"""
+        with self._lock:
+            # Tables of schemas not in the snapshot stay unknown, a single table doesn't tell about the others
+            if _normalize(schema_name) in self._tables:
+                self._tables[_normalize(schema_name)][_normalize(table_name)] = columns
@@ -0,0 +1,83 @@
+"""Coalescing of staged batches into fewer loads"""
+import threading
+import time
+
+from typing import Callable, Dict
+
+
+class CommitCoalescer:
+    """
+    Staged batches of every stream waiting to be loaded together, so that a stream gets a single MERGE,
+    and a single snapshot of its table, for several batches.
+
+    The files of the batches of a stream are staged under a common commit prefix, named in batch order, and
+    loaded from the prefix once the commit is due: when the oldest waiting batch is interval_seconds old or
+    max_files files are waiting.
+    """
+
+    def __init__(self, interval_seconds: float = None, max_files: int = None, clock: Callable = time.monotonic):
+        """
+        Args:
+            interval_seconds: Max age of the oldest waiting batch. (Default: None, no time limit)
+            max_files: Max number of waiting staged files across every stream. (Default: None, no file limit)
+            clock: Function returning the current time in seconds. (Default: time.monotonic)
+        """
+        self.interval_seconds = interval_seconds
+        self.max_files = max_files
+        self.clock = clock
+        self.committed_state = None
+        self._commits = {}
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def batch_key_prefix(self, stream: str, db_sync) -> str:
+        """Prefix of the staged files of the next batch of a stream, ordered after the files of its previous ones"""
+        with self._lock:
+            if stream not in self._commits:
+                self._commits[stream] = {'s3_key': db_sync.stage_commit_key(stream), 'batches': [], 'sequence': 0}
+            commit = self._commits[stream]
+            commit['sequence'] += 1
+            return f"{commit['s3_key']}{commit['sequence']:06d}_"
+
+    def add(self, stream: str, batch: Dict) -> None:
+        """Add a staged batch to the next commit of its stream"""
+        with self._lock:
+            self._commits[stream]['batches'].append(batch)
+            if self._opened_at is None:
+                self._opened_at = self.clock()
+
+    def has_pending(self, stream: str) -> bool:
+        """Whether batches of a stream are waiting for the next commit"""
+        with self._lock:
+            return bool(self._commits.get(stream, {}).get('batches'))
+
+    def pending_files(self) -> int:
+        """Number of staged files waiting for the next commit"""
+        with self._lock:
+            return sum(len(batch['files']) for commit in self._commits.values() for batch in commit['batches'])
+
+    def is_due(self) -> bool:
+        """Whether the waiting batches must be loaded now"""
+        if self._opened_at is None:
+            return False
+        if self.max_files and self.pending_files() >= self.max_files:
+            return True
+        return self.interval_seconds is not None and self.clock() - self._opened_at >= self.interval_seconds
+
+    def take(self) -> Dict[str, Dict]:
+        """
+        Take the commits of every stream with waiting batches
+
+        Returns:
+            Dictionary of commits by stream, every commit with the s3_key prefix and the list of its batches in order
+        """
+        with self._lock:
+            commits = {stream: commit for (stream, commit) in self._commits.items() if commit['batches']}
+            self._commits = {}
+            self._opened_at = None
+        return commits
+
+    def take_committed_state(self):
+        """State of the last commit if it hasn't been taken yet, None otherwise"""
+        state, self.committed_state = self.committed_state, None
+        return state
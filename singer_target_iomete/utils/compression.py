@@ -0,0 +1,199 @@
+"""Compression codecs of the staged files"""
+import gzip
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Codecs iomete can read by file format. CSV files are decompressed by the hadoop codec matching the file
+# extension, lz4 and snappy CSV files need the hadoop framing that python libraries don't write.
+CODECS = {
+    'csv': ['none', 'gzip', 'zstd'],
+    'parquet': ['none', 'snappy', 'gzip', 'zstd', 'lz4']
+}
+
+DEFAULT_CODECS = {
+    'csv': 'gzip',
+    'parquet': 'snappy'
+}
+
+# Codecs with compression levels, parquet files fail to write with a level set for the others
+LEVEL_CODECS = ['gzip', 'zstd', 'lz4']
+
+# Skips compression of the tiny batches, compresses the others with the default codec of the file format
+AUTO = 'auto'
+AUTO_MIN_ROWS = 1000
+
+# Uncompressed size of the blocks compressed in parallel, every block is a gzip member of the file
+PARALLEL_BLOCK_SIZE = 4 * 1024 * 1024
+
+FILE_EXTENSIONS = {
+    'none': '',
+    'gzip': '.gz',
+    'zstd': '.zst'
+}
+
+
+def supported_codecs(file_format_name: str) -> List[str]:
+    """Compression options of a file format"""
+    return CODECS[file_format_name.lower()] + [AUTO]
+
+
+def configured_codec(config: dict) -> str:
+    """Compression of the staged files set in the config, the legacy no_compression option disables it"""
+    if config.get('no_compression'):
+        return 'none'
+    file_format_name = str(config.get('file_format', 'csv')).lower()
+    return str(config.get('compression', DEFAULT_CODECS.get(file_format_name, 'gzip'))).lower()
+
+
+def validate_compression(config: dict) -> List[str]:
+    """Validate the compression options, returns the list of errors"""
+    errors = []
+    file_format_name = str(config.get('file_format', 'csv')).lower()
+    if file_format_name not in CODECS:
+        return errors
+
+    codec = configured_codec(config)
+    if codec not in supported_codecs(file_format_name):
+        errors.append(f"Unknown compression for the {file_format_name} file_format: {codec}. "
+                      f"Supported compressions: {', '.join(supported_codecs(file_format_name))}")
+    elif codec == 'zstd' and file_format_name == 'csv' and zstandard is None:
+        errors.append("zstd compression of CSV files requires the zstandard package. "
+                      "Install it with `pip install zstandard`")
+
+    level = config.get('compression_level')
+    if level is not None and (not isinstance(level, int) or isinstance(level, bool)):
+        errors.append(f"compression_level must be an integer: {level}")
+    elif level is not None and file_format_name == 'parquet' and codec not in LEVEL_CODECS:
+        errors.append(f"'compression_level' is not supported by the {codec} compression of the parquet file_format. "
+                      f"Supported compressions: {', '.join(LEVEL_CODECS)}")
+
+    threads = config.get('compression_threads', 1)
+    if not isinstance(threads, int) or isinstance(threads, bool) or threads < 1:
+        errors.append(f"compression_threads must be a positive integer: {threads}")
+    elif threads > 1 and file_format_name != 'csv':
+        errors.append("'compression_threads' is supported only with the csv file_format")
+
+    return errors
+
+
+def resolve_codec(codec: str, file_format_name: str, row_count: int) -> str:
+    """Codec compressing a batch of row_count records, resolves the automatic mode"""
+    if codec == AUTO:
+        if row_count < AUTO_MIN_ROWS:
+            return 'none'
+        return DEFAULT_CODECS[file_format_name.lower()]
+    return codec
+
+
+def file_extension(codec: str) -> str:
+    """Extension of the CSV files compressed by a codec, iomete picks the decompression by the extension"""
+    return FILE_EXTENSIONS[codec]
+
+
+class ParallelGzipWriter:
+    """
+    Binary file object compressing the written data on a pool of threads, pigz style. The data is cut
+    into blocks compressed independently and written in order as the members of a multi-member gzip
+    file, that gzip readers decompress as a single stream.
+
+    At most two blocks per thread are in memory, compressed or waiting for compression.
+    """
+
+    def __init__(self, fileobj, level: int = 9, threads: int = 2, block_size: int = PARALLEL_BLOCK_SIZE):
+        """
+        Args:
+            fileobj: An open binary file object receiving the compressed data
+            level: Compression level of every block. (Default: 9)
+            threads: Number of compression threads. (Default: 2)
+            block_size: Uncompressed size of the blocks. (Default: PARALLEL_BLOCK_SIZE)
+        """
+        self.fileobj = fileobj
+        self.level = level
+        self.block_size = block_size
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='compress')
+        self._max_pending = 2 * threads
+        self._pending = deque()
+        self._chunks = []
+        self._buffered = 0
+        self._written_blocks = 0
+
+    def write(self, data) -> int:
+        """Buffer data, compress the buffer once it reaches the block size"""
+        self._chunks.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.block_size:
+            self._submit_block()
+        return len(data)
+
+    def _submit_block(self) -> None:
+        block = b''.join(self._chunks)
+        self._chunks = []
+        self._buffered = 0
+        # zlib releases the GIL while compressing, so the blocks are compressed in parallel
+        self._pending.append(self._executor.submit(gzip.compress, block, self.level, mtime=0))
+        while len(self._pending) >= self._max_pending:
+            self._write_block()
+
+    def _write_block(self) -> None:
+        self.fileobj.write(self._pending.popleft().result())
+        self._written_blocks += 1
+
+    def close(self) -> None:
+        """Compress the remaining data and write every block, the wrapped file object stays open"""
+        try:
+            if self._buffered or (not self._pending and not self._written_blocks):
+                self._submit_block()
+            while self._pending:
+                self._write_block()
+        finally:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._pending.clear()
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+@contextmanager
+def compressed_writer(fileobj, codec: str, level: int = None, threads: int = 1):
+    """
+    Wrap a binary file object to write compressed data
+
+    Args:
+        fileobj: An open binary file object
+        codec: none, gzip or zstd
+        level: Compression level, default level of the codec if not set. (Default: None)
+        threads: Number of compression threads, more than one writes multi-member gzip files. (Default: 1)
+    """
+    if codec == 'none':
+        yield fileobj
+    elif codec == 'gzip' and threads > 1:
+        with ParallelGzipWriter(fileobj, 9 if level is None else level, threads) as writer:
+            yield writer
+    elif codec == 'gzip':
+        with gzip.GzipFile(mode='wb', fileobj=fileobj,
+                           compresslevel=9 if level is None else level) as gzipfile:
+            yield gzipfile
+    elif codec == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstd compression requires zstandard. Install it with `pip install zstandard`')
+        # Multi-threaded zstandard compresses chunks of the input in parallel into a single frame
+        compressor = zstandard.ZstdCompressor(level=3 if level is None else level,
+                                              threads=threads if threads > 1 else 0)
+        with compressor.stream_writer(fileobj, closefd=False) as writer:
+            yield writer
+    else:
+        raise ValueError(f"Unsupported compression: {codec}")
@@ -0,0 +1,115 @@
+"""Pool of iomete connections shared by every stream"""
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Callable
+
+from singer import get_logger
+
+LOGGER = get_logger('target_iomete')
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of DB-API connections.
+
+    At most max_size connections are open at the same time, callers wait for a free connection
+    above it. Connections idle for longer than health_check_seconds are checked with a cheap query
+    before reuse and reopened if the session died. Connections idle for longer than
+    idle_timeout_seconds are closed.
+    """
+
+    def __init__(self,
+                 connect: Callable,
+                 max_size: int = 16,
+                 idle_timeout_seconds: float = 300,
+                 health_check_seconds: float = 60):
+        """
+        Args:
+            connect: Function opening a new connection
+            max_size: Max number of open connections
+            idle_timeout_seconds: Close connections not used for this long
+            health_check_seconds: Check connections not used for this long before handing them out
+        """
+        self.connect = connect
+        self.max_size = max(1, max_size)
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self.health_check_seconds = health_check_seconds
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+
+    @staticmethod
+    def is_alive(connection) -> bool:
+        """Run a cheap query to check if the session of a connection is still open"""
+        try:
+            cursor = connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchall()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(connection) -> None:
+        try:
+            connection.close()
+        except Exception as exc:
+            LOGGER.debug('Closing connection failed: %s', exc)
+
+    def _evict_idle(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            expired = [conn for (conn, last_used) in self._idle if now - last_used > self.idle_timeout_seconds]
+            self._idle = [(conn, last_used) for (conn, last_used) in self._idle
+                          if now - last_used <= self.idle_timeout_seconds]
+        for connection in expired:
+            LOGGER.debug('Closing connection idle for more than %s seconds', self.idle_timeout_seconds)
+            self._close(connection)
+
+    def _checkout(self):
+        self._evict_idle()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                connection, last_used = self._idle.pop()
+
+            if time.monotonic() - last_used < self.health_check_seconds or self.is_alive(connection):
+                return connection
+
+            LOGGER.info('Pooled connection is not alive anymore, reconnecting')
+            self._close(connection)
+
+        return self.connect()
+
+    def _checkin(self, connection) -> None:
+        with self._lock:
+            self._idle.append((connection, time.monotonic()))
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, waits if every connection is in use"""
+        self._slots.acquire()
+        try:
+            connection = self._checkout()
+            try:
+                yield connection
+            except Exception:
+                # The query failed, keep the connection only if its session survived
+                if self.is_alive(connection):
+                    self._checkin(connection)
+                else:
+                    self._close(connection)
+                raise
+            self._checkin(connection)
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for (connection, _) in idle:
+            self._close(connection)
@@ -0,0 +1,65 @@
+"""Record buffer spilled to disk"""
+import os
+import pickle
+import tempfile
+
+from collections.abc import MutableMapping
+
+
+class DiskBuffer(MutableMapping):
+    """
+    Buffered records of a stream kept in a temporary file, only the primary keys and the file
+    offsets stay in memory. Behaves like the dictionary of records it replaces, records of streams
+    without primary key are appended.
+
+    The file is deleted when the buffer is closed or garbage collected.
+    """
+
+    def __init__(self, records=None, dest_dir: str = None):
+        """
+        Args:
+            records: Records to move to disk, dictionary by primary key or list of records without primary key
+            dest_dir: Directory of the temporary file. (Default: OS specific temp directory)
+        """
+        if dest_dir:
+            os.makedirs(dest_dir, exist_ok=True)
+        self._file = tempfile.TemporaryFile(prefix='buffer_', dir=dest_dir)
+        self._offsets = {}
+        if isinstance(records, list):
+            for record in records:
+                self.append(record)
+        elif records:
+            self.update(records)
+
+    def __setitem__(self, key, record):
+        # Replaced records stay in the file, the space is released only when the buffer is closed
+        data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        offset = self._file.seek(0, os.SEEK_END)
+        self._file.write(data)
+        self._offsets[key] = (offset, len(data))
+
+    def append(self, record) -> None:
+        """Add a record of a stream without primary key"""
+        self[len(self._offsets)] = record
+
+    def __getitem__(self, key):
+        offset, size = self._offsets[key]
+        self._file.seek(offset)
+        return pickle.loads(self._file.read(size))
+
+    def __delitem__(self, key):
+        del self._offsets[key]
+
+    def __contains__(self, key):
+        return key in self._offsets
+
+    def __iter__(self):
+        return iter(self._offsets)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def close(self) -> None:
+        """Delete the temporary file"""
+        self._offsets = {}
+        self._file.close()
@@ -0,0 +1,87 @@
+"""Staged flush pipeline"""
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Hashable, List, Tuple
+
+from singer import get_logger
+
+LOGGER = get_logger('target_iomete')
+
+
+class FlushPipeline:
+    """
+    Moves batches through a list of stages where every stage has its own bounded thread pool.
+
+    Consecutive batches overlap: while one batch is in the last stage, the next ones can already be
+    processed by the earlier stages. The last stage runs in submission order for batches sharing
+    the same key, so batches of the same stream are always loaded in the order they were read.
+    A batch fails if the previous batch of the same key failed.
+    """
+
+    def __init__(self, stages: List[Tuple[str, Callable, int]], max_inflight_batches: int):
+        """
+        Args:
+            stages: List of (name, function, number of workers) tuples. Every function takes the
+                    output of the previous stage, the first one the submitted batch
+            max_inflight_batches: Max number of batches in the pipeline, submit blocks above it
+        """
+        self.stages = stages
+        self._executors = [
+            ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=f'target-iomete-{name}')
+            for (name, _, workers) in stages
+        ]
+        self._inflight = threading.BoundedSemaphore(max(1, max_inflight_batches))
+        self._last_batches = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key: Hashable, batch) -> Future:
+        """
+        Send a batch into the pipeline
+
+        Args:
+            key: Batches with the same key run the last stage in submission order
+            batch: Input of the first stage
+
+        Returns:
+            Future resolving to the output of the last stage
+        """
+        self._inflight.acquire()
+        result = Future()
+        result.add_done_callback(lambda _: self._inflight.release())
+
+        with self._lock:
+            previous = self._last_batches.get(key)
+            self._last_batches[key] = result
+
+        self._run_stage(0, batch, previous, result)
+        return result
+
+    def _run_stage(self, index: int, value, previous: Future, result: Future) -> None:
+        if index == len(self.stages) - 1 and previous is not None and not previous.done():
+            # The last stage has to wait for the previous batch with the same key
+            previous.add_done_callback(lambda _: self._run_stage(index, value, previous, result))
+            return
+
+        if index == len(self.stages) - 1 and previous is not None and previous.exception() is not None:
+            result.set_exception(RuntimeError(f'Previous batch failed: {previous.exception()}'))
+            return
+
+        name, func, _ = self.stages[index]
+
+        def on_done(stage_future: Future):
+            exc = stage_future.exception()
+            if exc is not None:
+                LOGGER.error('Flush pipeline stage %s failed: %s', name, exc)
+                result.set_exception(exc)
+            elif index == len(self.stages) - 1:
+                result.set_result(stage_future.result())
+            else:
+                self._run_stage(index + 1, stage_future.result(), previous, result)
+
+        self._executors[index].submit(func, value).add_done_callback(on_done)
+
+    def shutdown(self) -> None:
+        """Wait for the running stages and release the worker threads"""
+        for executor in self._executors:
+            executor.shutdown(wait=True)
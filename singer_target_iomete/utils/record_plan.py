@@ -0,0 +1,158 @@
+"""Per-stream record transform plan"""
+import json
+
+from collections.abc import MutableMapping
+from typing import Dict, List
+
+from singer_target_iomete.utils import flattening, stream_utils
+from singer_target_iomete.utils.exceptions import PrimaryKeyNotFoundException
+
+# Value of a column not produced by flattening the record
+MISSING = object()
+
+
+def column_paths(schema: Dict, parent_key: tuple = (), sep: str = '__', level: int = 0, max_level: int = 0) -> Dict:
+    """
+    Walk the schema the same way as flattening.flatten_schema
+
+    Returns:
+        Dictionary of (path of keys in the record, level of the last key) by flattened column name
+    """
+    paths = {}
+    for k, v in schema.get('properties', {}).items():
+        if 'type' in v.keys() and 'object' in v['type'] and 'properties' in v and level < max_level:
+            paths.update(column_paths(v, parent_key + (k,), sep=sep, level=level + 1, max_level=max_level))
+        else:
+            paths[flattening.flatten_key(k, list(parent_key), sep)] = (parent_key + (k,), level)
+    return paths
+
+
+class RecordPlan:
+    """
+    Schema interpretation of a stream compiled once from the SCHEMA message: the date typed
+    properties, the path of every flattened column in the records, the column order and the
+    primary key columns.
+
+    Reading a column follows the rules of flattening.flatten_record without flattening the record.
+    """
+
+    def __init__(self, schema: Dict, flatten_schema: Dict, key_properties: List, data_flattening_max_level: int = 0):
+        """
+        Args:
+            schema: JSONSchema of the stream
+            flatten_schema: Flattened JSONSchema of the stream
+            key_properties: Primary key columns
+            data_flattening_max_level: Max level of auto flattening if a record message has nested objects
+        """
+        self.flatten_schema = flatten_schema
+        self.key_properties = key_properties
+        self.data_flattening_max_level = data_flattening_max_level
+        self.timestamp_properties = stream_utils.get_timestamp_properties(schema) if 'properties' in schema else {}
+        self.columns = list(flatten_schema)
+
+        paths = column_paths(schema, max_level=data_flattening_max_level)
+        self._readers = {}
+        for column in self.columns:
+            if column not in paths:
+                continue
+            path, leaf_level = paths[column]
+            self._readers[column] = (
+                path,
+                # Nested objects below the max level are flattened into other columns
+                leaf_level < data_flattening_max_level,
+                # Same condition as flattening._should_json_dump_value, that looks up the last key only
+                flattening._should_json_dump_value(path[-1], None, flatten_schema)
+            )
+
+        # Integer keys are compared as numbers, unless strings are allowed in the column as well
+        self._int_keys = {
+            key_property for key_property in key_properties
+            if 'string' not in flatten_schema.get(key_property, {}).get('type', ['string'])
+        }
+
+        # Columns without a path are read by flattening the whole record
+        self._row_readers = [self._readers.get(column) for column in self.columns]
+        self._compiled = all(reader is not None for reader in self._row_readers)
+
+    @staticmethod
+    def _read(record: Dict, reader: tuple):
+        path, flatten_leaf, json_dump = reader
+        value = record
+        for key in path:
+            if not isinstance(value, MutableMapping):
+                return MISSING
+            value = value.get(key, MISSING)
+            if value is MISSING:
+                return MISSING
+
+        if flatten_leaf and isinstance(value, MutableMapping):
+            return MISSING
+        if json_dump or isinstance(value, (dict, list)):
+            return json.dumps(value)
+        return value
+
+    def adjust_timestamps(self, record: Dict) -> None:
+        """Reset the out of range date typed values of a record, see stream_utils.adjust_timestamps_in_record"""
+        for key, _format in self.timestamp_properties.items():
+            if record.get(key) is not None:
+                stream_utils.reset_invalid_timestamp(record, key, _format)
+
+    def row(self, record: Dict) -> list:
+        """Values of a record in column order, None for the missing columns"""
+        if not self._compiled:
+            flatten = flattening.flatten_record(record, self.flatten_schema, max_level=self.data_flattening_max_level)
+            return [flatten.get(column) for column in self.columns]
+
+        read = self._read
+        row = [read(record, reader) for reader in self._row_readers]
+        return [None if value is MISSING else value for value in row]
+
+    def primary_key(self, record: Dict):
+        """
+        Compact primary key of the record, equal for the records with the same primary key string
+
+        Returns:
+            Value of a single primary key column, tuple of the values of composite primary keys or None
+        """
+        if len(self.key_properties) == 0:
+            return None
+
+        key_props = []
+        for key_property in self.key_properties:
+            reader = self._readers.get(key_property)
+            value = self._read(record, reader) if reader else MISSING
+            if value is MISSING:
+                key_props = self._flattened_primary_key_values(record)
+                break
+            # Values of other types are compared by their string, as in the primary key string
+            if type(value) is str or (type(value) is int and key_property in self._int_keys):
+                key_props.append(value)
+            else:
+                key_props.append(str(value))
+
+        return key_props[0] if len(key_props) == 1 else tuple(key_props)
+
+    def primary_key_string(self, record: Dict):
+        """Generate a unique PK string in the record"""
+        if len(self.key_properties) == 0:
+            return None
+
+        key_props = []
+        for key_property in self.key_properties:
+            reader = self._readers.get(key_property)
+            value = self._read(record, reader) if reader else MISSING
+            if value is MISSING:
+                return ','.join(self._flattened_primary_key_values(record))
+            key_props.append(str(value))
+        return ','.join(key_props)
+
+    def _flattened_primary_key_values(self, record: Dict) -> List[str]:
+        flatten = flattening.flatten_record(record, self.flatten_schema, max_level=self.data_flattening_max_level)
+        try:
+            key_props = [str(flatten[p]) for p in self.key_properties]
+        except Exception as exc:
+            pks = self.key_properties
+            fields = list(flatten.keys())
+            raise PrimaryKeyNotFoundException(f"Cannot find {pks} primary key(s) in record. "
+                                              f"Available fields: {fields}") from exc
+        return key_props
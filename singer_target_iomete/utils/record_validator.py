@@ -0,0 +1,98 @@
+"""Compiled JSON schema validation of records"""
+import hashlib
+import json
+
+from functools import partial
+from typing import Callable, Dict
+
+from jsonschema import Draft7Validator, FormatChecker
+from singer import get_logger
+
+from singer_target_iomete.utils import stream_utils
+
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
+
+LOGGER = get_logger('target_iomete')
+
+FORMAT_CHECKER = FormatChecker()
+
+# Formats defined by JSON schema draft 7
+DRAFT7_FORMATS = ['date-time', 'date', 'time', 'email', 'idn-email', 'hostname', 'idn-hostname', 'ipv4', 'ipv6',
+                  'uri', 'uri-reference', 'iri', 'iri-reference', 'uri-template', 'json-pointer',
+                  'relative-json-pointer', 'regex']
+
+
+def _any_value(_value) -> bool:
+    return True
+
+
+# Compiled validators check formats with the same functions as jsonschema, formats jsonschema can't check pass
+FORMATS = dict({name: _any_value for name in DRAFT7_FORMATS},
+               **{name: partial(FORMAT_CHECKER.conforms, format=name) for name in FORMAT_CHECKER.checkers})
+
+# Validate functions by schema hash, shared by every stream with the same schema
+_compiled_validators = {}
+
+
+def schema_hash(schema: Dict) -> str:
+    """Hash of the canonical JSON of a schema"""
+    return hashlib.sha1(json.dumps(schema, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def uses_multiple_of(schema) -> bool:
+    """Whether a multipleOf keyword is used anywhere in the schema"""
+    if isinstance(schema, dict):
+        return 'multipleOf' in schema or any(uses_multiple_of(value) for value in schema.values())
+    if isinstance(schema, list):
+        return any(uses_multiple_of(value) for value in schema)
+    return False
+
+
+def _compile(schema: Dict) -> Callable:
+    # multipleOf needs exact decimal arithmetic, checked on a Decimal copy of the record
+    if uses_multiple_of(schema):
+        validator = Draft7Validator(stream_utils.float_to_decimal(schema), format_checker=FORMAT_CHECKER)
+        return lambda record: validator.validate(stream_utils.float_to_decimal(record))
+
+    if fastjsonschema is not None:
+        try:
+            return fastjsonschema.compile(schema, formats=FORMATS)
+        except Exception as exc:
+            LOGGER.warning('Cannot compile the schema, validating records with jsonschema: %s', exc)
+
+    return Draft7Validator(schema, format_checker=FORMAT_CHECKER).validate
+
+
+def compile_validator(schema: Dict) -> Callable:
+    """Get the validate function of a schema, compiled once per distinct schema"""
+    key = schema_hash(schema)
+    if key not in _compiled_validators:
+        _compiled_validators[key] = _compile(schema)
+    return _compiled_validators[key]
+
+
+class RecordValidator:
+    """Validates the records of a stream, or an evenly spread fraction of them"""
+
+    def __init__(self, schema: Dict, sample_rate: float = 1.0):
+        """
+        Args:
+            schema: JSONSchema of the stream
+            sample_rate: Fraction of the records to validate, the first record is always validated
+        """
+        self.sample_rate = sample_rate
+        self._validate = compile_validator(schema)
+        self._credit = 1.0
+
+    def validate(self, record: Dict) -> None:
+        """Validate a record if it's in the sample, raises an exception if the record is invalid"""
+        if self.sample_rate < 1:
+            if self.sample_rate <= 0 or self._credit < 1:
+                self._credit += self.sample_rate
+                return
+            self._credit += self.sample_rate - 1
+
+        self._validate(record)
@@ -0,0 +1,147 @@
+"""Streaming upload of staged files to S3"""
+import io
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.s3.transfer import TransferConfig
+
+# S3 rejects the parts of a multipart upload smaller than 5 MB, except the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class S3StreamWriter:
+    """
+    Binary file object uploading the written data to an S3 object without a local file.
+
+    The data is buffered in memory up to the multipart threshold of the transfer config: smaller files are
+    uploaded in a single request when the writer is closed, larger ones as a multipart upload sending every
+    part of the multipart chunk size as soon as it's full. Parts are uploaded in the background while the
+    next one is written, so at most max_concurrency + 1 parts are in memory.
+    """
+
+    def __init__(self, s3_client, bucket: str, key: str, transfer_config: TransferConfig = None,
+                 extra_args: dict = None, max_concurrency: int = 1):
+        """
+        Args:
+            s3_client: boto3 S3 client
+            bucket: Bucket of the object
+            key: Key of the object
+            transfer_config: Multipart threshold and chunk size, at least MIN_PART_SIZE. (Default: boto3 defaults)
+            extra_args: Extra arguments of the upload requests, e.g. ACL. (Default: None)
+            max_concurrency: Max number of parts uploaded at the same time. (Default: 1)
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.transfer_config = transfer_config or TransferConfig()
+        self.multipart_threshold = max(self.transfer_config.multipart_threshold, MIN_PART_SIZE)
+        self.part_size = max(self.transfer_config.multipart_chunksize, MIN_PART_SIZE)
+        self.extra_args = extra_args or {}
+        self.max_concurrency = max_concurrency
+        self.closed = False
+        self._chunks = []
+        self._buffered = 0
+        self._position = 0
+        self._upload_id = None
+        self._parts = []
+        self._executor = None
+        self._uploading = deque()
+
+    def write(self, data) -> int:
+        """Buffer data, upload a part once the buffer reaches the part size"""
+        if self.closed:
+            raise ValueError('I/O operation on closed S3 stream')
+        self._chunks.append(bytes(data))
+        self._buffered += len(data)
+        self._position += len(data)
+        if self._buffered >= (self.part_size if self._upload_id else self.multipart_threshold):
+            self._upload_part()
+        return len(data)
+
+    def tell(self) -> int:
+        """Number of bytes written"""
+        return self._position
+
+    def flush(self) -> None:
+        """Parts are uploaded only once they are full"""
+
+    @staticmethod
+    def writable() -> bool:
+        return True
+
+    @staticmethod
+    def seekable() -> bool:
+        return False
+
+    def _take_buffer(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self._buffered = 0
+        return data
+
+    def _upload_part(self) -> None:
+        if self._upload_id is None:
+            self._upload_id = self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                                                     **self.extra_args)['UploadId']
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='s3_part')
+
+        data = self._take_buffer()
+        while len(self._uploading) >= self.max_concurrency:
+            self._wait_for_part()
+        part_number = len(self._parts) + len(self._uploading) + 1
+        self._uploading.append(self._executor.submit(self._send_part, part_number, data))
+
+    def _send_part(self, part_number: int, data: bytes) -> dict:
+        response = self.s3_client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                              PartNumber=part_number, Body=data)
+        return {'ETag': response['ETag'], 'PartNumber': part_number}
+
+    def _wait_for_part(self) -> None:
+        self._parts.append(self._uploading.popleft().result())
+
+    def close(self) -> None:
+        """Upload the remaining data and complete the upload of the object"""
+        if self.closed:
+            return
+        try:
+            if self._upload_id is None:
+                self.s3_client.upload_fileobj(io.BytesIO(self._take_buffer()), self.bucket, self.key,
+                                              ExtraArgs=self.extra_args or None, Config=self.transfer_config)
+            else:
+                if self._buffered:
+                    self._upload_part()
+                while self._uploading:
+                    self._wait_for_part()
+                self.s3_client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                                         MultipartUpload={'Parts': self._parts})
+        except Exception:
+            self.abort()
+            raise
+        self._shutdown()
+        self.closed = True
+
+    def abort(self) -> None:
+        """Discard the written data, the uploaded parts are deleted"""
+        self._chunks = []
+        self._buffered = 0
+        self._shutdown()
+        if self._upload_id is not None:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            self._upload_id = None
+        self.closed = True
+
+    def _shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._uploading.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
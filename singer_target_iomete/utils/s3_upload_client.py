@@ -2,10 +2,100 @@
 S3 Upload Client
 """
 import os
+import threading
 import boto3
 import datetime
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from singer import get_logger
 
+from singer_target_iomete.utils.s3_stream_writer import S3StreamWriter
+from singer_target_iomete.utils.stage_cleaner import get_stage_cleaner
+
+# How the loaded staged files are deleted: queued to a background cleaner, deleted one by one
+# before the next batch, or left to a lifecycle rule of the bucket
+STAGE_CLEANUP_MODES = ['background', 'sync', 'lifecycle']
+
+
+# Connections of the S3 client, shared by the upload threads of every flushed stream
+DEFAULT_MAX_POOL_CONNECTIONS = 64
+
+# Transfer config options by config key
+TRANSFER_CONFIG_KEYS = {
+    's3_multipart_threshold': 'multipart_threshold',
+    's3_multipart_chunksize': 'multipart_chunksize',
+    's3_max_concurrency': 'max_concurrency'
+}
+
+
+def create_client_config(config) -> Config:
+    """botocore config of the S3 client: size of the connection pool and TCP keepalive"""
+    options = {'max_pool_connections': config.get('s3_max_pool_connections', DEFAULT_MAX_POOL_CONNECTIONS)}
+    # Passed only when enabled, older botocore versions don't have the option
+    if config.get('s3_tcp_keepalive'):
+        options['tcp_keepalive'] = True
+    return Config(**options)
+
+
+def create_transfer_config(config) -> TransferConfig:
+    """boto3 transfer config of the uploads: multipart threshold, chunk size and concurrency"""
+    return TransferConfig(**{
+        argument: config[key] for (key, argument) in TRANSFER_CONFIG_KEYS.items() if config.get(key) is not None
+    })
+
+
+# S3 clients shared by every S3UploadClient instance, one per credentials, endpoint and region
+_s3_clients = {}
+_s3_clients_lock = threading.Lock()
+
+
+def _credentials(config) -> tuple:
+    """Effective credentials of the config, from the config file and/or environment variables"""
+    aws_profile = config.get('aws_profile') or os.environ.get('AWS_PROFILE')
+    aws_access_key_id = config.get('aws_access_key_id') or os.environ.get('AWS_ACCESS_KEY_ID')
+    aws_secret_access_key = config.get('aws_secret_access_key') or os.environ.get('AWS_SECRET_ACCESS_KEY')
+    aws_session_token = config.get('aws_session_token') or os.environ.get('AWS_SESSION_TOKEN')
+    if aws_access_key_id and aws_secret_access_key:
+        return None, aws_access_key_id, aws_secret_access_key, aws_session_token
+    return aws_profile, None, None, None
+
+
+def create_s3_client(config):
+    """Create a new S3 client with the credentials, endpoint and region in the config"""
+    aws_profile, aws_access_key_id, aws_secret_access_key, aws_session_token = _credentials(config)
+
+    # AWS credentials based authentication
+    if aws_access_key_id:
+        aws_session = boto3.session.Session(
+            aws_access_key_id=aws_access_key_id,
+            aws_secret_access_key=aws_secret_access_key,
+            aws_session_token=aws_session_token
+        )
+    # AWS Profile based authentication
+    else:
+        aws_session = boto3.session.Session(profile_name=aws_profile)
+
+    # Create the s3 client
+    return aws_session.client('s3',
+                              region_name=config.get('s3_region_name'),
+                              endpoint_url=config.get('s3_endpoint_url'),
+                              config=create_client_config(config))
+
+
+def get_s3_client(config):
+    """
+    Get the process-wide S3 client of the credentials, endpoint and region in the config
+
+    boto3 clients are thread safe. Credentials resolved from a profile, an assumed role or the instance
+    metadata are refreshed by the shared client, once for every stream using them.
+    """
+    client_key = _credentials(config) + tuple(
+        config.get(key) for key in ('s3_region_name', 's3_endpoint_url', 's3_max_pool_connections', 's3_tcp_keepalive'))
+    with _s3_clients_lock:
+        if client_key not in _s3_clients:
+            _s3_clients[client_key] = create_s3_client(config)
+        return _s3_clients[client_key]
+
 
 class S3UploadClient:
     """S3 Upload Client class"""
@@ -13,57 +103,55 @@ class S3UploadClient:
     def __init__(self, connection_config):
         self.connection_config = connection_config
         self.logger = get_logger('target_iomete')
-        self.s3_client = self._create_s3_client()
-
-    def _create_s3_client(self, config=None):
-        if not config:
-            config = self.connection_config
-
-        # Get the required parameters from config file and/or environment variables
-        aws_profile = config.get('aws_profile') or os.environ.get('AWS_PROFILE')
-        aws_access_key_id = config.get('aws_access_key_id') or os.environ.get('AWS_ACCESS_KEY_ID')
-        aws_secret_access_key = config.get('aws_secret_access_key') or os.environ.get('AWS_SECRET_ACCESS_KEY')
-        aws_session_token = config.get('aws_session_token') or os.environ.get('AWS_SESSION_TOKEN')
-
-        # AWS credentials based authentication
-        if aws_access_key_id and aws_secret_access_key:
-            aws_session = boto3.session.Session(
-                aws_access_key_id=aws_access_key_id,
-                aws_secret_access_key=aws_secret_access_key,
-                aws_session_token=aws_session_token
-            )
-        # AWS Profile based authentication
-        else:
-            aws_session = boto3.session.Session(profile_name=aws_profile)
-
-        # Create the s3 client
-        return aws_session.client('s3',
-                                  region_name=config.get('s3_region_name'),
-                                  endpoint_url=config.get('s3_endpoint_url'))
-
-    def upload_file(self, file, stream, temp_dir=None):
-        """Upload file to an external on s3 stage"""
-        # Generating key in S3 bucket
-        bucket = self.connection_config['s3_bucket']
-        s3_acl = self.connection_config.get('s3_acl')
+        self.s3_client = get_s3_client(connection_config)
+        self.transfer_config = create_transfer_config(connection_config)
+
+    def stage_key(self, stream: str, file_name: str) -> str:
+        """Generate the key of a staged file in S3 bucket"""
         s3_key_prefix = self.connection_config.get('s3_key_prefix', '')
         timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        return f"{s3_key_prefix}{stream}_{timestamp}_{file_name}"
 
-        s3_key = f"{s3_key_prefix}{stream}_{timestamp}_{os.path.basename(file)}"
+    def upload_file(self, file, stream, temp_dir=None, s3_key=None):
+        """Upload file to an external on s3 stage, by default to a new key named after the file"""
+        bucket = self.connection_config['s3_bucket']
+        s3_acl = self.connection_config.get('s3_acl')
+        s3_key = s3_key or self.stage_key(stream, os.path.basename(file))
         self.logger.info('Target S3 bucket: %s, local file: %s, S3 key: %s', bucket, file, s3_key)
 
         # Upload to S3 without encrypting
         extra_args = {'ACL': s3_acl} if s3_acl else None
-        self.s3_client.upload_file(file, bucket, s3_key, ExtraArgs=extra_args)
+        self.s3_client.upload_file(file, bucket, s3_key, ExtraArgs=extra_args, Config=self.transfer_config)
 
         return s3_key
 
+    def open_stream(self, s3_key: str) -> S3StreamWriter:
+        """Open a file object uploading a staged file to the external s3 stage while it's written"""
+        bucket = self.connection_config['s3_bucket']
+        s3_acl = self.connection_config.get('s3_acl')
+        self.logger.info('Target S3 bucket: %s, streamed S3 key: %s', bucket, s3_key)
+
+        # Upload to S3 without encrypting
+        extra_args = {'ACL': s3_acl} if s3_acl else None
+        return S3StreamWriter(self.s3_client, bucket, s3_key, self.transfer_config, extra_args,
+                              max_concurrency=self.connection_config.get('s3_max_concurrency', 1))
+
     def delete_object(self, key: str) -> None:
         """Delete object from an S3 stage"""
         self.logger.info('Deleting merged file %s from S3 stage', key)
         bucket = self.connection_config['s3_bucket']
         self.s3_client.delete_object(Bucket=bucket, Key=key)
 
+    def delete_staged_file(self, key: str) -> None:
+        """Delete a loaded staged file from the S3 stage as set by stage_cleanup"""
+        stage_cleanup = self.connection_config.get('stage_cleanup', 'background')
+        if stage_cleanup == 'lifecycle':
+            return
+        if stage_cleanup == 'sync':
+            self.delete_object(key)
+            return
+        get_stage_cleaner(self.s3_client, self.connection_config['s3_bucket']).delete(key)
+
     def copy_object(self, copy_source: str, target_bucket: str, target_key: str, target_metadata: dict) -> None:
         """Copy object to another location on S3"""
         self.logger.info('Copying %s to %s/%s', copy_source, target_bucket, target_key)
@@ -0,0 +1,127 @@
+"""Background deletion of staged files"""
+import queue
+import threading
+import time
+
+from typing import List
+
+from singer import get_logger
+
+LOGGER = get_logger('target_iomete')
+
+# Max number of keys of a single delete_objects request
+MAX_KEYS_PER_REQUEST = 1000
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_DELAY_SECONDS = 1
+
+_STOP = object()
+
+# Cleaners shared by every stream, one per S3 client and bucket
+_cleaners = {}
+_cleaners_lock = threading.Lock()
+
+
+class StageCleaner:
+    """
+    Deletes the loaded staged files from the S3 stage on a background thread, off the flush critical path.
+
+    Queued keys are deleted with delete_objects, up to MAX_KEYS_PER_REQUEST keys per request. Keys that
+    failed are retried up to max_attempts times, then left on the stage with a warning: a leftover staged
+    file is never loaded again, it's only wasted storage.
+    """
+
+    def __init__(self, s3_client, bucket: str, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 retry_delay_seconds: float = DEFAULT_RETRY_DELAY_SECONDS):
+        """
+        Args:
+            s3_client: boto3 S3 client
+            bucket: Bucket of the staged files
+            max_attempts: Max number of delete attempts of a key. (Default: DEFAULT_MAX_ATTEMPTS)
+            retry_delay_seconds: Delay before retrying the failed keys. (Default: DEFAULT_RETRY_DELAY_SECONDS)
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.max_attempts = max_attempts
+        self.retry_delay_seconds = retry_delay_seconds
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='target-iomete-stage-cleaner', daemon=True)
+        self._thread.start()
+
+    def delete(self, key: str) -> None:
+        """Queue a staged file for deletion"""
+        self._queue.put((key, 1))
+
+    def _take_batch(self) -> tuple:
+        """Block until a key is queued, then take every queued key up to a request"""
+        batch = []
+        stop = False
+        item = self._queue.get()
+        while True:
+            if item is _STOP:
+                stop = True
+            else:
+                batch.append(item)
+            if len(batch) >= MAX_KEYS_PER_REQUEST:
+                break
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+        return batch, stop
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            batch, stop = self._take_batch()
+            retries = self._delete_batch(batch) if batch else []
+            # Failed keys are retried after a delay, also after the cleaner is stopped
+            if retries:
+                time.sleep(self.retry_delay_seconds)
+                for item in retries:
+                    self._queue.put(item)
+                if stop:
+                    stop = False
+                    self._queue.put(_STOP)
+
+    def _delete_batch(self, batch: List[tuple]) -> List[tuple]:
+        """Delete a batch of keys, returns the keys to retry"""
+        attempts = dict(batch)
+        try:
+            response = self.s3_client.delete_objects(Bucket=self.bucket, Delete={
+                'Objects': [{'Key': key} for key in attempts],
+                'Quiet': True
+            })
+            failed = {error['Key']: error.get('Message') for error in response.get('Errors', [])}
+        except Exception as exc:  # pylint: disable=broad-except
+            failed = {key: str(exc) for key in attempts}
+
+        retries = []
+        for key, message in failed.items():
+            if attempts.get(key, self.max_attempts) < self.max_attempts:
+                retries.append((key, attempts[key] + 1))
+            else:
+                LOGGER.warning('Cannot delete %s from S3 stage: %s', key, message)
+        return retries
+
+    def close(self) -> None:
+        """Wait until every queued key is deleted or failed, then stop the background thread"""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+
+def get_stage_cleaner(s3_client, bucket: str) -> StageCleaner:
+    """Get the process-wide cleaner of the staged files of a bucket"""
+    cleaner_key = (id(s3_client), bucket)
+    with _cleaners_lock:
+        if cleaner_key not in _cleaners:
+            _cleaners[cleaner_key] = StageCleaner(s3_client, bucket)
+        return _cleaners[cleaner_key]
+
+
+def close_stage_cleaners() -> None:
+    """Drain and stop every cleaner, called at shutdown"""
+    with _cleaners_lock:
+        cleaners = list(_cleaners.values())
+        _cleaners.clear()
+    for cleaner in cleaners:
+        cleaner.close()
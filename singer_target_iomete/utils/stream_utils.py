@@ -1,7 +1,10 @@
 """Schema and singer message funtionalities"""
+import re
+
+from functools import lru_cache
 from typing import Dict, List
 
-from datetime import datetime
+from datetime import date, datetime
 from dateutil import parser
 from dateutil.parser import ParserError
 from decimal import Decimal
@@ -18,6 +21,15 @@ MAX_TIMESTAMP = '9999-12-31 23:59:59.999999'
 # max time supported in Spark, used to reset all invalid times that are beyond this value
 MAX_TIME = '23:59:59.999999'
 
+# ISO-8601/RFC-3339 shapes emitted by taps, checked without dateutil
+ISO_8601_DATETIME = re.compile(r'^(\d{4})-(\d{2})-(\d{2})'
+                               r'(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.\d{1,6})?)?'
+                               r'(?:[Zz]|[+-](\d{2}):?(\d{2}))?)?$')
+ISO_8601_TIME = re.compile(r'^(\d{2}):(\d{2})(?::(\d{2})(?:\.\d{1,6})?)?$')
+
+# Max number of unusual timestamp strings remembered after parsing them with dateutil
+TIMESTAMP_CACHE_SIZE = 10000
+
 
 def get_schema_names_from_config(config: Dict) -> List:
     """Get list of target schema name from config"""
@@ -35,6 +47,84 @@ def get_schema_names_from_config(config: Dict) -> List:
     return schema_names
 
 
+def get_timestamp_properties(schema: Dict) -> Dict:
+    """
+    Collect the properties of type date/datetime/time
+    Args:
+        schema: json schema that has types of each property
+
+    Returns:
+        Dictionary with the format of every date typed property
+    """
+    timestamp_properties = {}
+    for key, property_schema in schema['properties'].items():
+        if 'anyOf' in property_schema:
+            for type_dict in property_schema['anyOf']:
+                if 'string' in type_dict.get('type', []) and \
+                        type_dict.get('format', None) in {'date-time', 'time', 'date'}:
+                    timestamp_properties[key] = type_dict['format']
+                    break
+        elif 'string' in property_schema.get('type', []) and \
+                property_schema.get('format', None) in {'date-time', 'time', 'date'}:
+            timestamp_properties[key] = property_schema['format']
+
+    return timestamp_properties
+
+
+def _is_iso_8601(value: str) -> bool:
+    match = ISO_8601_DATETIME.match(value)
+    if match:
+        year, month, day, hour, minute, second, offset_hour, offset_minute = match.groups()
+        try:
+            date(int(year), int(month), int(day))
+        except ValueError:
+            return False
+    else:
+        match = ISO_8601_TIME.match(value)
+        if not match:
+            return False
+        hour, minute, second = match.groups()
+        offset_hour = offset_minute = None
+
+    return int(hour or 0) <= 23 and int(minute or 0) <= 59 and int(second or 0) <= 59 \
+        and int(offset_hour or 0) <= 23 and int(offset_minute or 0) <= 59
+
+
+@lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def _is_parsable_by_dateutil(value: str) -> bool:
+    try:
+        parser.parse(value)
+        return True
+    except ParserError:
+        return False
+
+
+def is_valid_timestamp(value: str) -> bool:
+    """
+    Check if a date, date-time or time string can be parsed. The ISO-8601 shapes are checked with a
+    strict pattern, every other string is parsed by dateutil and the result is remembered
+    """
+    return _is_iso_8601(value) or _is_parsable_by_dateutil(value)
+
+
+def reset_invalid_timestamp(record: Dict, key: str, _format: str) -> None:
+    """
+    Resets the date/datetime/time value of a key to MAX value accordingly if it cannot be parsed
+    Args:
+        record: record containing properties and values
+        key: property holding a not null date typed value
+        _format: date-time, date or time
+    """
+    if not isinstance(record[key], str):
+        raise UnexpectedValueTypeException(
+            f'Value {record[key]} of key "{key}" is not a string.')
+
+    if not is_valid_timestamp(record[key]):
+        LOGGER.warning('Parsing the %s "%s" in key "%s" has failed, thus defaulting to max '
+                       'acceptable value of %s in iomete', _format, record[key], key, _format)
+        record[key] = MAX_TIMESTAMP if _format != 'time' else MAX_TIME
+
+
 def adjust_timestamps_in_record(record: Dict, schema: Dict) -> None:
     """
     Goes through every field that is of type date/datetime/time and if its value is out of range,
@@ -43,32 +133,9 @@ def adjust_timestamps_in_record(record: Dict, schema: Dict) -> None:
         record: record containing properties and values
         schema: json schema that has types of each property
     """
-
-    # creating this internal function to avoid duplicating code and too many nested blocks.
-    def reset_new_value(record: Dict, key: str, _format: str):
-        if not isinstance(record[key], str):
-            raise UnexpectedValueTypeException(
-                f'Value {record[key]} of key "{key}" is not a string.')
-
-        try:
-            parser.parse(record[key])
-        except ParserError:
-            LOGGER.warning('Parsing the %s "%s" in key "%s" has failed, thus defaulting to max '
-                           'acceptable value of %s in iomete', _format, record[key], key, _format)
-            record[key] = MAX_TIMESTAMP if _format != 'time' else MAX_TIME
-
-    # traverse the schema looking for properties of some date type
-    for key, value in record.items():
-        if value is not None and key in schema['properties']:
-            if 'anyOf' in schema['properties'][key]:
-                for type_dict in schema['properties'][key]['anyOf']:
-                    if 'string' in type_dict['type'] and type_dict.get('format', None) in {'date-time', 'time', 'date'}:
-                        reset_new_value(record, key, type_dict['format'])
-                        break
-            else:
-                if 'string' in schema['properties'][key]['type'] and \
-                        schema['properties'][key].get('format', None) in {'date-time', 'time', 'date'}:
-                    reset_new_value(record, key, schema['properties'][key]['format'])
+    for key, _format in get_timestamp_properties(schema).items():
+        if record.get(key) is not None:
+            reset_invalid_timestamp(record, key, _format)
 
 
 def float_to_decimal(value):
@@ -8,7 +8,7 @@ import singer_target_iomete
 from singer_target_iomete import RecordValidationException
 from singer_target_iomete.utils.exceptions import PrimaryKeyNotFoundException
 from singer_target_iomete.db_sync import DbSync
-from singer_target_iomete.utils.s3_upload_client import S3UploadClient
+from singer_target_iomete.utils.s3_upload_client import get_s3_client
 
 from unittest import mock
 
@@ -1285,8 +1285,7 @@ class TestIntegration(unittest.TestCase):
             del self.config['aws_secret_access_key']
 
             # Create a new S3 client using env vars
-            s3Client = S3UploadClient(self.config)
-            s3Client._create_s3_client()
+            get_s3_client(self.config)
 
         # Restore the original state to not confuse other tests
         finally:
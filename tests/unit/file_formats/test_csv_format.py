@@ -1,10 +1,15 @@
 import unittest
 import os
 import gzip
+import json
 import tempfile
 
+import zstandard
+
 import singer_target_iomete.file_formats.csv_format as csv
 
+from singer_target_iomete.utils.record_plan import RecordPlan
+
 
 def _mock_record_to_csv_line(record, schema, data_flattening_max_level=0):
     return record
@@ -94,6 +99,59 @@ class TestCsv(unittest.TestCase):
         self.assertEqual(csv.record_to_csv_line(record, schema),
                          '"1","2030-01-22","10000-01-22 12:04:22","25:01:01","I\'m good",')
 
+    def test_records_to_file_with_serialized_rows(self):
+        """Files written from encoded rows are the same as the ones written from the records"""
+        schema = {'key1': {'type': ['integer']}, 'key2': {'type': ['null', 'string']}, 'key3': {'type': ['object']}}
+        records = {1: {'key1': 1, 'key2': 'a "quoted", ü'}, 2: {'key1': 2, 'key3': {'a': [1, 2]}}, 3: {'key1': 0}}
+        record_plan = RecordPlan({'properties': schema}, schema, ['key1'])
+        encode_row = csv.row_encoder(schema)
+
+        for compression in [False, True]:
+            filenames = [
+                csv.records_to_file(records, schema, compression=compression),
+                csv.records_to_file({pk: encode_row(record_plan.row(record)) for pk, record in records.items()},
+                                    schema, compression=compression, serialized_rows=True),
+                csv.records_to_file(list(records.values()), schema, compression=compression, record_plan=record_plan)
+            ]
+            contents = []
+            for filename in filenames:
+                with (gzip.open(filename, 'rb') if compression else open(filename, 'rb')) as f:
+                    contents.append(f.read())
+                os.remove(filename)
+
+            self.assertEqual(contents[0].decode('utf-8').split('\n')[0], '1,"a \\"quoted\\", ü",')
+            self.assertEqual(contents[1], contents[0])
+            self.assertEqual(contents[2], contents[0])
+
+    def test_records_to_file_with_codecs(self):
+        """Compressed files get the extension of the codec iomete decompresses them by"""
+        schema = {'key1': {'type': ['integer']}, 'key2': {'type': ['null', 'string']}}
+        records = {1: {'key1': 1, 'key2': 'a'}, 2: {'key1': 2}}
+
+        readers = [('none', '.csv', lambda f: f.read()),
+                   ('gzip', '.csv.gz', lambda f: gzip.decompress(f.read())),
+                   ('zstd', '.csv.zst', lambda f: zstandard.ZstdDecompressor().stream_reader(f).read())]
+        for codec, extension, read in readers:
+            filename = csv.records_to_file(records, schema, compression=codec, compression_level=1)
+            with open(filename, 'rb') as f:
+                self.assertEqual(read(f), b'1,"a"\n2,\n')
+            self.assertTrue(filename.endswith(extension))
+            os.remove(filename)
+
+    def test_row_encoder(self):
+        """Encoded rows are the same as the json.dumps of every non empty value"""
+        schema = {'c_int': {'type': ['integer']}, 'c_str': {'type': ['null', 'string']}, 'c_num': {'type': ['number']},
+                  'c_bool': {'type': ['boolean']}, 'c_dt': {'type': ['string'], 'format': 'date-time'},
+                  'c_obj': {'type': ['object']}}
+        values = [0, 1, -5, 2 ** 70, True, False, None, '', 'x"y\\\n\tü ', 0.0, -0.0, 1.5, float('nan'), float('inf'),
+                  {}, {'a': 'ü'}, [], [1], '0']
+        encode_row = csv.row_encoder(schema)
+
+        for value in values:
+            row = [value] * len(schema)
+            expected = ','.join([json.dumps(v, ensure_ascii=False) if v == 0 or v else '' for v in row])
+            self.assertEqual(encode_row(row), bytes(expected + '\n', 'UTF-8'))
+
     def test_create_copy_sql(self):
         self.assertEqual(csv.create_copy_sql(table_name='foo_table',
                                              columns_no_data=["COL_4"],
@@ -118,3 +176,59 @@ class TestCsv(unittest.TestCase):
                          "WHEN NOT MATCHED THEN "
                          "INSERT (COL_1, COL_2, COL_3, COL_4) "
                          "VALUES (s.COL_1, s.COL_2, s.COL_3, null)")
+
+    def test_create_latest_rows_sql(self):
+        self.assertEqual(csv.create_latest_rows_sql(temporary_stage_table='temp_table',
+                                                    data_columns=['COL_1', 'COL_2'],
+                                                    primary_key_columns=['COL_1']),
+
+                         "(SELECT COL_1, COL_2 FROM ("
+                         "SELECT COL_1, COL_2, "
+                         "ROW_NUMBER() OVER (PARTITION BY COL_1 ORDER BY _sdc_staged_file DESC) AS _sdc_row_number "
+                         "FROM (SELECT COL_1, COL_2, input_file_name() AS _sdc_staged_file FROM temp_table) files"
+                         ") ranked WHERE _sdc_row_number = 1) latest")
+
+    def test_create_merge_sql_with_target_predicate(self):
+        self.assertEqual(csv.create_merge_sql(table_name='foo_table',
+                                              columns_no_data=[],
+                                              temporary_stage_table='temp_table',
+                                              data_columns=['COL_1'],
+                                              pk_merge_condition='s.COL_1 = t.COL_1',
+                                              target_predicate='t.COL_1 >= 1 AND t.COL_1 <= 10'),
+
+                         "MERGE INTO foo_table t USING ("
+                         "SELECT COL_1 "
+                         "FROM temp_table) s "
+                         "ON s.COL_1 = t.COL_1 AND t.COL_1 >= 1 AND t.COL_1 <= 10 "
+                         "WHEN MATCHED THEN UPDATE SET COL_1=s.COL_1 "
+                         "WHEN NOT MATCHED THEN "
+                         "INSERT (COL_1) "
+                         "VALUES (s.COL_1)")
+
+    def test_create_copy_sql_with_hard_delete(self):
+        self.assertEqual(csv.create_copy_sql(table_name='foo_table',
+                                             columns_no_data=[],
+                                             temporary_stage_table='temp_table',
+                                             data_columns=['COL_1', '_SDC_DELETED_AT'],
+                                             deleted_at_column='_SDC_DELETED_AT'),
+
+                         "INSERT INTO foo_table (COL_1, _SDC_DELETED_AT) "
+                         "SELECT COL_1, _SDC_DELETED_AT FROM temp_table WHERE _SDC_DELETED_AT IS NULL")
+
+    def test_create_merge_sql_with_hard_delete(self):
+        self.assertEqual(csv.create_merge_sql(table_name='foo_table',
+                                              columns_no_data=[],
+                                              temporary_stage_table='temp_table',
+                                              data_columns=['COL_1', '_SDC_DELETED_AT'],
+                                              pk_merge_condition='s.COL_1 = t.COL_1',
+                                              deleted_at_column='_SDC_DELETED_AT'),
+
+                         "MERGE INTO foo_table t USING ("
+                         "SELECT COL_1, _SDC_DELETED_AT "
+                         "FROM temp_table) s "
+                         "ON s.COL_1 = t.COL_1 "
+                         "WHEN MATCHED AND s._SDC_DELETED_AT IS NOT NULL THEN DELETE "
+                         "WHEN MATCHED THEN UPDATE SET COL_1=s.COL_1, _SDC_DELETED_AT=s._SDC_DELETED_AT "
+                         "WHEN NOT MATCHED AND s._SDC_DELETED_AT IS NULL THEN "
+                         "INSERT (COL_1, _SDC_DELETED_AT) "
+                         "VALUES (s.COL_1, s._SDC_DELETED_AT)")
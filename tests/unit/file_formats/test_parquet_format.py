@@ -0,0 +1,98 @@
+import unittest
+import os
+
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+import pyarrow.parquet
+
+import singer_target_iomete.file_formats.parquet_format as parquet
+
+
+class TestParquet(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = None
+        self.schema = {
+            'c_int': {'type': ['null', 'integer']},
+            'c_num': {'type': ['null', 'number']},
+            'c_bool': {'type': ['null', 'boolean']},
+            'c_str': {'type': ['null', 'string']},
+            'c_dt': {'type': ['null', 'string'], 'format': 'date-time'},
+            'c_date': {'type': ['null', 'string'], 'format': 'date'},
+            'c_time': {'type': ['null', 'string'], 'format': 'time'},
+            'c_obj': {'type': ['null', 'object']},
+        }
+
+    def test_records_to_table_typed_columns(self):
+        """Values are converted to the types of the spark columns"""
+        records = {
+            '1': {'c_int': 1, 'c_num': 1.5, 'c_bool': False, 'c_str': 'I\'m good', 'c_dt': '2021-04-06T10:00:00Z',
+                  'c_date': '2030-01-22', 'c_time': '23:59:59.999999', 'c_obj': {'key': 'value'}},
+            '2': {'c_int': 0, 'c_num': None, 'c_bool': True, 'c_str': '', 'c_dt': '9999-12-31 23:59:59.999999'},
+        }
+
+        table = parquet.records_to_table(records, self.schema)
+
+        self.assertEqual(table.column_names, ['C_INT', 'C_NUM', 'C_BOOL', 'C_STR', 'C_DT', 'C_DATE', 'C_TIME',
+                                              'C_OBJ'])
+        self.assertEqual(table.to_pylist(), [
+            {'C_INT': 1, 'C_NUM': 1.5, 'C_BOOL': False, 'C_STR': 'I\'m good',
+             'C_DT': datetime(2021, 4, 6, 10, 0, tzinfo=timezone.utc), 'C_DATE': date(2030, 1, 22),
+             'C_TIME': datetime(1970, 1, 1, 23, 59, 59, 999999, tzinfo=timezone.utc), 'C_OBJ': '{"key": "value"}'},
+            {'C_INT': 0, 'C_NUM': None, 'C_BOOL': True, 'C_STR': None,
+             'C_DT': datetime(9999, 12, 31, 23, 59, 59, 999999, tzinfo=timezone.utc), 'C_DATE': None,
+             'C_TIME': None, 'C_OBJ': None},
+        ])
+
+    def test_records_to_table_invalid_value(self):
+        """Values that cannot be converted to the column type raise an error"""
+        with self.assertRaises(ValueError):
+            parquet.records_to_table({'1': {'c_int': 'not a number'}}, self.schema)
+
+    def test_records_to_table_rejects_coercions(self):
+        """Values of other python types are not coerced to the column type"""
+        for record in [{'c_int': 1.9}, {'c_int': True}, {'c_bool': 'false'}, {'c_bool': 1}, {'c_num': '1.5'},
+                       {'c_num': True}]:
+            with self.subTest(record=record), self.assertRaises(ValueError):
+                parquet.records_to_table({'1': record}, self.schema)
+
+        table = parquet.records_to_table({'1': {'c_num': 2}, '2': {'c_num': Decimal('1.25')}}, self.schema)
+        self.assertEqual(table.column('C_NUM').to_pylist(), [2.0, 1.25])
+
+    def test_records_to_file(self):
+        """Batch is written into a Parquet file"""
+        records = {'1': {'c_int': 1}, '2': {'c_int': 2}}
+
+        filename = parquet.records_to_file(records, self.schema, compression=True)
+
+        table = pyarrow.parquet.read_table(filename)
+        self.assertEqual(table.column('C_INT').to_pylist(), [1, 2])
+        self.assertTrue(filename.endswith('.parquet'))
+
+        os.remove(filename)
+
+    def test_records_to_file_with_codecs(self):
+        """Column chunks are compressed by the codec"""
+        records = {'1': {'c_int': 1}, '2': {'c_int': 2}}
+
+        for codec in ['none', 'snappy', 'gzip', 'zstd', 'lz4']:
+            filename = parquet.records_to_file(records, self.schema, compression=codec)
+
+            metadata = pyarrow.parquet.ParquetFile(filename).metadata
+            self.assertEqual(metadata.row_group(0).column(0).compression,
+                             {'none': 'UNCOMPRESSED', 'lz4': 'LZ4'}.get(codec, codec.upper()))
+            self.assertEqual(pyarrow.parquet.read_table(filename).column('C_INT').to_pylist(), [1, 2])
+
+            os.remove(filename)
+
+    def test_records_to_file_ignores_level_of_codecs_without_levels(self):
+        """Codecs without compression levels, like the tiny batches of the automatic mode, ignore the level"""
+        records = {'1': {'c_int': 1}, '2': {'c_int': 2}}
+
+        for codec in ['none', 'snappy', 'gzip', 'zstd', 'lz4']:
+            filename = parquet.records_to_file(records, self.schema, compression=codec, compression_level=1)
+
+            self.assertEqual(pyarrow.parquet.read_table(filename).column('C_INT').to_pylist(), [1, 2])
+
+            os.remove(filename)
@@ -3,6 +3,7 @@ import unittest
 from unittest.mock import patch
 
 from singer_target_iomete import db_sync
+from singer_target_iomete.utils.catalog_cache import CatalogCache
 
 
 class TestDBSync(unittest.TestCase):
@@ -12,6 +13,14 @@ class TestDBSync(unittest.TestCase):
 
     def setUp(self):
         self.config = {}
+        self.minimal_config = {
+            'host': "dummy-value",
+            'workspace_id': "dummy-value",
+            'lakehouse': "dummy-value",
+            'user': "dummy-value",
+            'password': "dummy-value",
+            'default_target_schema': "dummy-value"
+        }
 
         self.json_types = {
             'str': {"type": ["string"]},
@@ -74,6 +83,33 @@ class TestDBSync(unittest.TestCase):
         config_with_external_stage['stage'] = 'dummy-value'
         self.assertEqual(len(validator(config_with_external_stage)), 0)
 
+        # Configuration with supported and unknown file formats
+        config_with_file_format = minimal_config.copy()
+        config_with_file_format['file_format'] = 'parquet'
+        self.assertEqual(len(validator(config_with_file_format)), 0)
+        config_with_file_format['file_format'] = 'avro'
+        self.assertGreater(len(validator(config_with_file_format)), 0)
+
+        # Serialized rows buffer requires csv files
+        config_with_file_format['buffer_serialized_rows'] = True
+        config_with_file_format['file_format'] = 'csv'
+        self.assertEqual(len(validator(config_with_file_format)), 0)
+        config_with_file_format['file_format'] = 'parquet'
+        self.assertGreater(len(validator(config_with_file_format)), 0)
+
+        # Staged files are deleted by a known cleanup mode
+        self.assertEqual(len(validator(dict(minimal_config, stage_cleanup='lifecycle'))), 0)
+        self.assertGreater(len(validator(dict(minimal_config, stage_cleanup='never'))), 0)
+
+        # Part file sizes must be positive
+        self.assertEqual(len(validator(dict(minimal_config, max_rows_per_file=1000))), 0)
+        self.assertGreater(len(validator(dict(minimal_config, target_file_size_bytes=0))), 0)
+
+        # Coalesced commits are supported only by the inline flush
+        self.assertEqual(len(validator(dict(minimal_config, commit_interval_seconds=60, commit_max_files=10))), 0)
+        self.assertGreater(len(validator(dict(minimal_config, commit_max_files=0))), 0)
+        self.assertGreater(len(validator(dict(minimal_config, commit_interval_seconds=60, async_flush=True))), 0)
+
     def test_column_type_mapping(self):
         """Test JSON type to Snowflake column type mappings"""
         mapper = db_sync.column_type_spark
@@ -131,8 +167,6 @@ class TestDBSync(unittest.TestCase):
             "key_properties": ["id"]
         }
 
-        import sys
-        sys._called_from_test = True
         # Single primary key string
         dbsync = db_sync.DbSync(minimal_config, stream_schema_message)
         self.assertEqual(dbsync.record_primary_key_string({'id': 123}), '123')
@@ -151,4 +185,327 @@ class TestDBSync(unittest.TestCase):
         stream_schema_message['key_properties'] = ['id', 'c_bool']
         dbsync = db_sync.DbSync(minimal_config, stream_schema_message)
         self.assertEqual(dbsync.record_primary_key_string({'id': 1, 'c_bool': False, 'c_str': 'xyz'}), '1,False')
-        del sys._called_from_test
+
+    @patch('singer_target_iomete.db_sync.DbSync.execute_query')
+    def test_table_columns_cached_between_loads(self, query_patch):
+        """Columns of the target table are described once and reused by every load until the table changes"""
+        queries = []
+
+        def execute_query(query):
+            queries.append(query)
+            if query.startswith('SHOW TABLES'):
+                return [{'tableName': 'table1'}]
+            if query.startswith('describe'):
+                return [{'col_name': 'ID', 'data_type': 'long'}, {'col_name': 'C_STR', 'data_type': 'string'}]
+            return []
+
+        query_patch.side_effect = execute_query
+        stream_schema_message = {
+            "stream": "public-table1",
+            "schema": {
+                "properties": {
+                    "id": {"type": ["integer"]},
+                    "c_str": {"type": ["null", "string"]},
+                }
+            },
+            "key_properties": ["id"]
+        }
+
+        config = dict(self.minimal_config, s3_bucket='dummy-bucket')
+        dbsync = db_sync.DbSync(config, stream_schema_message)
+        dbsync.sync_table()
+        dbsync.load_file('key_1', 10, 100)
+        dbsync.load_file('key_2', 10, 100)
+        self.assertEqual(len([q for q in queries if q.startswith('describe')]), 1)
+
+        # Columns described before every load when caching is disabled
+        queries.clear()
+        dbsync = db_sync.DbSync(dict(config, cache_table_columns=False), stream_schema_message)
+        dbsync.sync_table()
+        dbsync.load_file('key_1', 10, 100)
+        dbsync.load_file('key_2', 10, 100)
+        self.assertEqual(len([q for q in queries if q.startswith('describe')]), 3)
+
+    @patch('singer_target_iomete.db_sync.DbSync.execute_query')
+    def test_load_file_retried_when_cached_columns_changed(self, query_patch):
+        """A failing load invalidates the cached columns and is retried if the table got altered meanwhile"""
+        described_columns = [{'col_name': 'ID', 'data_type': 'long'}]
+        merges = []
+
+        def execute_query(query):
+            if query.startswith('describe'):
+                return described_columns
+            if query.startswith('MERGE'):
+                merges.append(query)
+                if len(merges) == 2:
+                    raise Exception('column mismatch')
+            return []
+
+        query_patch.side_effect = execute_query
+        stream_schema_message = {
+            "stream": "public-table1",
+            "schema": {"properties": {"id": {"type": ["integer"]}}},
+            "key_properties": ["id"]
+        }
+
+        dbsync = db_sync.DbSync(dict(self.minimal_config, s3_bucket='dummy-bucket'), stream_schema_message)
+        dbsync.load_file('key_1', 10, 100)
+
+        # Column added to the table by someone else after caching
+        described_columns = [{'col_name': 'ID', 'data_type': 'long'}, {'col_name': 'NEW_COL', 'data_type': 'string'}]
+        dbsync.load_file('key_2', 10, 100)
+
+        self.assertEqual(len(merges), 3)
+        self.assertIn('`NEW_COL`=null', merges[-1])
+
+    @patch('singer_target_iomete.db_sync.DbSync.execute_query')
+    def test_catalog_cache_lookups(self, query_patch):
+        """Schema, table and column lookups are answered by the catalog cache"""
+        catalog_cache = CatalogCache()
+        catalog_cache.add_schema('dummy-value', created=True)
+        catalog_cache.set_columns('dummy-value', 'table1', [{'COLUMN_NAME': 'ID', 'DATA_TYPE': 'long'}])
+
+        stream_schema_message = {
+            "stream": "public-table1",
+            "schema": {"properties": {"id": {"type": ["integer"]}, "c_str": {"type": ["null", "string"]}}},
+            "key_properties": ["id"]
+        }
+
+        queries = []
+
+        def execute_query(query):
+            queries.append(query)
+            if query.startswith('describe'):
+                return [{'col_name': 'ID', 'data_type': 'long'}]
+            return []
+
+        query_patch.side_effect = execute_query
+
+        dbsync = db_sync.DbSync(self.minimal_config, stream_schema_message, catalog_cache)
+        dbsync.create_schema_if_not_exists()
+        dbsync.sync_table()
+
+        # The SCHEMA message describes the table again, the missing column is added without SHOW queries
+        self.assertEqual(queries,
+                         ['describe dummy-value.`TABLE1`',
+                          'ALTER TABLE spark_catalog.dummy-value.`TABLE1` ADD COLUMN `C_STR` string'])
+        self.assertEqual(len(catalog_cache.get_columns('dummy-value', 'table1')), 2)
+
+        # Later lookups of the columns are answered by the catalog cache
+        queries.clear()
+        self.assertEqual(len(db_sync.DbSync(self.minimal_config, stream_schema_message,
+                                            catalog_cache).cached_table_columns()), 2)
+        self.assertEqual(queries, [])
+
+    @patch('singer_target_iomete.db_sync.DbSync.execute_query')
+    def test_insert_only_fast_path(self, query_patch):
+        """Batches of append streams newer than the loaded rows are inserted instead of merged"""
+        loads = []
+        max_queries = []
+
+        def execute_query(query):
+            if query.startswith('describe'):
+                return [{'col_name': 'ID', 'data_type': 'long'}]
+            if query.startswith('SELECT'):
+                max_queries.append(query)
+                return [{'MAX_VALUE': 10}]
+            if query.startswith(('MERGE', 'INSERT')):
+                loads.append(query.split()[0])
+            return []
+
+        query_patch.side_effect = execute_query
+        stream_schema_message = {
+            "type": "SCHEMA",
+            "stream": "public-table1",
+            "schema": {"properties": {"id": {"type": ["integer"]}}},
+            "key_properties": ["id"],
+            "bookmark_properties": ["id"]
+        }
+
+        dbsync = db_sync.DbSync(dict(self.minimal_config, s3_bucket='dummy-bucket'), stream_schema_message)
+
+        def batch(*ids):
+            batch_stats = dbsync.new_batch_stats()
+            for record_id in ids:
+                batch_stats.update({'id': record_id})
+            return batch_stats
+
+        dbsync.load_file('key_1', 2, 100, batch(11, 12))
+        dbsync.load_file('key_2', 2, 100, batch(12, 13))
+        dbsync.load_file('key_3', 2, 100, batch(14, 15))
+        dbsync.load_file('key_4', 1, 100)
+        self.assertEqual(loads, ['INSERT', 'MERGE', 'INSERT', 'MERGE'])
+
+        # The max of the target table is queried once and tracked by the loads
+        self.assertEqual(max_queries, ['SELECT MAX(`ID`) AS MAX_VALUE FROM spark_catalog.dummy-value.`TABLE1`'])
+        self.assertEqual(dbsync.incremental_key_max, 15)
+
+        # Streams where the incremental key is not the primary key are merged unless declared append only
+        stream_schema_message = dict(stream_schema_message,
+                                     schema={"properties": {"id": {"type": ["integer"]},
+                                                            "updated_at": {"type": ["string"], "format": "date-time"}}},
+                                     bookmark_properties=["updated_at"])
+        dbsync = db_sync.DbSync(dict(self.minimal_config, s3_bucket='dummy-bucket'), stream_schema_message)
+        self.assertFalse(dbsync.is_append_stream())
+
+        dbsync = db_sync.DbSync(dict(self.minimal_config, s3_bucket='dummy-bucket',
+                                     append_only_streams=['public-table1']), stream_schema_message)
+        self.assertTrue(dbsync.is_append_stream())
+        self.assertFalse(dbsync.is_new_batch(batch()))
+
+    def test_partition_source_columns(self):
+        """Partition source columns are parsed from the partition section of DESCRIBE TABLE"""
+        columns = [{'col_name': 'id', 'data_type': 'bigint', 'comment': ''},
+                   {'col_name': 'updated_at', 'data_type': 'timestamp', 'comment': ''},
+                   {'col_name': '', 'data_type': '', 'comment': ''}]
+        iceberg = columns + [{'col_name': '# Partitioning', 'data_type': '', 'comment': ''},
+                             {'col_name': 'Part 0', 'data_type': 'days(updated_at)', 'comment': ''},
+                             {'col_name': 'Part 1', 'data_type': 'bucket(16, id)', 'comment': ''}]
+        hive = columns + [{'col_name': '# Partition Information', 'data_type': '', 'comment': ''},
+                          {'col_name': '# col_name', 'data_type': 'data_type', 'comment': 'comment'},
+                          {'col_name': 'updated_at', 'data_type': 'timestamp', 'comment': ''}]
+
+        self.assertEqual(db_sync.partition_source_columns(columns), [])
+        self.assertEqual(db_sync.partition_source_columns(iceberg), ['updated_at', 'id'])
+        self.assertEqual(db_sync.partition_source_columns(hive), ['updated_at'])
+
+    @patch('singer_target_iomete.db_sync.DbSync.execute_query')
+    def test_merge_pruning(self, query_patch):
+        """MERGE reads only the target rows within the bounds of the primary key and immutable columns"""
+        queries = []
+
+        def execute_query(query):
+            queries.append(query)
+            if query.startswith('describe'):
+                return [{'col_name': 'ID', 'data_type': 'bigint'},
+                        {'col_name': 'UPDATED_AT', 'data_type': 'timestamp'},
+                        {'col_name': '# Partitioning', 'data_type': ''},
+                        {'col_name': 'Part 0', 'data_type': 'days(UPDATED_AT)'}]
+            if query.startswith('SELECT'):
+                # 2021-01-03, batches of the test are not newer than the loaded rows
+                return [{'MAX_VALUE': 1609632000.0}]
+            return []
+
+        query_patch.side_effect = execute_query
+        stream_schema_message = {
+            "type": "SCHEMA",
+            "stream": "public-table1",
+            "schema": {"properties": {"id": {"type": ["integer"]},
+                                      "updated_at": {"type": ["null", "string"], "format": "date-time"}}},
+            "key_properties": ["id"],
+            "bookmark_properties": ["updated_at"]
+        }
+        config = dict(self.minimal_config, s3_bucket='dummy-bucket', stage_source='path')
+
+        def load(dbsync, *records):
+            batch_stats = dbsync.new_batch_stats()
+            for record in records:
+                batch_stats.update(record)
+            dbsync.load_file('key_1', len(records), 100, batch_stats)
+            return queries[-1]
+
+        # Partitioning section is not a column
+        dbsync = db_sync.DbSync(config, stream_schema_message)
+        self.assertEqual([c['COLUMN_NAME'] for c in dbsync.cached_table_columns()], ['ID', 'UPDATED_AT'])
+
+        self.assertEqual(dbsync.merge_pruning_columns(), ['id'])
+        self.assertIn('ON s.`ID` = t.`ID` AND t.`ID` >= 3 AND t.`ID` <= 7 WHEN',
+                      load(dbsync, {'id': 7, 'updated_at': '2021-01-01T00:00:00+00:00'}, {'id': 3}))
+
+        # Incremental key and partition columns of append streams never change once loaded
+        dbsync = db_sync.DbSync(dict(config, append_only_streams=['public-table1']), stream_schema_message)
+        self.assertEqual(dbsync.merge_pruning_columns(), ['id', 'updated_at'])
+        self.assertIn('ON s.`ID` = t.`ID` AND t.`ID` >= 3 AND t.`ID` <= 7 AND '
+                      't.`UPDATED_AT` >= TIMESTAMP_MICROS(1609459200000000) AND '
+                      't.`UPDATED_AT` <= TIMESTAMP_MICROS(1609545600000000) WHEN',
+                      load(dbsync, {'id': 7, 'updated_at': '2021-01-01T00:00:00+00:00'},
+                           {'id': 3, 'updated_at': '2021-01-02T00:00:00+00:00'}))
+
+        # Null values can't be bounded
+        self.assertIn('ON s.`ID` = t.`ID` AND t.`ID` >= 3 AND t.`ID` <= 7 WHEN',
+                      load(dbsync, {'id': 7, 'updated_at': '2021-01-01T00:00:00+00:00'}, {'id': 3}))
+
+        dbsync = db_sync.DbSync(dict(config, merge_pruning=False), stream_schema_message)
+        self.assertIn('ON s.`ID` = t.`ID` WHEN', load(dbsync, {'id': 7}))
+
+    @patch('singer_target_iomete.db_sync.create_connection')
+    def test_close_connection_pools(self, create_connection_patch):
+        """Idle sessions of every pool are closed at shutdown"""
+        pool = db_sync.get_connection_pool(self.minimal_config)
+        with pool.connection() as connection:
+            pass
+
+        db_sync.close_connection_pools()
+        connection.close.assert_called_once_with()
+        self.assertIsNot(db_sync.get_connection_pool(self.minimal_config), pool)
+        db_sync.close_connection_pools()
+
+    def test_rows_per_file(self):
+        """Part files are sized by the max rows and by the size of the previous staged files"""
+        stream_schema_message = {
+            "type": "SCHEMA",
+            "stream": "public-table1",
+            "schema": {"properties": {"id": {"type": ["integer"]}}},
+            "key_properties": ["id"]
+        }
+        dbsync = db_sync.DbSync(dict(self.minimal_config, s3_bucket='dummy-bucket'), stream_schema_message)
+        self.assertIsNone(dbsync.rows_per_file())
+
+        dbsync = db_sync.DbSync(dict(self.minimal_config, s3_bucket='dummy-bucket', max_rows_per_file=5000,
+                                     target_file_size_bytes=1000000), stream_schema_message)
+        self.assertEqual(dbsync.rows_per_file(), 5000)
+        dbsync.track_staged_file(1000, 1000000)
+        self.assertEqual(dbsync.rows_per_file(), 1000)
+        dbsync.track_staged_file(1000, 100)
+        self.assertEqual(dbsync.rows_per_file(), 5000)
+
+    @patch('singer_target_iomete.db_sync.DbSync.execute_query')
+    def test_stage_source(self, query_patch):
+        """Loads read the staged files through a view replaced by every load, or straight from their path"""
+        queries = []
+
+        def execute_query(query):
+            queries.append(' '.join(query.split()))
+            if query.startswith('describe'):
+                return [{'col_name': 'ID', 'data_type': 'long'}, {'col_name': 'C_STR', 'data_type': 'string'}]
+            return []
+
+        query_patch.side_effect = execute_query
+        stream_schema_message = {
+            "stream": "public-table1",
+            "schema": {"properties": {"id": {"type": ["integer"]}, "c_str": {"type": ["null", "string"]}}},
+            "key_properties": ["id"]
+        }
+        config = dict(self.minimal_config, s3_bucket='dummy-bucket')
+
+        dbsync = db_sync.DbSync(config, stream_schema_message)
+        dbsync.load_file('key_1', 10, 100)
+        dbsync.load_file('key_2', 10, 100)
+        views = [q for q in queries if q.startswith('CREATE OR REPLACE TEMPORARY VIEW')]
+        self.assertEqual(len(views), 2)
+        self.assertTrue(all(q.startswith('CREATE OR REPLACE TEMPORARY VIEW stage_dummy_value_table1(') for q in views))
+        self.assertIn('USING (SELECT `C_STR`, `ID` FROM stage_dummy_value_table1) s', queries[-1])
+
+        queries.clear()
+        dbsync = db_sync.DbSync(dict(config, stage_source='path'), stream_schema_message)
+        dbsync.load_file('key_1', 10, 100)
+        self.assertFalse([q for q in queries if q.startswith('CREATE')])
+        # Casts of malformed values fail the load instead of loading nulls
+        self.assertIn("USING (SELECT `C_STR`, `ID` FROM (SELECT CAST(_c0 AS string) AS `C_STR`, "
+                      "CASE WHEN _c1 IS NOT NULL AND CAST(_c1 AS long) IS NULL "
+                      "THEN CAST(raise_error('Malformed long value in column `ID`') AS long) "
+                      "ELSE CAST(_c1 AS long) END AS `ID` FROM csv.`s3a://dummy-bucket/key_1`) stage) s", queries[-1])
+
+        queries.clear()
+        dbsync = db_sync.DbSync(dict(config, stage_source='path', file_format='parquet'), stream_schema_message)
+        dbsync.load_file('key_1/', 10, 100)
+        self.assertIn("USING (SELECT `C_STR`, `ID` FROM parquet.`s3a://dummy-bucket/key_1/`) s", queries[-1])
+
+        # The rows of the batches of a coalesced commit are deduplicated by primary key
+        queries.clear()
+        dbsync.load_file('commit_1/', 20, 200, batches=2)
+        self.assertIn("USING (SELECT `C_STR`, `ID` FROM (SELECT `C_STR`, `ID` FROM (SELECT `C_STR`, `ID`, "
+                      "ROW_NUMBER() OVER (PARTITION BY `ID` ORDER BY _sdc_staged_file DESC) AS _sdc_row_number "
+                      "FROM (SELECT `C_STR`, `ID`, input_file_name() AS _sdc_staged_file "
+                      "FROM parquet.`s3a://dummy-bucket/commit_1/`) files) ranked WHERE _sdc_row_number = 1) latest) s",
+                      queries[-1])
@@ -2,18 +2,31 @@ import io
 import unittest
 import os
 import itertools
+import threading
 
 from contextlib import redirect_stdout
 from datetime import datetime, timedelta
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import singer_target_iomete
 
+from singer_target_iomete.file_formats import csv_format
+from singer_target_iomete.utils.commit_coalescer import CommitCoalescer
+from singer_target_iomete.utils.disk_buffer import DiskBuffer
+
 
 def _mock_record_to_csv_line(record):
     return record
 
 
+class _StageStream(io.BytesIO):
+    """Staged file kept readable after the upload is completed"""
+    key = 'stage_key'
+
+    def close(self):
+        pass
+
+
 class TestTargetIomete(unittest.TestCase):
 
     def setUp(self):
@@ -118,3 +131,311 @@ class TestTargetIomete(unittest.TestCase):
             buf.getvalue().strip(),
             '{"bookmarks": {"tap_mysql_test-test_simple_table": {"replication_key": "id", '
             '"replication_key_value": 100, "version": 1}}}')
+
+    @patch('singer_target_iomete.load_stream_batch')
+    @patch('singer_target_iomete.DbSync')
+    def test_persist_lines_with_async_flush_emits_state_after_batches_loaded(self, dbSync_mock,
+                                                                             load_stream_batch_mock):
+        """
+        With async_flush batches are loaded in the background and every state is emitted after the batches
+        preceding it are loaded
+        """
+        self.config['batch_size_rows'] = 5
+        self.config['async_flush'] = True
+        self.config['max_inflight_batches'] = 1
+
+        with open(f'{os.path.dirname(__file__)}/resources/logical-streams.json', 'r') as f:
+            lines = f.readlines()
+
+        instance = dbSync_mock.return_value
+        instance.create_schema_if_not_exists.return_value = None
+        instance.sync_table.return_value = None
+        instance.record_primary_key.return_value = None
+
+        events = []
+        load_stream_batch_mock.side_effect = lambda **kwargs: events.append(('load', kwargs['stream']))
+
+        with patch('singer_target_iomete.emit_state', side_effect=lambda state: events.append(('state', state))):
+            singer_target_iomete.persist_lines(self.config, lines)
+
+        loads = [event for event in events if event[0] == 'load']
+        self.assertGreater(len(loads), 1)
+
+        # The last state is emitted after every load
+        self.assertEqual(events[-1][0], 'state')
+        self.assertIsNotNone(events[-1][1])
+        self.assertLess(events.index(loads[-1]), len(events) - 1)
+
+    @patch('singer_target_iomete.load_commit')
+    @patch('singer_target_iomete.serialize_batch', side_effect=lambda batch: dict(batch, files=[{}]))
+    @patch('singer_target_iomete.DbSync')
+    def test_persist_lines_with_commit_max_files_emits_state_after_commit(self, dbSync_mock, serialize_batch_mock,
+                                                                          load_commit_mock):
+        """With coalesced commits the staged batches are loaded together and the state is emitted after the load"""
+        self.config['batch_size_rows'] = 5
+        self.config['commit_max_files'] = 3
+
+        with open(f'{os.path.dirname(__file__)}/resources/logical-streams.json', 'r') as f:
+            lines = f.readlines()
+
+        instance = dbSync_mock.return_value
+        instance.create_schema_if_not_exists.return_value = None
+        instance.sync_table.return_value = None
+        instance.record_primary_key.return_value = None
+        instance.stage_commit_key.return_value = 'commit/'
+
+        events = []
+        load_commit_mock.side_effect = lambda commit: events.append(('commit', len(commit['batches'])))
+
+        with patch('singer_target_iomete.emit_state', side_effect=lambda state: events.append(('state', state))):
+            singer_target_iomete.persist_lines(self.config, lines)
+
+        commits = [event for event in events if event[0] == 'commit']
+        self.assertEqual(sum(batches for (_, batches) in commits), serialize_batch_mock.call_count)
+        self.assertLess(len(commits), serialize_batch_mock.call_count)
+
+        # Every state is emitted after a commit
+        states = [i for (i, event) in enumerate(events) if event[0] == 'state' and event[1] is not None]
+        self.assertTrue(states)
+        self.assertEqual(events[states[0] - 1][0], 'commit')
+        self.assertEqual(events[-1][0], 'state')
+
+    @patch('singer_target_iomete.load_commit')
+    @patch('singer_target_iomete.DbSync')
+    def test_persist_lines_with_commit_max_files_commits_on_schema_change_only_if_pending(self, dbSync_mock,
+                                                                                         load_commit_mock):
+        """A SCHEMA message commits the staged batches of its stream, nothing is committed without them"""
+        self.config['commit_max_files'] = 10
+        instance = dbSync_mock.return_value
+        instance.record_primary_key.return_value = None
+
+        lines = self._two_stream_lines(0, 0) + [
+            '{"type": "STATE", "value": {"bookmarks": {"narrow": 1}}}',
+            '{"type": "SCHEMA", "stream": "narrow", "schema": {"properties": {"id": {"type": "string"}}}, '
+            '"key_properties": ["id"]}'
+        ]
+        with patch('singer_target_iomete.emit_state') as emit_state_mock:
+            singer_target_iomete.persist_lines(self.config, lines)
+
+        load_commit_mock.assert_not_called()
+        self.assertEqual([c.args[0] for c in emit_state_mock.call_args_list], [{'bookmarks': {'narrow': 1}}])
+
+    @patch('singer_target_iomete.load_batch')
+    @patch('singer_target_iomete.upload_batch', side_effect=lambda batch: batch)
+    @patch('singer_target_iomete.serialize_batch')
+    @patch('singer_target_iomete.DbSync')
+    def test_persist_lines_with_flush_pipeline_serializes_while_loading(self, dbSync_mock, serialize_batch_mock,
+                                                                       upload_batch_mock, load_batch_mock):
+        """Without async_flush the flush pipeline serializes the next batch while the previous one loads"""
+        self.config['batch_size_rows'] = 5
+        self.config['flush_pipeline'] = True
+
+        with open(f'{os.path.dirname(__file__)}/resources/logical-streams.json', 'r') as f:
+            lines = f.readlines()
+
+        instance = dbSync_mock.return_value
+        instance.create_schema_if_not_exists.return_value = None
+        instance.sync_table.return_value = None
+        instance.record_primary_key.return_value = None
+
+        next_batch_serialized = threading.Event()
+        overlaps = []
+
+        def serialize_batch(batch):
+            if serialize_batch_mock.call_count > 1:
+                next_batch_serialized.set()
+            return batch
+
+        def load_batch(batch):
+            # The first load finishes only once the next batch got serialized
+            if load_batch_mock.call_count == 1:
+                overlaps.append(next_batch_serialized.wait(timeout=5))
+            return batch
+
+        serialize_batch_mock.side_effect = serialize_batch
+        load_batch_mock.side_effect = load_batch
+
+        with patch('singer_target_iomete.emit_state'):
+            singer_target_iomete.persist_lines(self.config, lines)
+
+        self.assertGreater(load_batch_mock.call_count, 1)
+        self.assertEqual(overlaps, [True])
+
+    @staticmethod
+    def _two_stream_lines(records_per_stream, wide_record_size):
+        """Messages of a narrow and a wide stream, interleaved"""
+        lines = [
+            '{"type": "SCHEMA", "stream": "narrow", "schema": {"properties": {"id": {"type": "integer"}}}, '
+            '"key_properties": ["id"]}',
+            '{"type": "SCHEMA", "stream": "wide", "schema": {"properties": {"id": {"type": "integer"}, '
+            '"c_str": {"type": "string"}}}, "key_properties": ["id"]}'
+        ]
+        for i in range(records_per_stream):
+            lines.append(f'{{"type": "RECORD", "stream": "narrow", "record": {{"id": {i}}}}}')
+            lines.append(f'{{"type": "RECORD", "stream": "wide", "record": {{"id": {i}, '
+                         f'"c_str": "{"x" * wide_record_size}"}}}}')
+        return lines
+
+    @patch('singer_target_iomete.flush_streams')
+    @patch('singer_target_iomete.DbSync')
+    def test_persist_lines_with_batch_size_bytes(self, dbSync_mock, flush_streams_mock):
+        """Streams are flushed when their buffer reaches batch_size_bytes"""
+        self.config['batch_size_bytes'] = 5000
+        flushed_streams = []
+
+        def flush_streams(streams, row_count, stream_to_sync, config, state, flushed_state, **kwargs):
+            flushed_streams.append(kwargs.get('filter_streams'))
+            for stream in kwargs.get('filter_streams') or streams:
+                row_count[stream] = 0
+                kwargs['buffer_bytes'][stream] = 0
+
+        dbSync_mock.return_value.record_primary_key.side_effect = lambda record: record['id']
+        flush_streams_mock.side_effect = flush_streams
+
+        singer_target_iomete.persist_lines(self.config, self._two_stream_lines(20, 1000))
+
+        # Only the wide stream reaches the limit, every 5th record, then everything is flushed at the end
+        self.assertEqual(flushed_streams, [['wide']] * 4 + [None])
+
+    @patch('singer_target_iomete.flush_streams')
+    @patch('singer_target_iomete.DbSync')
+    def test_persist_lines_with_max_buffer_bytes(self, dbSync_mock, flush_streams_mock):
+        """The largest buffers are flushed or spilled to disk when the buffers reach max_buffer_bytes"""
+        self.config['max_buffer_bytes'] = 20000
+        flushed_streams = []
+        flushed_buffers = []
+
+        def flush_streams(streams, row_count, stream_to_sync, config, state, flushed_state, **kwargs):
+            flushed_streams.append(kwargs.get('filter_streams'))
+            flushed_buffers.append({stream: type(records).__name__ for (stream, records) in streams.items()})
+            for stream in kwargs.get('filter_streams') or streams:
+                row_count[stream] = 0
+                kwargs['buffer_bytes'][stream] = 0
+                streams[stream] = {}
+
+        dbSync_mock.return_value.record_primary_key.side_effect = lambda record: record['id']
+        flush_streams_mock.side_effect = flush_streams
+
+        singer_target_iomete.persist_lines(self.config, self._two_stream_lines(20, 1000))
+        self.assertEqual(flushed_streams, [['wide']] + [None])
+
+        # Spilled buffers are flushed only at the end
+        flushed_streams.clear()
+        self.config['spill_to_disk'] = True
+        singer_target_iomete.persist_lines(self.config, self._two_stream_lines(20, 1000))
+        self.assertEqual(flushed_streams, [None])
+        self.assertEqual(flushed_buffers[-1], {'narrow': 'dict', 'wide': 'DiskBuffer'})
+
+    @patch('singer_target_iomete.flush_streams')
+    @patch('singer_target_iomete.DbSync')
+    def test_persist_lines_without_primary_key(self, dbSync_mock, flush_streams_mock):
+        """Records of streams without primary key are appended to a list"""
+        self.config['primary_key_required'] = False
+        flushed_records = []
+
+        def flush_streams(streams, row_count, stream_to_sync, config, state, flushed_state, **kwargs):
+            flushed_records.append((dict(streams), dict(row_count)))
+
+        dbSync_mock.return_value.record_primary_key.return_value = None
+        flush_streams_mock.side_effect = flush_streams
+
+        lines = ['{"type": "SCHEMA", "stream": "tbl", "schema": {"properties": {"id": {"type": "integer"}}}, '
+                 '"key_properties": []}']
+        lines += ['{"type": "RECORD", "stream": "tbl", "record": {"id": 1}}'] * 2
+        singer_target_iomete.persist_lines(self.config, lines)
+
+        self.assertEqual(flushed_records, [({'tbl': [{'id': 1}, {'id': 1}]}, {'tbl': 2})])
+
+    def _serialize_batch_db_sync(self, stages):
+        db_sync = MagicMock(stage_on_disk=False, buffer_serialized_rows=False, compression_threads=1,
+                            compression_level=None, data_flattening_max_level=0, record_plan=None,
+                            flatten_schema={'id': {'type': ['integer']}})
+        db_sync.compression_codec.return_value = 'none'
+        db_sync.file_format = csv_format
+        db_sync.stage_file_key.side_effect = \
+            lambda stream, file_suffix, key_prefix=None: f'{key_prefix or ""}{stream}_key{file_suffix}'
+        db_sync.open_stage_stream.side_effect = lambda s3_key: stages.setdefault(s3_key, _StageStream())
+        return db_sync
+
+    def test_serialize_batch_streams_to_stage(self):
+        """Staged files are streamed to s3 without a local file unless stage_on_disk is enabled"""
+        stages = {}
+        db_sync = self._serialize_batch_db_sync(stages)
+        db_sync.rows_per_file.return_value = None
+
+        batch = singer_target_iomete.serialize_batch({'stream': 'tbl', 'records': {1: {'id': 1}, 2: {'id': 2}},
+                                                      'db_sync': db_sync, 'temp_dir': None, 'no_compression': False})
+
+        self.assertEqual({key: stage.getvalue() for key, stage in stages.items()}, {'tbl_key.csv': b'1\n2\n'})
+        self.assertEqual((batch['s3_key'], batch['row_count'], batch['size_bytes']), ('tbl_key.csv', 2, 4))
+        self.assertIs(singer_target_iomete.upload_batch(batch), batch)
+        db_sync.put_to_stage.assert_not_called()
+
+        singer_target_iomete.load_batch(batch)
+        db_sync.load_file.assert_called_once_with('tbl_key.csv', 2, 4, None)
+        db_sync.delete_from_stage.assert_called_once_with('tbl', 'tbl_key.csv')
+
+    def test_serialize_batch_closes_disk_buffer(self):
+        """Records spilled to disk are released once written, also when the batch fails"""
+        stages = {}
+        db_sync = self._serialize_batch_db_sync(stages)
+        db_sync.rows_per_file.return_value = None
+
+        records = DiskBuffer({1: {'id': 1}, 2: {'id': 2}})
+        batch = singer_target_iomete.serialize_batch({'stream': 'tbl', 'records': records, 'db_sync': db_sync,
+                                                      'temp_dir': None, 'no_compression': False})
+        self.assertEqual(stages['tbl_key.csv'].getvalue(), b'1\n2\n')
+        self.assertEqual(batch['row_count'], 2)
+        self.assertTrue(records._file.closed)
+
+        records = DiskBuffer({1: {'id': 1}})
+        db_sync.open_stage_stream.side_effect = IOError('S3 is down')
+        with self.assertRaises(IOError):
+            singer_target_iomete.serialize_batch({'stream': 'tbl', 'records': records, 'db_sync': db_sync,
+                                                  'temp_dir': None, 'no_compression': False})
+        self.assertTrue(records._file.closed)
+
+    def test_serialize_batch_split_into_part_files(self):
+        """Large batches are staged as part files under the prefix loaded by iomete"""
+        stages = {}
+        db_sync = self._serialize_batch_db_sync(stages)
+        db_sync.rows_per_file.return_value = 2
+
+        batch = singer_target_iomete.serialize_batch({'stream': 'tbl', 'records': [{'id': i} for i in range(5)],
+                                                      'db_sync': db_sync, 'temp_dir': None, 'no_compression': False})
+
+        self.assertEqual({key: stage.getvalue() for key, stage in stages.items()}, {
+            'tbl_key/part_00000.csv': b'0\n1\n',
+            'tbl_key/part_00001.csv': b'2\n3\n',
+            'tbl_key/part_00002.csv': b'4\n'
+        })
+        self.assertEqual((batch['s3_key'], batch['row_count'], batch['size_bytes']), ('tbl_key/', 5, 10))
+        self.assertEqual(db_sync.track_staged_file.call_count, 3)
+
+        singer_target_iomete.load_batch(batch)
+        db_sync.load_file.assert_called_once_with('tbl_key/', 5, 10, None)
+        self.assertEqual([c.args[1] for c in db_sync.delete_from_stage.call_args_list], list(stages))
+
+    def test_flush_records_coalesces_batches_into_one_load(self):
+        """Coalesced batches are staged under the commit prefix of the stream and loaded by a single load"""
+        stages = {}
+        db_sync = self._serialize_batch_db_sync(stages)
+        db_sync.rows_per_file.return_value = None
+        db_sync.stage_commit_key.return_value = 'tbl_commit/'
+        coalescer = CommitCoalescer(max_files=3)
+
+        singer_target_iomete.flush_records('tbl', {1: {'id': 1}}, db_sync, coalescer=coalescer)
+        self.assertFalse(coalescer.is_due())
+        db_sync.rows_per_file.return_value = 1
+        singer_target_iomete.flush_records('tbl', [{'id': 1}, {'id': 2}], db_sync, coalescer=coalescer)
+        self.assertTrue(coalescer.is_due())
+        self.assertEqual(list(stages), ['tbl_commit/000001_tbl_key.csv',
+                                        'tbl_commit/000002_tbl_key_part_00000.csv',
+                                        'tbl_commit/000002_tbl_key_part_00001.csv'])
+        db_sync.load_file.assert_not_called()
+
+        singer_target_iomete.commit_streams(coalescer, {}, {'bookmarks': {'tbl': 2}})
+        db_sync.load_file.assert_called_once_with('tbl_commit/', 3, 6, None, batches=2)
+        self.assertEqual([c.args[1] for c in db_sync.delete_from_stage.call_args_list], list(stages))
+        self.assertEqual(coalescer.take_committed_state(), {'bookmarks': {'tbl': 2}})
+        self.assertFalse(coalescer.is_due())
@@ -0,0 +1,72 @@
+import threading
+import time
+import unittest
+
+from singer_target_iomete.utils.background_flush import BackgroundFlusher
+
+
+class TestBackgroundFlusher(unittest.TestCase):
+
+    def test_states_emitted_in_order_after_jobs(self):
+        """States are emitted in submission order, each one after its own job finished"""
+        events = []
+        flusher = BackgroundFlusher(lambda state: events.append(('state', state)), max_inflight_batches=2)
+
+        def job(batch, delay):
+            time.sleep(delay)
+            events.append(('job', batch))
+
+        flusher.submit(lambda: job(1, 0.05), {'pos': 1})
+        flusher.submit(lambda: job(2, 0.0), {'pos': 2})
+        flusher.close()
+
+        self.assertEqual(events, [('job', 1), ('state', {'pos': 1}),
+                                  ('job', 2), ('state', {'pos': 2})])
+
+    def test_submit_blocks_when_queue_is_full(self):
+        """Submitting more jobs than max_inflight_batches blocks until the worker catches up"""
+        release = threading.Event()
+        flusher = BackgroundFlusher(lambda state: None, max_inflight_batches=2)
+
+        flusher.submit(release.wait)   # taken by the worker
+        flusher.submit(lambda: None)   # waiting, the limit is reached
+
+        submitted = threading.Event()
+        threading.Thread(target=lambda: (flusher.submit(lambda: None), submitted.set())).start()
+        self.assertFalse(submitted.wait(0.1))
+
+        release.set()
+        self.assertTrue(submitted.wait(1))
+        flusher.close()
+
+    def test_running_job_counts_as_in_flight(self):
+        """With a limit of one, the next job is accepted only once the running job finished"""
+        release = threading.Event()
+        flusher = BackgroundFlusher(lambda state: None, max_inflight_batches=1)
+
+        flusher.submit(release.wait)
+
+        submitted = threading.Event()
+        threading.Thread(target=lambda: (flusher.submit(lambda: None), submitted.set())).start()
+        self.assertFalse(submitted.wait(0.1))
+
+        release.set()
+        self.assertTrue(submitted.wait(1))
+        flusher.close()
+
+    def test_failed_job_stops_state_emission_and_is_raised(self):
+        """After a failure no further state is emitted and the error is raised in the caller"""
+        states = []
+        flusher = BackgroundFlusher(states.append)
+
+        def failing_job():
+            raise ValueError('load failed')
+
+        flusher.submit(failing_job, {'pos': 1})
+        flusher.submit(lambda: None, {'pos': 2})
+
+        with self.assertRaises(ValueError):
+            flusher.wait()
+        with self.assertRaises(ValueError):
+            flusher.submit(lambda: None, {'pos': 3})
+        self.assertEqual(states, [])
@@ -0,0 +1,68 @@
+import unittest
+
+from datetime import date, datetime, timezone
+
+from singer_target_iomete.utils.batch_stats import BatchStats, NOT_COMPARABLE, comparable_value, sql_literal
+
+
+class TestBatchStats(unittest.TestCase):
+    """
+    Unit Tests
+    """
+
+    def test_comparable_value(self):
+        """Record values are converted to python values sorting like the loaded values"""
+        self.assertEqual(comparable_value(5, 'long'), 5)
+        self.assertEqual(comparable_value(None, 'long'), None)
+        self.assertIs(comparable_value(True, 'long'), NOT_COMPARABLE)
+        self.assertIs(comparable_value('5', 'double'), NOT_COMPARABLE)
+        self.assertEqual(comparable_value('2021-01-01T10:00:00+02:00', 'timestamp'),
+                         datetime(2021, 1, 1, 8, 0, tzinfo=timezone.utc))
+        self.assertIs(comparable_value('2021-01-01T10:00:00', 'timestamp'), NOT_COMPARABLE)
+        self.assertIs(comparable_value('not a date', 'timestamp'), NOT_COMPARABLE)
+        self.assertEqual(comparable_value('2021-01-01', 'date'), date(2021, 1, 1))
+        self.assertEqual(comparable_value('abc', 'string'), 'abc')
+        self.assertIs(comparable_value({'a': 1}, 'string'), NOT_COMPARABLE)
+
+    def test_min_max(self):
+        """Bounds are tracked per column and dropped once a value is not comparable"""
+        batch_stats = BatchStats({'id': 'long', 'updated_at': 'timestamp'})
+        for record in [{'id': 3, 'updated_at': '2021-01-01T00:00:00+00:00'},
+                       {'id': 1, 'updated_at': '2021-01-02T00:00:00'},
+                       {'id': 7, 'updated_at': None},
+                       {'id': None}]:
+            batch_stats.update(record)
+
+        self.assertEqual(batch_stats.min_max('id'), (1, 7))
+        self.assertIsNone(batch_stats.min_max('updated_at'))
+        self.assertEqual(batch_stats.has_nulls, {'id'})
+        self.assertIsNone(BatchStats({'id': 'long'}).min_max('id'))
+
+    def test_merge(self):
+        """Statistics of several batches are merged into the statistics of their commit"""
+        batch_stats = BatchStats({'id': 'long', 'name': 'string'})
+        batch_stats.update({'id': 3, 'name': 'b'})
+        other = BatchStats({'id': 'long', 'name': 'string'})
+        for record in [{'id': 1, 'name': None}, {'id': 5, 'name': 'a'}]:
+            other.update(record)
+
+        batch_stats.merge(other)
+        self.assertEqual(batch_stats.min_max('id'), (1, 5))
+        self.assertEqual(batch_stats.min_max('name'), ('a', 'b'))
+        self.assertEqual(batch_stats.has_nulls, {'name'})
+
+        other = BatchStats({'id': 'long'})
+        other.update({'id': 'x'})
+        batch_stats.merge(other)
+        self.assertIsNone(batch_stats.min_max('id'))
+
+    def test_sql_literal(self):
+        """Bounds are converted to exact spark SQL literals"""
+        self.assertEqual(sql_literal(5, 'long'), '5')
+        self.assertEqual(sql_literal(1.5, 'double'), '1.5')
+        self.assertIsNone(sql_literal(float('nan'), 'double'))
+        self.assertEqual(sql_literal(datetime(2021, 1, 1, 0, 0, 0, 1, tzinfo=timezone.utc), 'timestamp'),
+                         'TIMESTAMP_MICROS(1609459200000001)')
+        self.assertEqual(sql_literal(date(2021, 1, 1), 'date'), "DATE '2021-01-01'")
+        self.assertEqual(sql_literal("it's a \\ test", 'string'), "'it\\'s a \\\\ test'")
+        self.assertIsNone(sql_literal(1.5, 'long'))
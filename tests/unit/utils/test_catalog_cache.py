@@ -0,0 +1,81 @@
+import unittest
+
+from singer_target_iomete.utils.catalog_cache import CatalogCache, parse_table_columns
+
+TABLE1_INFORMATION = """Database: schema1
+Table: table1
+Is Temporary: false
+Schema: root
+ |-- ID: long (nullable = true)
+ |-- C_STR: string (nullable = true)
+ |-- C_ARR: array (nullable = true)
+ |    |-- element: string (containsNull = true)
+"""
+
+
+class TestCatalogCache(unittest.TestCase):
+
+    def setUp(self):
+        self.queries = []
+
+    def execute_query(self, query):
+        self.queries.append(query)
+        if query == 'SHOW SCHEMAS':
+            return [{'namespace': 'default'}, {'namespace': 'schema1'}, {'namespace': 'not_configured'}]
+        if query == 'SHOW TABLES IN schema1':
+            return [{'namespace': 'schema1', 'tableName': 'table1', 'isTemporary': False},
+                    {'namespace': 'schema1', 'tableName': 'table2', 'isTemporary': False},
+                    {'namespace': '', 'tableName': 'tmp', 'isTemporary': True}]
+        if query.startswith('SHOW TABLE EXTENDED IN schema1'):
+            return [{'namespace': 'schema1', 'tableName': 'table1', 'information': TABLE1_INFORMATION}]
+        raise Exception(f'Unexpected query {query}')
+
+    def test_parse_table_columns(self):
+        """Top level columns are parsed from the schema tree with the types printed by DESCRIBE"""
+        self.assertEqual(parse_table_columns(TABLE1_INFORMATION), [
+            {'COLUMN_NAME': 'ID', 'DATA_TYPE': 'bigint'},
+            {'COLUMN_NAME': 'C_STR', 'DATA_TYPE': 'string'},
+            {'COLUMN_NAME': 'C_ARR', 'DATA_TYPE': 'array'},
+        ])
+        self.assertIsNone(parse_table_columns('Table: table1'))
+
+    def test_load(self):
+        """Schemas, tables and columns are loaded in bulk and looked up from memory"""
+        cache = CatalogCache.load(self.execute_query, ['schema1', 'new_schema'])
+
+        self.assertEqual(len(self.queries), 3)
+        self.assertTrue(cache.has_schema('SCHEMA1'))
+        self.assertFalse(cache.has_schema('new_schema'))
+        self.assertTrue(cache.has_table('schema1', '`TABLE1`'))
+        self.assertFalse(cache.has_table('schema1', 'tmp'))
+        self.assertFalse(cache.has_table('schema1', 'table3'))
+        self.assertIsNone(cache.has_table('not_configured', 'table1'))
+        self.assertEqual(len(cache.get_columns('schema1', 'table1')), 3)
+        self.assertIsNone(cache.get_columns('schema1', 'table2'))
+
+    def test_updates(self):
+        """Objects created by the target are registered in the cache"""
+        cache = CatalogCache.load(self.execute_query, ['schema1'])
+
+        cache.add_schema('new_schema', created=True)
+        self.assertTrue(cache.has_schema('new_schema'))
+        self.assertFalse(cache.has_table('new_schema', 'table1'))
+
+        cache.set_columns('new_schema', 'table1', [{'COLUMN_NAME': 'ID', 'DATA_TYPE': 'bigint'}])
+        self.assertTrue(cache.has_table('new_schema', 'table1'))
+        self.assertEqual(cache.get_columns('new_schema', 'table1'), [{'COLUMN_NAME': 'ID', 'DATA_TYPE': 'bigint'}])
+
+        # Tables of schemas outside of the snapshot stay unknown
+        cache.set_columns('not_configured', 'table1', [])
+        self.assertIsNone(cache.has_table('not_configured', 'table1'))
+
+    def test_columns_not_supported(self):
+        """Tables are still cached if columns cannot be loaded in bulk"""
+        def execute_query(query):
+            if query.startswith('SHOW TABLE EXTENDED'):
+                raise Exception('SHOW TABLE EXTENDED is not supported for v2 tables')
+            return self.execute_query(query)
+
+        cache = CatalogCache.load(execute_query, ['schema1'])
+        self.assertTrue(cache.has_table('schema1', 'table1'))
+        self.assertIsNone(cache.get_columns('schema1', 'table1'))
@@ -0,0 +1,87 @@
+import unittest
+
+from unittest.mock import MagicMock
+
+from singer_target_iomete.utils.commit_coalescer import CommitCoalescer
+
+
+class TestCommitCoalescer(unittest.TestCase):
+    """
+    Unit Tests
+    """
+
+    def setUp(self):
+        self.now = 0
+        self.db_sync = MagicMock()
+        self.db_sync.stage_commit_key.side_effect = lambda stream: f'{stream}_commit/'
+
+    def _add_batch(self, coalescer, stream, files=1):
+        key_prefix = coalescer.batch_key_prefix(stream, self.db_sync)
+        coalescer.add(stream, {'stream': stream, 'files': [{'s3_key': f'{key_prefix}{i}'} for i in range(files)]})
+        return key_prefix
+
+    def test_batch_key_prefix(self):
+        """Files of the batches of a stream are staged under its commit prefix, named in batch order"""
+        coalescer = CommitCoalescer(max_files=10)
+        self.assertEqual(self._add_batch(coalescer, 'tbl'), 'tbl_commit/000001_')
+        self.assertEqual(self._add_batch(coalescer, 'other'), 'other_commit/000001_')
+        self.assertEqual(self._add_batch(coalescer, 'tbl'), 'tbl_commit/000002_')
+        self.db_sync.stage_commit_key.assert_any_call('tbl')
+        self.assertEqual(self.db_sync.stage_commit_key.call_count, 2)
+
+    def test_has_pending(self):
+        """Only streams with staged batches have a pending commit"""
+        coalescer = CommitCoalescer(max_files=10)
+        self.assertFalse(coalescer.has_pending('tbl'))
+        self._add_batch(coalescer, 'tbl')
+        self.assertTrue(coalescer.has_pending('tbl'))
+        self.assertFalse(coalescer.has_pending('other'))
+        coalescer.take()
+        self.assertFalse(coalescer.has_pending('tbl'))
+
+    def test_is_due_by_max_files(self):
+        """The commit is due once the staged files of every stream reach max_files"""
+        coalescer = CommitCoalescer(max_files=4)
+        self.assertFalse(coalescer.is_due())
+        self._add_batch(coalescer, 'tbl', files=2)
+        self._add_batch(coalescer, 'other')
+        self.assertEqual(coalescer.pending_files(), 3)
+        self.assertFalse(coalescer.is_due())
+        self._add_batch(coalescer, 'tbl')
+        self.assertTrue(coalescer.is_due())
+
+    def test_is_due_by_interval(self):
+        """The commit is due once the oldest waiting batch is interval_seconds old"""
+        coalescer = CommitCoalescer(interval_seconds=60, clock=lambda: self.now)
+        self.now = 100
+        self._add_batch(coalescer, 'tbl')
+        self.now = 150
+        self._add_batch(coalescer, 'tbl')
+        self.assertFalse(coalescer.is_due())
+        self.now = 160
+        self.assertTrue(coalescer.is_due())
+
+    def test_take(self):
+        """Taking the commits starts new ones"""
+        coalescer = CommitCoalescer(interval_seconds=60, clock=lambda: self.now)
+        self._add_batch(coalescer, 'tbl')
+        self._add_batch(coalescer, 'tbl')
+
+        commits = coalescer.take()
+        self.assertEqual(list(commits), ['tbl'])
+        self.assertEqual(commits['tbl']['s3_key'], 'tbl_commit/')
+        self.assertEqual([batch['files'][0]['s3_key'] for batch in commits['tbl']['batches']],
+                         ['tbl_commit/000001_0', 'tbl_commit/000002_0'])
+        self.assertEqual(coalescer.take(), {})
+
+        self.now = 1000
+        self.assertFalse(coalescer.is_due())
+        self.assertEqual(self._add_batch(coalescer, 'tbl'), 'tbl_commit/000001_')
+
+    def test_take_committed_state(self):
+        """The state of a commit is taken once"""
+        coalescer = CommitCoalescer(max_files=1)
+        self.assertIsNone(coalescer.take_committed_state())
+        coalescer.committed_state = {'bookmarks': {}}
+        self.assertEqual(coalescer.take_committed_state(), {'bookmarks': {}})
+        self.assertIsNone(coalescer.take_committed_state())
@@ -0,0 +1,89 @@
+import gzip
+import io
+import unittest
+
+import zstandard
+
+from singer_target_iomete.utils import compression
+
+
+class TestCompression(unittest.TestCase):
+    """
+    Unit Tests
+    """
+
+    def test_configured_codec(self):
+        """Default codec depends on the file format, no_compression disables compression"""
+        self.assertEqual(compression.configured_codec({}), 'gzip')
+        self.assertEqual(compression.configured_codec({'file_format': 'parquet'}), 'snappy')
+        self.assertEqual(compression.configured_codec({'compression': 'ZSTD'}), 'zstd')
+        self.assertEqual(compression.configured_codec({'compression': 'zstd', 'no_compression': True}), 'none')
+
+    def test_validate_compression(self):
+        """Codecs iomete cannot read from the file format are rejected"""
+        self.assertEqual(compression.validate_compression({'compression': 'auto'}), [])
+        self.assertEqual(compression.validate_compression({'file_format': 'parquet', 'compression': 'lz4'}), [])
+        self.assertEqual(len(compression.validate_compression({'compression': 'lz4'})), 1)
+        self.assertEqual(len(compression.validate_compression({'compression': 'gzip', 'compression_level': '9'})), 1)
+
+    def test_validate_compression_level(self):
+        """Parquet codecs without compression levels don't take one"""
+        for codec in ['gzip', 'zstd', 'lz4']:
+            self.assertEqual(compression.validate_compression({'file_format': 'parquet', 'compression': codec,
+                                                               'compression_level': 1}), [])
+        for codec in ['none', 'snappy', 'auto']:
+            self.assertEqual(len(compression.validate_compression({'file_format': 'parquet', 'compression': codec,
+                                                                   'compression_level': 1})), 1)
+        self.assertEqual(len(compression.validate_compression({'file_format': 'parquet', 'compression_level': 1})), 1)
+        self.assertEqual(compression.validate_compression({'compression': 'auto', 'compression_level': 1}), [])
+
+    def test_resolve_codec(self):
+        """Automatic mode skips compression of tiny batches"""
+        self.assertEqual(compression.resolve_codec('auto', 'csv', 10), 'none')
+        self.assertEqual(compression.resolve_codec('auto', 'csv', compression.AUTO_MIN_ROWS), 'gzip')
+        self.assertEqual(compression.resolve_codec('auto', 'parquet', compression.AUTO_MIN_ROWS), 'snappy')
+        self.assertEqual(compression.resolve_codec('zstd', 'csv', 10), 'zstd')
+
+    def test_compressed_writer(self):
+        """Data written through the writer is compressed by the codec"""
+        data = b'1,"a"\n' * 1000
+
+        for codec, decompress in [('none', lambda x: x),
+                                  ('gzip', gzip.decompress),
+                                  ('zstd', lambda x: zstandard.ZstdDecompressor().decompressobj().decompress(x))]:
+            for level in [None, 1]:
+                outfile = io.BytesIO()
+                with compression.compressed_writer(outfile, codec, level) as writer:
+                    writer.write(data)
+                self.assertFalse(outfile.closed)
+                self.assertEqual(decompress(outfile.getvalue()), data)
+
+    def test_parallel_gzip_writer(self):
+        """Blocks compressed in parallel are decompressed in order as a single stream"""
+        data = [f'{i},"row {i}"\n'.encode('utf-8') for i in range(10000)]
+
+        outfile = io.BytesIO()
+        with compression.compressed_writer(outfile, 'gzip', 1, threads=4) as writer:
+            self.assertIsInstance(writer, compression.ParallelGzipWriter)
+            writer.block_size = 1000
+            for row in data:
+                writer.write(row)
+
+        self.assertGreater(writer._written_blocks, 100)
+        self.assertEqual(gzip.decompress(outfile.getvalue()), b''.join(data))
+
+    def test_parallel_gzip_writer_empty(self):
+        """Empty files are valid gzip files"""
+        outfile = io.BytesIO()
+        with compression.ParallelGzipWriter(outfile, threads=2):
+            pass
+        self.assertEqual(gzip.decompress(outfile.getvalue()), b'')
+
+    def test_parallel_zstd_writer(self):
+        """Multi-threaded zstd writes a single stream"""
+        data = b'1,"a"\n' * 100000
+        outfile = io.BytesIO()
+        with compression.compressed_writer(outfile, 'zstd', threads=2) as writer:
+            writer.write(data)
+        outfile.seek(0)
+        self.assertEqual(zstandard.ZstdDecompressor().stream_reader(outfile).read(), data)
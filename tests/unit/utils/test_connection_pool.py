@@ -0,0 +1,106 @@
+import threading
+import time
+import unittest
+
+from singer_target_iomete.utils.connection_pool import ConnectionPool
+
+
+class FakeCursor:
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query):
+        if not self.connection.alive:
+            raise ConnectionError('session closed')
+        self.connection.queries.append(query)
+
+    def fetchall(self):
+        return []
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+        self.queries = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.connections = []
+
+    def connect(self):
+        connection = FakeConnection()
+        self.connections.append(connection)
+        return connection
+
+    def test_connections_are_reused(self):
+        """A returned connection is handed out again instead of opening a new one"""
+        pool = ConnectionPool(self.connect, max_size=2)
+
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+
+        self.assertIs(first, second)
+        self.assertEqual(len(self.connections), 1)
+
+    def test_max_size_limits_open_connections(self):
+        """Callers wait for a free connection when every connection is in use"""
+        pool = ConnectionPool(self.connect, max_size=1)
+        borrowed = threading.Event()
+
+        def borrow():
+            with pool.connection():
+                borrowed.set()
+
+        with pool.connection():
+            thread = threading.Thread(target=borrow)
+            thread.start()
+            self.assertFalse(borrowed.wait(0.1))
+
+        thread.join(1)
+        self.assertTrue(borrowed.is_set())
+        self.assertEqual(len(self.connections), 1)
+
+    def test_dead_connections_are_replaced(self):
+        """Connections that failed the health check or a query with a dead session are reopened"""
+        pool = ConnectionPool(self.connect, max_size=1, health_check_seconds=0)
+
+        with pool.connection() as first:
+            pass
+        first.alive = False
+
+        with pool.connection() as second:
+            pass
+        self.assertIsNot(first, second)
+        self.assertTrue(first.closed)
+
+        with self.assertRaises(ConnectionError):
+            with pool.connection() as third:
+                third.alive = False
+                third.cursor().execute('MERGE INTO ...')
+        self.assertTrue(third.closed)
+
+    def test_idle_connections_are_evicted(self):
+        """Connections idle for longer than idle_timeout_seconds are closed"""
+        pool = ConnectionPool(self.connect, max_size=1, idle_timeout_seconds=0.01)
+
+        with pool.connection() as first:
+            pass
+        time.sleep(0.02)
+        with pool.connection() as second:
+            pass
+
+        self.assertTrue(first.closed)
+        self.assertIsNot(first, second)
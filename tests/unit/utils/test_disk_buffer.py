@@ -0,0 +1,32 @@
+import unittest
+
+from singer_target_iomete.utils.disk_buffer import DiskBuffer
+
+
+class TestDiskBuffer(unittest.TestCase):
+    """
+    Unit Tests
+    """
+
+    def test_behaves_like_dict(self):
+        """Records are read back from disk by primary key, replaced records keep their position"""
+        buffer = DiskBuffer({'1': {'id': 1, 'c_str': 'a'}, '2': {'id': 2, 'c_str': 'b'}})
+        buffer['1'] = {'id': 1, 'c_str': 'updated'}
+        buffer['3'] = {'id': 3, 'c_obj': {'nested': [1, 2]}}
+
+        self.assertEqual(len(buffer), 3)
+        self.assertIn('2', buffer)
+        self.assertNotIn('4', buffer)
+        self.assertEqual(list(buffer.values()), [{'id': 1, 'c_str': 'updated'},
+                                                 {'id': 2, 'c_str': 'b'},
+                                                 {'id': 3, 'c_obj': {'nested': [1, 2]}}])
+
+        buffer.close()
+        self.assertEqual(len(buffer), 0)
+
+    def test_append(self):
+        """Records of streams without primary key are appended"""
+        buffer = DiskBuffer([{'id': 1}, {'id': 1}])
+        buffer.append({'id': 2})
+
+        self.assertEqual(list(buffer.values()), [{'id': 1}, {'id': 1}, {'id': 2}])
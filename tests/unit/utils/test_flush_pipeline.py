@@ -0,0 +1,104 @@
+import threading
+import time
+import unittest
+
+from singer_target_iomete.utils.flush_pipeline import FlushPipeline
+
+
+class TestFlushPipeline(unittest.TestCase):
+
+    def test_last_stage_runs_in_submission_order_per_key(self):
+        """Batches of the same key are loaded in order even if the earlier stages finish out of order"""
+        loaded = []
+
+        def slow_first(batch):
+            time.sleep(batch['delay'])
+            return batch
+
+        pipeline = FlushPipeline(stages=[('serialize', slow_first, 4),
+                                         ('load', lambda batch: loaded.append(batch['id']), 4)],
+                                 max_inflight_batches=10)
+
+        futures = [pipeline.submit('stream', {'id': i, 'delay': delay})
+                   for i, delay in enumerate([0.1, 0.05, 0.0])]
+        for future in futures:
+            future.result()
+        pipeline.shutdown()
+
+        self.assertEqual(loaded, [0, 1, 2])
+
+    def test_next_batch_is_processed_while_previous_one_loads(self):
+        """The first stage of a batch runs while the last stage of the previous batch is still running"""
+        load_started = threading.Event()
+        release_load = threading.Event()
+        serialized = []
+
+        def load(batch):
+            load_started.set()
+            release_load.wait(1)
+            return batch
+
+        pipeline = FlushPipeline(stages=[('serialize', serialized.append, 1), ('load', load, 1)],
+                                 max_inflight_batches=10)
+
+        first = pipeline.submit('stream', 1)
+        load_started.wait(1)
+        second = pipeline.submit('stream', 2)
+
+        time.sleep(0.05)
+        self.assertEqual(serialized, [1, 2])
+        self.assertFalse(first.done())
+
+        release_load.set()
+        first.result()
+        second.result()
+        pipeline.shutdown()
+
+    def test_failure_fails_the_next_batch_of_the_same_key(self):
+        """A failed batch is not skipped silently, later batches of the same key fail as well"""
+        def load(batch):
+            if batch == 'bad':
+                raise ValueError('load failed')
+            return batch
+
+        pipeline = FlushPipeline(stages=[('serialize', lambda batch: batch, 1), ('load', load, 1)],
+                                 max_inflight_batches=10)
+
+        failed = pipeline.submit('stream_a', 'bad')
+        next_batch = pipeline.submit('stream_a', 'good')
+        other_stream = pipeline.submit('stream_b', 'good')
+
+        with self.assertRaises(ValueError):
+            failed.result()
+        with self.assertRaises(RuntimeError):
+            next_batch.result()
+        self.assertEqual(other_stream.result(), 'good')
+        pipeline.shutdown()
+
+    def test_failure_fails_the_batch_queued_behind_it(self):
+        """A batch waiting for the load of the previous batch of its key fails once that load fails"""
+        release = threading.Event()
+        loaded = []
+
+        def load(batch):
+            if batch == 'bad':
+                release.wait(5)
+                raise ValueError('load failed')
+            loaded.append(batch)
+            return batch
+
+        pipeline = FlushPipeline(stages=[('serialize', lambda batch: batch, 1), ('load', load, 2)],
+                                 max_inflight_batches=10)
+
+        failed = pipeline.submit('stream_a', 'bad')
+        next_batch = pipeline.submit('stream_a', 'good')
+        time.sleep(0.1)
+        self.assertFalse(next_batch.done())
+        release.set()
+
+        with self.assertRaises(ValueError):
+            failed.result()
+        with self.assertRaises(RuntimeError):
+            next_batch.result()
+        pipeline.shutdown()
+        self.assertEqual(loaded, [])
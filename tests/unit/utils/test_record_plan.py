@@ -0,0 +1,90 @@
+import unittest
+
+from singer_target_iomete.file_formats import csv_format
+from singer_target_iomete.utils import flattening
+from singer_target_iomete.utils.exceptions import PrimaryKeyNotFoundException
+from singer_target_iomete.utils.record_plan import RecordPlan
+
+
+class TestRecordPlan(unittest.TestCase):
+    """
+    Unit Tests
+    """
+
+    def setUp(self):
+        self.schema = {
+            "properties": {
+                "id": {"type": ["integer"]},
+                "c_str": {"type": ["null", "string"]},
+                "c_ts": {"type": ["null", "string"], "format": "date-time"},
+                "c_any": {"anyOf": [{"type": ["null", "string"], "format": "date"}, {"type": "null"}]},
+                "c_mixed": {"type": ["null", "object", "array"]},
+                "c_obj": {
+                    "type": ["null", "object"],
+                    "properties": {
+                        "key_1": {"type": ["null", "string"]},
+                        "nested": {"type": ["null", "object"], "properties": {"key_2": {"type": ["integer"]}}}
+                    }
+                }
+            }
+        }
+        self.records = [
+            {"id": 1, "c_str": "a", "c_ts": "2021-01-01T00:00:00", "c_mixed": "x",
+             "c_obj": {"key_1": "b", "nested": {"key_2": 2}}},
+            {"id": 0, "c_str": "", "c_mixed": None, "c_obj": None},
+            {"id": 2, "c_str": None, "c_mixed": [1, {"a": "ü"}], "c_obj": {"nested": 5, "extra": True}},
+            {"id": 3, "c_obj": {"key_1": {"deep": [1]}, "nested": {"key_2": {"too": "deep"}}}},
+            {"id": 4, "c_obj": "not an object", "unknown": 1}
+        ]
+
+    def test_rows_match_flattened_records(self):
+        """Columns read by the plan are the ones of flattening the whole record"""
+        for max_level in range(3):
+            flatten_schema = flattening.flatten_schema(self.schema, max_level=max_level)
+            record_plan = RecordPlan(self.schema, flatten_schema, ['id'], max_level)
+            encode_row = csv_format.row_encoder(flatten_schema)
+            for record in self.records:
+                self.assertEqual(encode_row(record_plan.row(record)),
+                                 bytes(csv_format.record_to_csv_line(record, flatten_schema, max_level) + '\n',
+                                       'UTF-8'),
+                                 f'max_level {max_level}, record {record}')
+
+    def test_primary_key_string(self):
+        """Primary keys are read from the record without flattening it"""
+        flatten_schema = flattening.flatten_schema(self.schema, max_level=1)
+
+        record_plan = RecordPlan(self.schema, flatten_schema, ['id', 'c_obj__key_1'], 1)
+        self.assertEqual(record_plan.primary_key_string({'id': 1, 'c_obj': {'key_1': 'b'}}), '1,b')
+        with self.assertRaises(PrimaryKeyNotFoundException):
+            record_plan.primary_key_string({'id': 1, 'c_obj': None})
+
+        # Primary key not in the schema
+        record_plan = RecordPlan(self.schema, flatten_schema, ['other_id'], 1)
+        self.assertEqual(record_plan.primary_key_string({'other_id': 5}), '5')
+        self.assertIsNone(RecordPlan(self.schema, flatten_schema, [], 1).primary_key_string({'id': 1}))
+
+    def test_primary_key(self):
+        """Compact primary keys are equal for the records with equal primary key strings"""
+        schema = {"properties": {"id": {"type": ["integer"]}, "c_str": {"type": ["null", "string"]},
+                                 "c_int_or_str": {"type": ["integer", "string"]}, "c_num": {"type": ["number"]}}}
+        flatten_schema = flattening.flatten_schema(schema)
+
+        self.assertEqual(RecordPlan(schema, flatten_schema, ['id']).primary_key({'id': 1}), 1)
+        self.assertEqual(RecordPlan(schema, flatten_schema, ['id', 'c_str']).primary_key({'id': 1, 'c_str': 'a,b'}),
+                         (1, 'a,b'))
+        self.assertIsNone(RecordPlan(schema, flatten_schema, []).primary_key({'id': 1}))
+
+        for key_property, values in [('c_int_or_str', [1, '1']), ('c_num', [1.5, '1.5']), ('id', [True, 'True'])]:
+            record_plan = RecordPlan(schema, flatten_schema, [key_property])
+            self.assertEqual(len({record_plan.primary_key({key_property: value}) for value in values}), 1)
+
+    def test_adjust_timestamps(self):
+        """Invalid values of the date typed properties are reset"""
+        record_plan = RecordPlan(self.schema, flattening.flatten_schema(self.schema), [])
+        record = {'id': 1, 'c_ts': '10000-01-01T00:00:00', 'c_any': 'not a date', 'c_str': 'not a date'}
+        record_plan.adjust_timestamps(record)
+
+        self.assertEqual(record, {'id': 1,
+                                  'c_ts': '9999-12-31 23:59:59.999999',
+                                  'c_any': '9999-12-31 23:59:59.999999',
+                                  'c_str': 'not a date'})
@@ -0,0 +1,53 @@
+import unittest
+
+from singer_target_iomete.utils import record_validator
+from singer_target_iomete.utils.record_validator import RecordValidator
+
+
+class TestRecordValidator(unittest.TestCase):
+    """
+    Unit Tests
+    """
+
+    def setUp(self):
+        self.schema = {
+            "properties": {
+                "id": {"type": ["integer"]},
+                "c_str": {"type": ["null", "string"], "maxLength": 3},
+                "c_date": {"type": ["null", "string"], "format": "date"},
+                "c_ts": {"type": ["null", "string"], "format": "date-time"}
+            }
+        }
+
+    def test_validate(self):
+        """Invalid records raise an exception"""
+        validator = RecordValidator(self.schema)
+        validator.validate({'id': 1, 'c_str': 'abc', 'c_date': '2021-01-01', 'c_ts': '2021-01-01 10:00:00'})
+
+        for invalid_record in [{'id': 'x'}, {'id': 1, 'c_str': 'abcd'}, {'id': 1, 'c_date': '2021-01-01 10:00:00'}]:
+            with self.assertRaises(Exception):
+                validator.validate(invalid_record)
+
+    def test_multiple_of_validated_with_decimals(self):
+        """multipleOf is checked with exact decimal arithmetic"""
+        validator = RecordValidator({"properties": {"c_num": {"type": ["number"], "multipleOf": 0.01}}})
+        validator.validate({'c_num': 0.29})
+
+        with self.assertRaises(Exception):
+            validator.validate({'c_num': 0.291})
+
+    def test_compiled_once_per_schema(self):
+        """Streams with the same schema share the compiled validator"""
+        self.assertIs(record_validator.compile_validator(self.schema),
+                      record_validator.compile_validator(dict(self.schema)))
+
+    def test_sample_rate(self):
+        """Only a fraction of the records is validated, starting with the first one"""
+        for (sample_rate, expected_validated) in [(1, 10), (0.5, 5), (0.25, 3), (0, 0)]:
+            validator = RecordValidator(self.schema, sample_rate)
+            validated = []
+            validator._validate = validated.append
+            for i in range(10):
+                validator.validate(i)
+            self.assertEqual(len(validated), expected_validated)
+            self.assertEqual(validated[:1], [0] if expected_validated else [])
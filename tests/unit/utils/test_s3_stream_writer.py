@@ -0,0 +1,117 @@
+import gzip
+import unittest
+
+import pyarrow.parquet
+
+from boto3.s3.transfer import TransferConfig
+
+import singer_target_iomete.file_formats.csv_format as csv
+import singer_target_iomete.file_formats.parquet_format as parquet
+
+from singer_target_iomete.utils.s3_stream_writer import S3StreamWriter, MIN_PART_SIZE
+
+
+class FakeS3Client:
+    """In memory S3 client with the upload calls of the writer"""
+
+    def __init__(self, fail_part: int = None):
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+        self.calls = []
+        self.fail_part = fail_part
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None, Config=None):
+        self.calls.append(('upload_fileobj', ExtraArgs))
+        self.objects[(bucket, key)] = fileobj.read()
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.calls.append(('create_multipart_upload', kwargs))
+        upload_id = f'upload_{len(self.uploads)}'
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber == self.fail_part:
+            raise IOError('Upload failed')
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': f'etag_{PartNumber}'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        self.objects[(Bucket, Key)] = b''.join(parts[part['PartNumber']] for part in MultipartUpload['Parts'])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted.append(UploadId)
+
+
+class TestS3StreamWriter(unittest.TestCase):
+    """
+    Unit Tests
+    """
+
+    def test_small_file_in_single_request(self):
+        """Files smaller than a part are uploaded from memory in a single request"""
+        s3_client = FakeS3Client()
+        with S3StreamWriter(s3_client, 'bucket', 'key', extra_args={'ACL': 'private'}) as writer:
+            writer.write(b'1,"a"\n')
+            writer.write(b'2,"b"\n')
+
+        self.assertEqual(writer.tell(), 12)
+        self.assertEqual(s3_client.objects, {('bucket', 'key'): b'1,"a"\n2,"b"\n'})
+        self.assertEqual(s3_client.calls, [('upload_fileobj', {'ACL': 'private'})])
+
+    def test_large_file_in_parts(self):
+        """Larger files are uploaded in parts of at least the minimum size, in order"""
+        s3_client = FakeS3Client()
+        chunk = b'x' * (1024 * 1024)
+        transfer_config = TransferConfig(multipart_threshold=1, multipart_chunksize=1)
+        for max_concurrency in [1, 3]:
+            with S3StreamWriter(s3_client, 'bucket', 'key', transfer_config, max_concurrency=max_concurrency) as writer:
+                for i in range(12):
+                    writer.write(bytes([i]) + chunk)
+
+            data = b''.join(bytes([i]) + chunk for i in range(12))
+            self.assertEqual(s3_client.objects, {('bucket', 'key'): data})
+            self.assertEqual(writer.part_size, MIN_PART_SIZE)
+
+        self.assertEqual(s3_client.calls, [('create_multipart_upload', {})] * 2)
+        self.assertEqual(s3_client.uploads, {})
+
+    def test_multipart_threshold(self):
+        """Files are buffered up to the multipart threshold, the next parts have the chunk size"""
+        s3_client = FakeS3Client()
+        transfer_config = TransferConfig(multipart_threshold=3 * MIN_PART_SIZE, multipart_chunksize=MIN_PART_SIZE)
+        with S3StreamWriter(s3_client, 'bucket', 'key', transfer_config) as writer:
+            writer.write(b'x' * 2 * MIN_PART_SIZE)
+            self.assertIsNone(writer._upload_id)
+            writer.write(b'x' * 2 * MIN_PART_SIZE)
+            writer.write(b'x' * MIN_PART_SIZE)
+
+        self.assertEqual(len(s3_client.objects[('bucket', 'key')]), 5 * MIN_PART_SIZE)
+    def test_abort_on_failure(self):
+        """Failed uploads are aborted and the error is raised"""
+        s3_client = FakeS3Client(fail_part=2)
+        chunk = b'x' * MIN_PART_SIZE
+        with self.assertRaises(IOError):
+            with S3StreamWriter(s3_client, 'bucket', 'key') as writer:
+                for _ in range(3):
+                    writer.write(chunk)
+
+        self.assertEqual(s3_client.aborted, ['upload_0'])
+        self.assertEqual(s3_client.objects, {})
+
+    def test_records_streamed_by_file_formats(self):
+        """CSV and Parquet files are written straight to the writer"""
+        schema = {'c_int': {'type': ['null', 'integer']}, 'c_str': {'type': ['null', 'string']}}
+        records = {1: {'c_int': 1, 'c_str': 'a'}, 2: {'c_int': 2}}
+        s3_client = FakeS3Client()
+
+        with S3StreamWriter(s3_client, 'bucket', 'csv') as writer:
+            csv.records_to_fileobj(records, schema, writer, compression='gzip', compression_threads=2)
+        with S3StreamWriter(s3_client, 'bucket', 'parquet') as writer:
+            parquet.records_to_fileobj(records, schema, writer, compression='snappy')
+
+        self.assertEqual(gzip.decompress(s3_client.objects[('bucket', 'csv')]), b'1,"a"\n2,\n')
+        table = pyarrow.parquet.read_table(pyarrow.BufferReader(s3_client.objects[('bucket', 'parquet')]))
+        self.assertEqual(table.column('C_STR').to_pylist(), ['a', None])
@@ -0,0 +1,53 @@
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from singer_target_iomete.utils import s3_upload_client
+
+
+class TestS3UploadClient(unittest.TestCase):
+    """
+    Unit Tests
+    """
+
+    def test_create_client_config(self):
+        """Connection pool is sized for the parallel uploads by default"""
+        client_config = s3_upload_client.create_client_config({})
+        self.assertEqual(client_config.max_pool_connections, s3_upload_client.DEFAULT_MAX_POOL_CONNECTIONS)
+        self.assertFalse(getattr(client_config, 'tcp_keepalive', False))
+
+        client_config = s3_upload_client.create_client_config({'s3_max_pool_connections': 8, 's3_tcp_keepalive': True})
+        self.assertEqual(client_config.max_pool_connections, 8)
+        self.assertTrue(client_config.tcp_keepalive)
+
+    def test_create_transfer_config(self):
+        """Only the configured transfer options override the boto3 defaults"""
+        default_config = s3_upload_client.create_transfer_config({})
+        transfer_config = s3_upload_client.create_transfer_config({'s3_multipart_threshold': 64 * 1024 * 1024,
+                                                                   's3_multipart_chunksize': 32 * 1024 * 1024,
+                                                                   's3_max_concurrency': 4})
+
+        self.assertEqual(transfer_config.multipart_threshold, 64 * 1024 * 1024)
+        self.assertEqual(transfer_config.multipart_chunksize, 32 * 1024 * 1024)
+        self.assertEqual(transfer_config.max_concurrency, 4)
+        self.assertEqual(transfer_config.max_io_queue, default_config.max_io_queue)
+
+    @patch('singer_target_iomete.utils.s3_upload_client.create_s3_client')
+    def test_get_s3_client(self, create_s3_client_patch):
+        """One S3 client is created per credentials, endpoint and region and shared by every stream"""
+        create_s3_client_patch.side_effect = lambda config: object()
+        config = {'aws_access_key_id': 'shared-key', 'aws_secret_access_key': 'secret', 's3_region_name': 'eu-west-1'}
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            clients = list(executor.map(s3_upload_client.get_s3_client, [dict(config) for _ in range(32)]))
+        upload_client = s3_upload_client.S3UploadClient(dict(config, s3_bucket='bucket', s3_key_prefix='other/'))
+
+        self.assertEqual(create_s3_client_patch.call_count, 1)
+        self.assertTrue(all(client is clients[0] for client in clients))
+        self.assertIs(upload_client.s3_client, clients[0])
+
+        # Other region or credentials get their own client
+        self.assertIsNot(s3_upload_client.get_s3_client(dict(config, s3_region_name='us-east-1')), clients[0])
+        self.assertIsNot(s3_upload_client.get_s3_client(dict(config, aws_secret_access_key='other')), clients[0])
+        self.assertEqual(create_s3_client_patch.call_count, 3)
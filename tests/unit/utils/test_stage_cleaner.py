@@ -0,0 +1,79 @@
+import threading
+import unittest
+
+from unittest.mock import patch
+
+from singer_target_iomete.utils import stage_cleaner
+from singer_target_iomete.utils.stage_cleaner import StageCleaner
+
+
+class FakeS3Client:
+    """Records the delete_objects requests, fails the keys in failing the given number of times"""
+
+    def __init__(self, failing=None, raise_first=False):
+        self.requests = []
+        self.deleted = []
+        self.failing = dict(failing or {})
+        self.raise_first = raise_first
+        self.lock = threading.Lock()
+
+    def delete_objects(self, Bucket, Delete):
+        with self.lock:
+            keys = [obj['Key'] for obj in Delete['Objects']]
+            self.requests.append(keys)
+            if self.raise_first:
+                self.raise_first = False
+                raise IOError('Connection reset')
+
+            errors = []
+            for key in keys:
+                if self.failing.get(key, 0) > 0:
+                    self.failing[key] -= 1
+                    errors.append({'Key': key, 'Code': 'InternalError', 'Message': 'Try again'})
+                else:
+                    self.deleted.append(key)
+            return {'Errors': errors} if errors else {}
+
+
+class TestStageCleaner(unittest.TestCase):
+    """
+    Unit Tests
+    """
+
+    def test_deletes_in_batches(self):
+        """Queued keys are deleted in requests of at most 1000 keys and drained at close"""
+        s3_client = FakeS3Client()
+        cleaner = StageCleaner(s3_client, 'bucket')
+        keys = [f'key_{i}' for i in range(2500)]
+        for key in keys:
+            cleaner.delete(key)
+        cleaner.close()
+
+        self.assertEqual(sorted(s3_client.deleted), sorted(keys))
+        self.assertTrue(all(len(request) <= stage_cleaner.MAX_KEYS_PER_REQUEST for request in s3_client.requests))
+
+    @patch('singer_target_iomete.utils.stage_cleaner.LOGGER')
+    def test_retries_failed_keys(self, logger_patch):
+        """Failed keys and failed requests are retried up to the max attempts"""
+        s3_client = FakeS3Client(failing={'key_1': 1, 'key_2': 5}, raise_first=True)
+        cleaner = StageCleaner(s3_client, 'bucket', max_attempts=3, retry_delay_seconds=0)
+        for key in ['key_1', 'key_2', 'key_3']:
+            cleaner.delete(key)
+        cleaner.close()
+
+        self.assertEqual(sorted(s3_client.deleted), ['key_1', 'key_3'])
+        logger_patch.warning.assert_called_once()
+        self.assertEqual(logger_patch.warning.call_args.args[1], 'key_2')
+
+    def test_shared_cleaners(self):
+        """One cleaner per S3 client and bucket, closed at shutdown"""
+        s3_client = FakeS3Client()
+        cleaner = stage_cleaner.get_stage_cleaner(s3_client, 'bucket')
+        self.assertIs(stage_cleaner.get_stage_cleaner(s3_client, 'bucket'), cleaner)
+        self.assertIsNot(stage_cleaner.get_stage_cleaner(s3_client, 'other_bucket'), cleaner)
+
+        cleaner.delete('key_1')
+        stage_cleaner.close_stage_cleaners()
+        self.assertEqual(s3_client.deleted, ['key_1'])
+        self.assertIsNot(stage_cleaner.get_stage_cleaner(s3_client, 'bucket'), cleaner)
+        stage_cleaner.close_stage_cleaners()
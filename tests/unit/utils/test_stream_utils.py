@@ -116,6 +116,18 @@ class TestSchemaUtils(unittest.TestCase):
         with self.assertRaises(UnexpectedValueTypeException):
             stream_utils.adjust_timestamps_in_record(record, schema)
 
+    def test_is_valid_timestamp(self):
+        """Fast checked timestamps agree with dateutil"""
+        valid_values = ['2030-01-22', '2021-04-06T10:11:12', '2021-04-06 10:11:12.123456', '2021-04-06T10:11:12Z',
+                        '2021-04-06T10:11:12.5+02:00', '2021-04-06T10:11:12-0530', '2021-04-06T10:11', '10:11:12',
+                        '23:59:59.999999', 'Tue, 06 Apr 2021 10:11:12 GMT', '2021/04/06']
+        invalid_values = ['10000-01-22 12:04:22', '25:01:01', '2021-02-30', '2021-13-01T00:00:00', 'not a date', '']
+
+        for value in valid_values:
+            self.assertTrue(stream_utils.is_valid_timestamp(value), value)
+        for value in invalid_values:
+            self.assertFalse(stream_utils.is_valid_timestamp(value), value)
+
     def test_float_to_decimal(self):
         """Test if float values are converted to singer compatible Decimal types"""
         # Simple numeric value